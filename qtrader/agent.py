@@ -1,40 +1,33 @@
-from os.path import join, dirname
-from random import random, choice
+from os.path import basename, dirname, exists, join
 import logging
-from sys import argv, stdout
-import time
+from sys import argv
 from collections import defaultdict
+from functools import partial
 import pickle
 import pprint
+from shutil import copyfile
 
-from numpy import isnan
-from pandas import read_csv
+from numpy import isnan, full, nan, zeros, concatenate, log, log1p, sign, clip, tanh, floor, arange, atleast_2d
 from bintrees import FastRBTree
 
 from environment import Agent, Environment
+from vec_environment import VecEnvironment
 from simulator import Simulator
 import translators
 import preprocess
+import async_logging
+from async_logging import LazyFormat
+import instrument
+import state_space
+import replay
+from run_cache import RunCache, get_run_key, seed_all
+from simulator import get_nvisits_fname
 
 DEBUG = True
 BASE_DIR = dirname(dirname(__file__))
 
 
-# setup logging messages
-if DEBUG:
-    s_format = '%(asctime)s;%(message)s'
-    s_now = time.strftime('%c')
-    s_now = s_now.replace('/', '').replace(' ', '_').replace(':', '')
-    s_file = 'log/train_test/sim_{}.log'.format(s_now)
-    logging.basicConfig(filename=s_file, format=s_format)
-    root = logging.getLogger()
-    root.setLevel(logging.DEBUG)
-    ch = logging.StreamHandler(stdout)
-    ch.setLevel(logging.DEBUG)
-
-    formatter = logging.Formatter(s_format)
-    ch.setFormatter(formatter)
-    root.addHandler(ch)
+root = logging.getLogger()
 
 
 '''
@@ -58,12 +51,13 @@ class BasicAgent(Agent):
     '''
     A Basic agent representation that learns to drive in the smartcab world.
     '''
-    actions_to_open = [None, 'BEST_BID', 'BEST_OFFER', 'BEST_BOTH']
-    actions_to_close_when_short = [None, 'BEST_BID']
-    actions_to_close_when_long = [None, 'BEST_OFFER']
-    actions_to_stop_when_short = [None, 'BEST_BID', 'BUY']
-    actions_to_stop_when_long = [None, 'BEST_OFFER', 'SELL']
+    actions_to_open = state_space.ACTIONS_TO_OPEN
+    actions_to_close_when_short = state_space.ACTIONS_TO_CLOSE_WHEN_SHORT
+    actions_to_close_when_long = state_space.ACTIONS_TO_CLOSE_WHEN_LONG
+    actions_to_stop_when_short = state_space.ACTIONS_TO_STOP_WHEN_SHORT
+    actions_to_stop_when_long = state_space.ACTIONS_TO_STOP_WHEN_LONG
     FROZEN_POLICY = False
+    USE_SCALER = True
 
     def __init__(self, env, i_id, f_min_time=3600.):
         '''
@@ -79,12 +73,19 @@ class BasicAgent(Agent):
         self.next_time = 0.
         self.max_pos = 100.
         # self.scaler = preprocess.ClusterScaler()
-        self.scaler = preprocess.LessClustersScaler()
+        self.scaler = None
+        if self.USE_SCALER:
+            self.scaler = preprocess.LessClustersScaler()
         self.s_agent_name = 'BasicAgent'
         self.last_max_pnl = None
         self.f_delta_pnl = 0.  # defined at [-inf, 0)
         self.old_state = None
         self.last_action = None
+        self.f_total_reward = 0.
+        # the reward summed and the PnL seen by each update of the current
+        # session, used to rank the agents
+        self.f_session_reward = 0.
+        self.l_session_pnl = []
 
     def _freeze_policy(self):
         '''
@@ -108,6 +109,8 @@ class BasicAgent(Agent):
         self.d_order_map = {}
         # Reset any variables here, if required
         self.next_time = 0.
+        self.f_session_reward = 0.
+        self.l_session_pnl = []
 
     def should_update(self):
         '''
@@ -127,15 +130,27 @@ class BasicAgent(Agent):
         if not msg_env:
             if not self.should_update():
                 return None
+        b_timing = instrument.ENABLED
+        if b_timing:
+            f_t0 = instrument.clock()
+            instrument.STATS.count('agent_updates')
         # recover basic infos
         inputs = self.env.sense(self)
         state = self.env.agent_states[self]
 
         # Update state (position ,volume and if has an order in bid or ask)
         self.state = self._get_intern_state(inputs, state)
+        if b_timing:
+            f_t1 = instrument.clock()
+            instrument.STATS.add_time('agent.state', f_t1 - f_t0)
 
         # Select action according to the agent's policy
         l_msg = self._take_action(self.state, msg_env)
+        if b_timing:
+            f_t2 = instrument.clock()
+            instrument.STATS.add_time('agent.policy', f_t2 - f_t1)
+            if not msg_env:
+                instrument.STATS.count('agent_decisions')
 
         # # Execute action and get reward
         # print '\ncurrent action: {}\n'.format(action)
@@ -166,10 +181,19 @@ class BasicAgent(Agent):
                 s_action = 'BEST_BID'
             elif s_action == 'SELL':
                 s_action = 'BEST_OFFER'
+        if b_timing:
+            f_t3 = instrument.clock()
+            instrument.STATS.add_time('agent.execution', f_t3 - f_t2)
+        self.f_total_reward += reward
+        self.f_session_reward += reward
+        self.l_session_pnl.append(self.env.agent_states[self]['Pnl'])
         # Learn policy based on state, action, reward
         if not self.FROZEN_POLICY:
             # does not update if it is frozen
             self._apply_policy(self.state, s_action, reward)
+        if b_timing:
+            f_t4 = instrument.clock()
+            instrument.STATS.add_time('agent.learn', f_t4 - f_t3)
         # calculate the next time that the agent will react
         self.next_time = self.env.order_matching.last_date
         self.next_time += self.f_min_time
@@ -179,29 +203,37 @@ class BasicAgent(Agent):
         s_rtn = '{}.update(): time = {}, position = {}, inputs = {}, action'
         s_rtn += ' = {}, price_action = {}, pnl = {:0.2f}, delta_pnl = {:0.2f}'
         s_rtn += ', reward = {}'
-        inputs['midPrice'] = '{:0.2f}'.format(inputs['midPrice'])
+        inputs['midPrice'] = LazyFormat('{:0.2f}', inputs['midPrice'])
         # inputs['logret'] = '{:0.4f}%'.format(inputs['logret'] * 100)
         # inputs['deltaMid'] = '{:0.3f}'.format(inputs['deltaMid'])
         inputs.pop('deltaMid')
         inputs.pop('logret')
         inputs.pop('qAggr')
         inputs.pop('qTraded')
-        inputs['cluster'] = self.state['cluster']
+        inputs['cluster'] = self.state.get('cluster')
         # check the last maximum pnl considering just the current position
         f_delta_pnl = 0.
         f_pnl = self.env.agent_states[self]['Pnl']
         if self.env.agent_states[self]['Position'] == 0:
             self.last_max_pnl = None
         else:
+            if self.last_max_pnl is None:
+                self.last_max_pnl = f_pnl
             self.last_max_pnl = max(self.last_max_pnl,
                                     self.env.agent_states[self]['Pnl'])
             f_delta_pnl = f_pnl - self.last_max_pnl
             self.f_delta_pnl = f_delta_pnl
-        # Print inputs and agent state
+        # Print inputs and agent state. The message is formatted just when
+        # it is written
+        s_rtn = LazyFormat(s_rtn, self.s_agent_name, s_date, state['Position'], inputs, s_action2, l_prices_to_print, f_pnl, f_delta_pnl, reward)
         if DEBUG:
-            root.debug(s_rtn.format(self.s_agent_name, s_date, state['Position'], inputs, s_action2, l_prices_to_print, f_pnl, f_delta_pnl, reward))
+            root.debug(s_rtn)
         else:
-            print((s_rtn.format(self.s_agent_name, s_date, state['Position'], inputs, s_action2, l_prices_to_print, f_pnl, f_delta_pnl, reward)))
+            print(s_rtn)
+        if b_timing:
+            f_t5 = instrument.clock()
+            instrument.STATS.add_time('agent.logging', f_t5 - f_t4)
+            instrument.STATS.add_time('agent.update', f_t5 - f_t0)
 
     def _get_intern_state(self, inputs, state):
         '''
@@ -259,7 +291,7 @@ class BasicAgent(Agent):
         :param valid_actions: list. List of the allowed actions
         :param t_state: tuple. The inputs to be considered by the agent
         '''
-        return choice(valid_actions)
+        return self.rng.choice(valid_actions)
 
     def _translate_action(self, t_state, s_action):
         '''
@@ -283,7 +315,8 @@ class BasicAgent(Agent):
             return translators.translate_trades(idx, row, my_ordmatch, 'BID', i_id)
         # generate limit order or cancel everything
         else:
-            return translators.translate_to_agent(self, s_action, my_ordmatch, 0.01)  # 1 cent inside book
+            order_ids = self.env.get_order_ids(self)
+            return translators.translate_to_agent(self, s_action, my_ordmatch, 0.01, order_ids)  # 1 cent inside book
         return []
 
     def _apply_policy(self, state, action, reward):
@@ -314,10 +347,12 @@ class BasicLearningAgent(BasicAgent):
         super(BasicLearningAgent, self).__init__(env=env, i_id=i_id, f_min_time=f_min_time)
         # Initialize any additional variables here
         self.max_pos = 100.
-        self.q_table = defaultdict(lambda: defaultdict(float))
+        self.q_table = defaultdict(partial(defaultdict, float))
         self.f_gamma = f_gamma
         self.last_reward = None
         self.s_agent_name = 'BasicLearningAgent'
+        # action by (state index, valid set index) when policy is frozen
+        self.na_policy = None
 
     def _choose_an_action(self, d_state, valid_actions):
         '''
@@ -330,7 +365,7 @@ class BasicLearningAgent(BasicAgent):
         d_state['Position'] = float(d_state['Position'])
         # set a random action in case of exploring world
         max_val = 0.01
-        best_Action = choice(valid_actions)
+        best_Action = self.rng.choice(valid_actions)
         # arg max Q-value choosing a action better than zero
         for action, val in list(self.q_table[str(d_state)].items()):
             # if the agent is positioned, should check just what is allowed
@@ -388,20 +423,44 @@ class BasicLearningAgent(BasicAgent):
         Set up the q-table to be used in testing simulation and freeze policy
         :param s_fname: string. Path to the qtable to be used
         '''
-        # freeze policy
-        self._freeze_policy()
+        # pandas is imported just by the code paths that need it
+        from pandas import read_csv
         # load qtable and transform in a dictionary
         df_qtable = read_csv(s_fname, sep='\t', index_col=0)
-        for s_idx, row in df_qtable.iterrows():
-            for s_key, f_val in list(row.items()):
+        l_actions = list(df_qtable.columns)
+        # the None action is saved without a name, in any column
+        l_actions = [None if s_key.startswith('Unnamed: ') else s_key
+                     for s_key in l_actions]
+        self.set_qtable_values(l_states=list(df_qtable.index),
+                               l_actions=l_actions,
+                               na_values=df_qtable.values,
+                               s_fname=s_fname)
+
+    def set_qtable_values(self, l_states, l_actions, na_values, s_fname=''):
+        '''
+        Set up the q-table from an array of values and freeze policy
+        :param l_states: list. The states related to each row of na_values
+        :param l_actions: list. The actions related to each column of na_values
+        :param na_values: numpy array. Q-values. NaN where it was not observed
+        :*param s_fname: string. Path to the qtable used, just to log it
+        '''
+        # freeze policy
+        self._freeze_policy()
+        for s_idx, na_row in zip(l_states, na_values):
+            # states that were not visited by this table are skipped
+            if isnan(na_row).all():
+                continue
+            for s_key, f_val in zip(l_actions, na_row):
                 if not isnan(f_val):
-                    if s_key == 'Unnamed: 1':
-                        s_key = None
                     self.q_table[s_idx][s_key] = f_val
             # fill stop actions to be desirable over any other action
             for s_key in ['BUY', 'SELL']:
                 f_val = self.q_table[s_idx][s_key]
                 self.q_table[s_idx][s_key] = max(f_val, 0.)
+        # the frozen policy does not change, so precompute every decision
+        na_qtable = state_space.qtable_to_array(self.q_table)
+        na_ranks = state_space.qtable_to_ranks(self.q_table, na_qtable.shape[0])
+        self.na_policy = state_space.compile_frozen_policy(na_qtable, na_ranks)
         # log file used
         s_print = '{}.set_qtable(): Setting up the agent to use'
         s_print = s_print.format(self.s_agent_name)
@@ -438,12 +497,15 @@ class LearningAgent_k(BasicLearningAgent):
         :param valid_actions: list. List of the allowed actions
         :param t_state: tuple. The inputs to be considered by the agent
         '''
+        # a frozen policy is just a lookup in the compiled policy
+        if self.FROZEN_POLICY and self.na_policy is not None:
+            return self._choose_compiled_action(t_state, valid_actions)
         # set a random action in case of exploring world
         max_val = 0.01
         cum_prob = 1.
         f_count = 0.
         f_prob = 0.
-        best_Action = choice(valid_actions)
+        best_Action = self.rng.choice(valid_actions)
         # if the policy is frozen and the agent didnt observed the state
         # previously, do nothing (or close out its positions)
         if self.FROZEN_POLICY:
@@ -475,26 +537,45 @@ class LearningAgent_k(BasicLearningAgent):
             f_prob = 1.
         # print 'PROB: {:.2f}'.format(f_prob)
         # choose the best_action just if: eps <= k**thisQhat / sum(k**Qhat)
-        if (random() <= f_prob):
-            s_print = '{}.choose_an_action(): '.format(self.s_agent_name)
-            s_aux = 'action = explotation, gamma = {}, k = {}'
-            s_print += s_aux.format(self.f_gamma, self.f_k)
-            s_print += ', prob: {:0.2f}'.format(f_prob)
+        if (self.rng.random() <= f_prob):
+            s_print = '{}.choose_an_action(): '
+            s_print += 'action = explotation, gamma = {}, k = {}'
+            s_print += ', prob: {:0.2f}'
+            s_print = LazyFormat(s_print, self.s_agent_name, self.f_gamma,
+                                 self.f_k, f_prob)
             if DEBUG:
                 root.debug(s_print)
             else:
                 print(s_print)
             return best_Action
         else:
-            s_print = '{}.choose_an_action(): '.format(self.s_agent_name)
-            s_aux = 'action = exploration, gamma = {}, k = {}'
-            s_print += s_aux.format(self.f_gamma, self.f_k)
-            s_print += ', prob: {:0.2f}'.format(f_prob)
+            s_print = '{}.choose_an_action(): '
+            s_print += 'action = exploration, gamma = {}, k = {}'
+            s_print += ', prob: {:0.2f}'
+            s_print = LazyFormat(s_print, self.s_agent_name, self.f_gamma,
+                                 self.f_k, f_prob)
             if DEBUG:
                 root.debug(s_print)
             else:
                 print(s_print)
-            return choice(valid_actions)
+            return self.rng.choice(valid_actions)
+
+    def _choose_compiled_action(self, t_state, valid_actions):
+        '''
+        Return the action of the frozen policy compiled by set_qtable()
+        :param t_state: dictionary. The inputs to be considered by the agent
+        :param valid_actions: list. List of the allowed actions
+        '''
+        i_state = state_space.state_to_index(t_state)
+        if i_state < self.na_policy.shape[0]:
+            i_set = state_space.get_valid_set_index(valid_actions)
+            return state_space.ACTIONS[self.na_policy[i_state, i_set]]
+        # never observed: do nothing (or close out its positions)
+        if 'BUY' in valid_actions:
+            return 'BUY'
+        elif 'SELL' in valid_actions:
+            return 'SELL'
+        return None
 
 
 class LearningAgent(LearningAgent_k):
@@ -516,7 +597,7 @@ class LearningAgent(LearningAgent_k):
         super(LearningAgent, self).__init__(env=env, i_id=i_id, f_min_time=f_min_time, f_gamma=f_gamma, f_k=f_k)
         # Initialize any additional variables here
         self.s_agent_name = 'LearningAgent'
-        self.nvisits_table = defaultdict(lambda: defaultdict(float))
+        self.nvisits_table = defaultdict(partial(defaultdict, float))
 
     def _apply_policy(self, state, action, reward):
         '''
@@ -559,31 +640,364 @@ class LearningAgent(LearningAgent_k):
             self.q_table[s_aux][self.last_action] = self.last_reward
 
 
-def run(s_option, filename):
+class ReplayLearningAgent(LearningAgent):
+    '''
+    A LearningAgent that keeps the transitions observed in a replay buffer and
+    learns from mini-batches sampled from it, so each simulated decision is
+    used to update the Q-table more than once
+    '''
+
+    def __init__(self, env, i_id, f_min_time=3600., f_gamma=0.5, f_k=0.8,
+                 i_buffer_size=10000, i_batch_size=32, i_replay_every=1,
+                 i_seed=None):
+        '''
+        Initialize a ReplayLearningAgent. Save all parameters as attributes
+        :param env: Environment object. The grid-like world
+        :*param f_gamma: float. weight of delayed versus immediate rewards
+        :*param f_k: float. How strongly should favor high Q-hat values
+        :*param i_buffer_size: integer. Maximum number of transitions kept
+        :*param i_batch_size: integer. Transitions used by each update
+        :*param i_replay_every: integer. Decisions between each update
+        :*param i_seed: integer. Seed used to sample the transitions. Drawn
+            from the random numbers of the agent if None
+        '''
+        super(ReplayLearningAgent, self).__init__(env=env, i_id=i_id, f_min_time=f_min_time, f_gamma=f_gamma, f_k=f_k)
+        self.s_agent_name = 'ReplayLearningAgent'
+        if i_seed is None:
+            i_seed = self.rng.randint(0, 2 ** 32 - 1)
+        self.replay_buffer = replay.ReplayBuffer(i_buffer_size, i_seed)
+        self.i_batch_size = i_batch_size
+        self.i_replay_every = i_replay_every
+        self.i_ntransitions = 0
+        # dense Q-table and visits to each (s, a), not counting the replays.
+        # The source of the values in the q_table and in the nvisits_table
+        i_nstates = state_space.N_SUBSTATES
+        i_nactions = len(state_space.ACTIONS)
+        self.na_qtable = full((i_nstates, i_nactions), nan)
+        self.na_nvisits = zeros((i_nstates, i_nactions))
+        self.d_state_keys = {}
+
+    def _get_state_index(self, state):
+        '''
+        Return the row of the state in the dense Q-table, growing it if needed
+        :param state: dictionary. The intern state of the agent
+        '''
+        i_idx = state_space.state_to_index(state)
+        self.d_state_keys[i_idx] = str(state)
+        i_nrows = self.na_qtable.shape[0]
+        if i_idx >= i_nrows:
+            i_new = (i_idx // state_space.N_SUBSTATES + 1)
+            i_new *= state_space.N_SUBSTATES
+            i_new -= i_nrows
+            i_nactions = self.na_qtable.shape[1]
+            self.na_qtable = concatenate([self.na_qtable, full((i_new, i_nactions), nan)])
+            self.na_nvisits = concatenate([self.na_nvisits, zeros((i_new, i_nactions))])
+        return i_idx
+
+    def _apply_policy(self, state, action, reward):
+        '''
+        Learn policy based on state, action, reward
+        :param state: dictionary. The current state of the agent
+        :param action: string. the action selected at this time
+        :param reward: integer. the rewards received due to the action
+        '''
+        i_state = self._get_state_index(state)
+        # check if there is some state in cache
+        if self.old_state:
+            i_old = self._get_state_index(self.old_state)
+            i_action = state_space.get_action_index(self.last_action)
+            self.replay_buffer.add(i_old, i_action, self.last_reward, i_state)
+            self.i_ntransitions += 1
+            # the visits count the transitions observed, not the replayed
+            self.na_nvisits[i_old, i_action] += 1
+            s_aux = str(self.old_state)
+            f_visits = self.na_nvisits[i_old, i_action]
+            self.nvisits_table[s_aux][self.last_action] = f_visits
+            if self.i_ntransitions % self.i_replay_every == 0:
+                t_batch = self.replay_buffer.sample(self.i_batch_size)
+                na_s, na_a, na_r, na_s2 = t_batch
+                replay.batch_q_update(self.na_qtable, self.na_nvisits, na_s,
+                                      na_a, na_r, na_s2, self.f_gamma)
+                # keep the tables used to choose actions in sync
+                for i_s, i_a in set(zip(na_s, na_a)):
+                    s_state = self.d_state_keys[i_s]
+                    s_action = state_space.ACTIONS[i_a]
+                    self.q_table[s_state][s_action] = self.na_qtable[i_s, i_a]
+        # save current state, action and reward to use in the next run
+        # apply s <- s'
+        self.old_state = state
+        self.last_action = action
+        self.last_reward = reward
+        # make sure that the current state has at least the current reward
+        if not self.q_table[str(self.old_state)][self.last_action]:
+            s_aux = str(self.old_state)
+            self.q_table[s_aux][self.last_action] = self.last_reward
+            i_action = state_space.get_action_index(self.last_action)
+            self.na_qtable[i_state, i_action] = self.last_reward
+
+
+class SharedLearningAgent(LearningAgent):
+    '''
+    A LearningAgent whose Q-table and visit counts live in shared memory, so
+    many actor processes can learn the same policy at the same time
+    '''
+
+    def __init__(self, env, i_id, shared_qtable, f_min_time=3600.,
+                 f_gamma=0.5, f_k=0.8):
+        '''
+        Initialize a SharedLearningAgent. Save all parameters as attributes
+        :param env: Environment object. The grid-like world
+        :param shared_qtable: SharedQTable object. The Q-table to be updated
+        :*param f_gamma: float. weight of delayed versus immediate rewards
+        :*param f_k: float. How strongly should favor high Q-hat values
+        '''
+        super(SharedLearningAgent, self).__init__(env=env, i_id=i_id, f_min_time=f_min_time, f_gamma=f_gamma, f_k=f_k)
+        self.s_agent_name = 'SharedLearningAgent'
+        self.shared_qtable = shared_qtable
+        self.q_table = shared_qtable.get_qtable_view()
+        self.nvisits_table = shared_qtable.get_nvisits_view()
+
+    def _apply_policy(self, state, action, reward):
+        '''
+        Learn policy based on state, action, reward
+        :param state: dictionary. The current state of the agent
+        :param action: string. the action selected at this time
+        :param reward: integer. the rewards received due to the action
+        '''
+        # there is no transition to learn from before the first decision
+        if not self.old_state:
+            self.old_state = state
+            self.last_action = action
+            self.last_reward = reward
+            return
+        # lock the states changed, so other actors do not interleave with it
+        l_locks = self.shared_qtable.get_locks([self.old_state, state])
+        for lock in l_locks:
+            lock.acquire()
+        try:
+            super(SharedLearningAgent, self)._apply_policy(state, action, reward)
+        finally:
+            for lock in reversed(l_locks):
+                lock.release()
+
+
+class LinearLearningAgent(BasicAgent):
+    '''
+    A representation of an agent that learns a linear Q-function directly
+    over the inputs sensed from the environment and its position, without
+    discretizing them in clusters. Optionally, tile coding is applied to the
+    order flow and book ratio inputs
+    '''
+    USE_SCALER = False
+    l_features = ['bias', 'qOfi', 'qAggr', 'qTraded', 'spread', 'bookRatio',
+                  'logret', 'Position', 'best_bid', 'best_offer']
+
+    def __init__(self, env, i_id, f_min_time=3600., f_gamma=0.5,
+                 f_alpha=0.01, f_epsilon=0.1, i_tilings=0, i_tiles=8):
+        '''
+        Initialize a LinearLearningAgent. Save all parameters as attributes
+        :param env: Environment object. The grid-like world
+        :*param f_gamma: float. weight of delayed versus immediate rewards
+        :*param f_alpha: float. Learning rate of the weights
+        :*param f_epsilon: float. Probability of exploring a random action
+        :*param i_tilings: integer. Number of tilings. No tile coding if 0
+        :*param i_tiles: integer. Tiles by dimension in each tiling
+        '''
+        super(LinearLearningAgent, self).__init__(env=env, i_id=i_id, f_min_time=f_min_time)
+        self.s_agent_name = 'LinearLearningAgent'
+        self.f_gamma = f_gamma
+        self.f_alpha = f_alpha
+        self.f_epsilon = f_epsilon
+        self.i_tilings = i_tilings
+        self.i_tiles = i_tiles
+        self.last_reward = None
+        self.l_weights_names = list(self.l_features)
+        for i_tiling in range(i_tilings):
+            for i_tile in range(i_tiles ** 2):
+                self.l_weights_names.append('tile_{}_{}'.format(i_tiling, i_tile))
+        self.na_weights = zeros((len(self.l_weights_names),
+                                 len(state_space.ACTIONS)))
+
+    @property
+    def q_table(self):
+        '''
+        Return the weights by feature and action in the same shape of the
+        Q-tables, so they are saved and loaded by the same code
+        '''
+        return dict((s_feat, dict(zip(state_space.ACTIONS, na_row)))
+                    for s_feat, na_row in zip(self.l_weights_names,
+                                              self.na_weights))
+
+    def _get_intern_state(self, inputs, state):
+        '''
+        Return a dcitionary representing the intern state of the agent
+        :param inputs: dictionary. inputs sensed from the environment
+        :param state: dictionary. the current position of the agent
+        '''
+        d_rtn = {}
+        for s_key in ['qOfi', 'qAggr', 'qTraded', 'spread', 'logret']:
+            d_rtn[s_key] = float(inputs[s_key])
+        d_rtn['bookRatio'] = inputs['qBid'] * 1. / inputs['qAsk']
+        d_rtn['Position'] = float(state['Position'])
+        d_rtn['best_bid'] = state['best_bid']
+        d_rtn['best_offer'] = state['best_offer']
+        return d_rtn
+
+    def get_features(self, l_states):
+        '''
+        Return an array with shape (n_states, n_weights) with the features
+        of each state passed, scaled to similar ranges
+        :param l_states: list. The intern states of the agent
+        '''
+        na_raw = atleast_2d([[d_state[s_key] for s_key in self.l_features[1:]]
+                             for d_state in l_states]).astype(float)
+        na_rtn = zeros((na_raw.shape[0], len(self.l_weights_names)))
+        na_rtn[:, 0] = 1.
+        na_rtn[:, 1] = sign(na_raw[:, 0]) * log1p(abs(na_raw[:, 0])) / 10.
+        na_rtn[:, 2] = sign(na_raw[:, 1]) * log1p(abs(na_raw[:, 1])) / 10.
+        na_rtn[:, 3] = log1p(abs(na_raw[:, 2])) / 10.
+        na_rtn[:, 4] = clip(na_raw[:, 3], 0., 10.) / 10.
+        na_rtn[:, 5] = clip(log(na_raw[:, 4]), -5., 5.) / 5.
+        na_rtn[:, 6] = clip(na_raw[:, 5] * 100., -1., 1.)
+        na_rtn[:, 7] = na_raw[:, 6] / self.max_pos
+        na_rtn[:, 8] = na_raw[:, 7]
+        na_rtn[:, 9] = na_raw[:, 8]
+        if self.i_tilings:
+            na_rtn[:, len(self.l_features):] = self._tile_code(na_rtn[:, [1, 5]])
+        return na_rtn
+
+    def _tile_code(self, na_x):
+        '''
+        Return the one-hot tile coding of bidimensional inputs, with shape
+        (n_states, i_tilings * i_tiles ** 2)
+        :param na_x: numpy array. inputs with shape (n_states, 2)
+        '''
+        i_tiles = self.i_tiles
+        # squash the inputs to [0, 1)
+        na_x = (tanh(na_x) + 1.) / 2. * (1. - 1e-9)
+        na_rtn = zeros((na_x.shape[0], self.i_tilings * i_tiles ** 2))
+        na_rows = arange(na_x.shape[0])
+        for i_tiling in range(self.i_tilings):
+            # each tiling is shifted by a fraction of the tile width
+            f_offset = i_tiling * 1. / (self.i_tilings * i_tiles)
+            na_idx = floor((na_x + f_offset) * i_tiles).astype(int)
+            na_idx = clip(na_idx, 0, i_tiles - 1)
+            na_col = na_idx[:, 0] * i_tiles + na_idx[:, 1]
+            na_rtn[na_rows, i_tiling * i_tiles ** 2 + na_col] = 1.
+        return na_rtn
+
+    def q_values(self, na_features):
+        '''
+        Return the Q-values of each action to a batch of states, with shape
+        (n_states, n_actions)
+        :param na_features: numpy array. Returned by get_features()
+        '''
+        return na_features.dot(self.na_weights)
+
+    def _choose_an_action(self, d_state, valid_actions):
+        '''
+        Return an action from a list of allowed actions according to the
+        agent policy
+        :param valid_actions: list. List of the allowed actions
+        :param d_state: dictionary. The inputs to be considered by the agent
+        '''
+        if not self.FROZEN_POLICY and self.rng.random() < self.f_epsilon:
+            return self.rng.choice(valid_actions)
+        na_q = self.q_values(self.get_features([d_state]))[0]
+        l_idx = [state_space.get_action_index(s_action)
+                 for s_action in valid_actions]
+        i_best = max(l_idx, key=lambda i_idx: na_q[i_idx])
+        return state_space.ACTIONS[i_best]
+
+    def _apply_policy(self, state, action, reward):
+        '''
+        Learn policy based on state, action, reward
+        :param state: dictionary. The current state of the agent
+        :param action: string. the action selected at this time
+        :param reward: integer. the rewards received due to the action
+        '''
+        if self.old_state:
+            # apply: w_a <- w_a + alpha [r + y max_a' Q(s', a') - Q(s, a)] phi
+            na_phi = self.get_features([self.old_state, state])
+            na_q = self.q_values(na_phi)
+            i_action = state_space.get_action_index(self.last_action)
+            f_delta = self.last_reward + self.f_gamma * na_q[1].max()
+            f_delta -= na_q[0, i_action]
+            self.na_weights[:, i_action] += self.f_alpha * f_delta * na_phi[0]
+        # save current state, action and reward to use in the next run
+        self.old_state = state
+        self.last_action = action
+        self.last_reward = reward
+
+    def set_qtable(self, s_fname):
+        '''
+        Set up the weights to be used in testing simulation and freeze policy
+        :param s_fname: string. Path to the weights saved as a qtable
+        '''
+        from pandas import read_csv
+        self._freeze_policy()
+        df_weights = read_csv(s_fname, sep='\t', index_col=0)
+        for s_key in df_weights.columns:
+            s_action = None if s_key.startswith('Unnamed') else s_key
+            i_action = state_space.get_action_index(s_action)
+            for i_feat, s_feat in enumerate(self.l_weights_names):
+                if s_feat in df_weights.index:
+                    f_val = df_weights.at[s_feat, s_key]
+                    if not isnan(f_val):
+                        self.na_weights[i_feat, i_action] = f_val
+        # log file used
+        s_print = '{}.set_qtable(): Setting up the agent to use'
+        s_print = s_print.format(self.s_agent_name)
+        s_print += ' the weights at {}'.format(s_fname)
+        if DEBUG:
+            root.debug(s_print)
+        else:
+            print(s_print)
+
+
+def run(s_option, filename, b_resume=False):
     """
     Run the agent for a finite number of trials.:
     :param s_option: string. The type of the test
     :filename_option: string. Hisotyr data filename ithout extension
+    :*param b_resume: boolean. If the training should continue from the
+        checkpoint left by a run that was stopped
     """
     i_idx = 15  # 15  # index of the start file to be used in simulations
     n_trials = 10  # number of repetitions of the same sessions
     n_sessions = 1  # number of different days traded
+    i_seed = 0  # seed of the random numbers used by the agents
+    seed_all(i_seed)
     # Set up environment
     s_fname = join(BASE_DIR, "data", filename + ".zip")
-    e = Environment(s_fname=s_fname, i_idx=i_idx)
+    e = Environment(s_fname=s_fname, i_idx=i_idx, i_seed=i_seed)
     # create agent
     if s_option in ["train_learner", "test_learner", "optimize_k", "optimize_gamma"]:
-        a = e.create_agent(LearningAgent_k, f_min_time=2., f_k=0.8, f_gamma=0.5)
+        d_kwargs = {'f_min_time': 2., 'f_k': 0.8, 'f_gamma': 0.5}
+        a = e.create_agent(LearningAgent_k, **d_kwargs)
     elif s_option == "test_random":
-        a = e.create_agent(BasicAgent, f_min_time=2.)
+        d_kwargs = {'f_min_time': 2.}
+        a = e.create_agent(BasicAgent, **d_kwargs)
+    elif s_option in ["train_linear", "test_linear"]:
+        d_kwargs = {'f_min_time': 2., 'f_gamma': 0.5, 'i_tilings': 4}
+        a = e.create_agent(LinearLearningAgent, **d_kwargs)
+    elif s_option in ["test_learner_batch", "test_learner_batch_oos"]:
+        # one replica by qtable saved in training, all on the same book
+        e = VecEnvironment(s_fname=s_fname, i_idx=i_idx, i_seed=i_seed)
+        for i_trial in range(n_trials):
+            a = e.add_replica(LearningAgent_k, f_min_time=2., f_k=0.8, f_gamma=0.5)
     else:
-        l_aux = ["train_learner", "test_learner", "test_random", "optimize_k", "optimize_gamma"]
+        l_aux = ["train_learner", "test_learner", "test_random", "optimize_k", "optimize_gamma", "test_learner_batch", "test_learner_batch_oos", "train_linear", "test_linear"]
         s_err = "Select an <OPTION> between: \n{}".format(l_aux)
         raise InvalidOptionException(s_err)
     e.set_primary_agent(a)  # specify agent to track
 
     # set up the simulation object
-    sim = Simulator(e, update_delay=1.00, display=False)
+    # the state is saved from time to time, so a training that stops can be
+    # resumed
+    s_checkpoint = 'log/checkpoint/{}.pkl'.format(s_option)
+    sim = Simulator(e, update_delay=1.00, display=False,
+                    s_checkpoint=s_checkpoint)
 
     if 'train' in s_option:
         # ==== IN-SAMPLE TEST ====
@@ -594,8 +1008,36 @@ def run(s_option, filename):
         else:
             print(s_print)
 
-        # run for a specified number of trials
-        sim.train(n_trials=n_trials, n_sessions=n_sessions)
+        # run for a specified number of trials. An identical training done
+        # before just restores the Q-tables it saved
+        cache = RunCache('log/run_cache')
+        d_key = {'option': s_option, 'agent': a.__class__.__name__,
+                 'agent_kwargs': d_kwargs, 'idx': i_idx, 'n_trials': n_trials,
+                 'n_sessions': n_sessions, 'seed': i_seed}
+        s_key = get_run_key(s_fname, d_key)
+        d_hit = cache.get(s_key)
+        if d_hit:
+            for s_cached in d_hit['files']:
+                copyfile(s_cached, join('log/qtable', basename(s_cached)))
+            s_print = 'run(): Training restored from the cache ({})'
+            s_print = s_print.format(s_key[:16])
+            if DEBUG:
+                root.debug(s_print)
+            else:
+                print(s_print)
+        else:
+            sim.train(n_trials=n_trials, n_sessions=n_sessions,
+                      b_resume=b_resume)
+            l_files = []
+            for i_trial in range(n_trials):
+                s_qtable = 'log/qtable/{}_qtable_{}.log'
+                s_qtable = s_qtable.format(a.s_agent_name, i_trial+1)
+                l_files += [s_aux for s_aux
+                            in [s_qtable, get_nvisits_fname(s_qtable)]
+                            if exists(s_aux)]
+            d_summary = {'pnl': float(e.agent_states[a]['Pnl']),
+                         'reward': float(getattr(a, 'f_total_reward', 0.))}
+            cache.put(s_key, d_summary, l_files=l_files, d_config=d_key)
 
         # test the agent
         s_print = 'run(): Starting testing phase ! In-Sample Test.'
@@ -606,7 +1048,7 @@ def run(s_option, filename):
         # run for a specified number of trials. should have the same number of
         # trials and session of the training phase
         sim.in_sample_test(n_trials=n_trials, n_sessions=n_sessions)
-    elif s_option in ['test_random', 'test_learner']:
+    elif s_option in ['test_random', 'test_learner', 'test_linear']:
         # ==== OUT-OF-SAMPLE TEST ====
         # test the agent
         s_print = 'run(): Starting testing phase ! Out-of-Sample Test.'
@@ -615,7 +1057,8 @@ def run(s_option, filename):
         else:
             print(s_print)
         # run for a specified number of trials
-        s_qtable = 'log/qtable/LearningAgent_k_qtable_{}.log'.format(n_trials)
+        s_qtable = 'log/qtable/{}_qtable_{}.log'
+        s_qtable = s_qtable.format(a.s_agent_name, n_trials)
         if e.primary_agent.s_agent_name == 'BasicAgent':
             # run that if is the basicagent
             sim.out_of_sample(s_qtable=s_qtable, n_start=n_sessions+i_idx, n_trials=20, n_sessions=1)
@@ -624,6 +1067,45 @@ def run(s_option, filename):
             # the same actions. So there is no meaning on test multiple times
             sim.out_of_sample(s_qtable=s_qtable, n_start=n_sessions+i_idx, n_trials=1, n_sessions=1)
 
+    elif s_option == 'test_learner_batch':
+        # ==== IN-SAMPLE TEST OF ALL POLICIES AT ONCE ====
+        # the replicas are filled by the shadow model of the VecEnvironment,
+        # so the PnL approximates the one of test_learner
+        s_print = 'run(): Starting batch testing phase ! In-Sample Test'
+        s_print += ' (approximated by shadow fills).'
+        if DEBUG:
+            root.debug(s_print)
+        else:
+            print(s_print)
+        df_pnl = sim.batch_in_sample_test(n_trials=n_trials, n_sessions=n_sessions)
+        s_print = 'run(): Final PnL by policy:\n{}'.format(df_pnl.ffill().iloc[-1])
+        if DEBUG:
+            root.debug(s_print)
+        else:
+            print(s_print)
+
+    elif s_option == 'test_learner_batch_oos':
+        # ==== OUT-OF-SAMPLE TEST OF ALL POLICIES AT ONCE ====
+        # also filled by the shadow model, as test_learner_batch
+        s_print = 'run(): Starting batch testing phase ! Out-of-Sample Test'
+        s_print += ' (approximated by shadow fills).'
+        if DEBUG:
+            root.debug(s_print)
+        else:
+            print(s_print)
+        l_qtables = []
+        for i_trial in range(n_trials):
+            s_qtable = 'log/qtable/{}_qtable_{}.log'
+            l_qtables.append(s_qtable.format(a.s_agent_name, i_trial+1))
+        df_pnl = sim.batch_out_of_sample(l_qtables=l_qtables,
+                                         n_start=n_sessions+i_idx,
+                                         n_sessions=1)
+        s_print = 'run(): Final PnL by policy:\n{}'.format(df_pnl.ffill().iloc[-1])
+        if DEBUG:
+            root.debug(s_print)
+        else:
+            print(s_print)
+
     elif s_option == 'optimize_k':
         # test the agent
         s_print = 'run(): Starting training session ! Optimiza_K Test.'
@@ -631,13 +1113,16 @@ def run(s_option, filename):
             root.debug(s_print)
         else:
             print(s_print)
-        # k tests
-        for f_k in [0.3, 0.8, 1.3, 2.]:
-            e = Environment(s_fname=s_fname, i_idx=i_idx)
-            a = e.create_agent(LearningAgent_k, f_min_time=2., f_k=f_k, f_gamma=0.5)
-            e.set_primary_agent(a)
-            sim = Simulator(e, update_delay=1.00, display=False)
-            sim.train(n_trials=5, n_sessions=1)
+        # k tests. The candidates losing after few trials are dropped
+        from search import successive_halving
+        l_rounds = successive_halving(s_fname, {'f_k': [0.3, 0.8, 1.3, 2.]},
+                                      [i_idx], i_max_budget=5,
+                                      s_out='log/search/optimize_k.json')
+        s_print = 'run(): Best K: {}'.format(l_rounds[-1]['configs'][0])
+        if DEBUG:
+            root.debug(s_print)
+        else:
+            print(s_print)
     elif s_option == 'optimize_gamma':
         # test the agent
         s_print = 'run(): Starting training session ! Optimiza_gamma Test.'
@@ -645,23 +1130,31 @@ def run(s_option, filename):
             root.debug(s_print)
         else:
             print(s_print)
-        # gamma test
-        for f_gamma in [0.3, 0.5, 0.7, 0.9]:
-            e = Environment(s_fname=s_fname, i_idx=i_idx)
-            a = e.create_agent(LearningAgent_k, f_min_time=2., f_gamma=f_gamma, f_k=0.8)
-            e.set_primary_agent(a)
-            sim = Simulator(e, update_delay=1.00, display=False)
-            sim.train(n_trials=5, n_sessions=1)
+        # gamma test. The candidates losing after few trials are dropped
+        from search import successive_halving
+        l_rounds = successive_halving(s_fname,
+                                      {'f_gamma': [0.3, 0.5, 0.7, 0.9]},
+                                      [i_idx], i_max_budget=5,
+                                      s_out='log/search/optimize_gamma.json')
+        s_print = 'run(): Best gamma: {}'.format(l_rounds[-1]['configs'][0])
+        if DEBUG:
+            root.debug(s_print)
+        else:
+            print(s_print)
 
 
 if __name__ == '__main__':
+    if DEBUG:
+        async_logging.setup_logging()
     try:
         filename = "EURUSD-2016-01"
-        run(s_option=argv[1], filename=filename)
+        run(s_option=argv[1], filename=filename,
+            b_resume='--resume' in argv[2:])
     except IndexError:
         s_err = '\nRun "python qtrader/agent.py <OPTION>" to simulate'
         s_err += ' the behavior of selected agent.\n'
         l_aux = ['train_learner', 'test_learner', 'test_random', 'optimize_k',
-                 'optimize_gamma']
+                 'optimize_gamma', 'test_learner_batch',
+                 'test_learner_batch_oos', 'train_linear', 'test_linear']
         s_err += 'Select an <OPTION> between: {}'.format(l_aux)
         raise InvalidOptionException(s_err)
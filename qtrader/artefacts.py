@@ -0,0 +1,256 @@
+import argparse
+from contextlib import contextmanager
+from hashlib import sha256
+from io import BytesIO
+import json
+import multiprocessing
+from multiprocessing import forkserver
+from os import environ
+from os.path import abspath, dirname, exists, isabs, join
+import pickle
+import warnings
+
+from numpy import ndarray
+
+
+BASE_DIR = dirname(dirname(abspath(__file__)))
+# the content hash of each artefact, by name, checked when it is loaded
+MANIFEST = 'data/artefacts.json'
+
+# the artefacts unpickled by each scaler of the preprocess module
+SCALER_ARTEFACTS = {
+    'ClusterScaler': ['data/kmeans.dat', 'data/pca.dat', 'data/scale_ofi.dat',
+                      'data/scale_qbid.dat', 'data/scale_bookratio.dat',
+                      'data/logret.dat'],
+    'LessClustersScaler': ['data/kmeans_2.dat', 'data/scale_ofi_2.dat',
+                           'data/scale_bookratio_2.dat'],
+    'ZeroOneScaler': ['data/scale_ofi.dat', 'data/scale_bookratio.dat']}
+
+# modules of scikit-learn renamed since the artefacts were pickled
+MOVED_MODULES = {'sklearn.cluster.k_means_': 'sklearn.cluster',
+                 'sklearn.decomposition.pca': 'sklearn.decomposition',
+                 'sklearn.preprocessing.data': 'sklearn.preprocessing'}
+# attributes read by the current scikit-learn that the old estimators lack,
+# set to the values that reproduce the old behavior
+MISSING_ATTRS = {'KMeans': {'_n_threads': 1},
+                 'MinMaxScaler': {'clip': False},
+                 'PCA': {'svd_solver': 'full'}}
+
+
+'''
+Begin help functions
+'''
+
+
+class InvalidArtefactException(Exception):
+    """
+    InvalidArtefactException is raised when the content of an artefact does not
+    match the hash of the manifest
+    """
+    pass
+
+
+def get_path(s_name):
+    '''
+    Return the absolute path of an artefact
+    :param s_name: string. Path relative to the base dir of the package
+    '''
+    if isabs(s_name):
+        return s_name
+    return join(BASE_DIR, s_name)
+
+
+def get_hash(s_data):
+    '''
+    Return the SHA-256 of the content of an artefact
+    :param s_data: bytes. The content of the file
+    '''
+    return sha256(s_data).hexdigest()
+
+
+class LegacyUnpickler(pickle.Unpickler):
+    '''
+    Unpickler that finds the classes of scikit-learn moved since the
+    artefacts were saved by Python 2
+    '''
+    def find_class(self, s_module, s_name):
+        s_module = MOVED_MODULES.get(s_module, s_module)
+        return super(LegacyUnpickler, self).find_class(s_module, s_name)
+
+
+def unpickle(s_data):
+    '''
+    Return the object pickled, with the arrays it holds made read-only, as
+    the object is shared by all the agents of the process
+    :param s_data: bytes. The content of the file
+    '''
+    with warnings.catch_warnings():
+        # the version of scikit-learn is checked by the hash instead
+        warnings.filterwarnings('ignore', message='Trying to unpickle')
+        obj = LegacyUnpickler(BytesIO(s_data), encoding='latin1').load()
+    d_attrs = getattr(obj, '__dict__', {})
+    for s_attr, val in MISSING_ATTRS.get(type(obj).__name__, {}).items():
+        d_attrs.setdefault(s_attr, val)
+    for val in d_attrs.values():
+        if isinstance(val, ndarray):
+            val.setflags(write=False)
+    return obj
+
+
+@contextmanager
+def set_environ(d_environ):
+    '''
+    Set the environment variables passed and restore their previous values
+    (or remove them) on exit
+    :param d_environ: dictionary. Values by name of the variable
+    '''
+    d_old = dict((s_key, environ.get(s_key)) for s_key in d_environ)
+    environ.update(d_environ)
+    try:
+        yield
+    finally:
+        for s_key, s_old in d_old.items():
+            if s_old is None:
+                environ.pop(s_key, None)
+            else:
+                environ[s_key] = s_old
+
+
+'''
+End help functions
+'''
+
+
+class ArtefactRegistry(object):
+    '''
+    The model artefacts used by the process. Each one is loaded and verified
+    just once and then shared, read-only, by every scaler that asks for it
+    '''
+    def __init__(self, s_manifest=MANIFEST):
+        '''
+        Initiate an ArtefactRegistry object. Save all parameters as attributes
+        :*param s_manifest: string. JSON with the expected hash by artefact
+        '''
+        self.s_manifest = s_manifest
+        self.d_objects = {}
+        self.d_hashes = {}
+        self.d_expected = None
+
+    def get_expected_hashes(self):
+        '''
+        Return the hashes of the manifest, read the first time it is called.
+        Empty if there is no manifest
+        '''
+        if self.d_expected is None:
+            self.d_expected = {}
+            s_path = get_path(self.s_manifest)
+            if exists(s_path):
+                with open(s_path) as fr:
+                    self.d_expected = json.load(fr)
+        return self.d_expected
+
+    def get(self, s_name):
+        '''
+        Return the object of an artefact, loading it if needed
+        :param s_name: string. Path relative to the base dir of the package
+        '''
+        if s_name in self.d_objects:
+            return self.d_objects[s_name]
+        with open(get_path(s_name), 'rb') as fr:
+            s_data = fr.read()
+        s_hash = get_hash(s_data)
+        s_expected = self.get_expected_hashes().get(s_name)
+        if s_expected and s_expected != s_hash:
+            s_err = '{} has the hash {}, but {} was expected'
+            raise InvalidArtefactException(s_err.format(s_name, s_hash,
+                                                        s_expected))
+        self.d_objects[s_name] = unpickle(s_data)
+        self.d_hashes[s_name] = s_hash
+        return self.d_objects[s_name]
+
+    def prewarm(self, l_scalers=None):
+        '''
+        Load all the artefacts of the scalers passed and return their hashes
+        :*param l_scalers: list. Name of the scalers. All of them if None
+        '''
+        for s_scaler in (l_scalers or sorted(SCALER_ARTEFACTS)):
+            for s_name in SCALER_ARTEFACTS[s_scaler]:
+                self.get(s_name)
+        return dict(self.d_hashes)
+
+    def write_manifest(self):
+        '''
+        Save the hash of the current content of every artefact known
+        '''
+        d_hashes = {}
+        for l_names in SCALER_ARTEFACTS.values():
+            for s_name in l_names:
+                with open(get_path(s_name), 'rb') as fr:
+                    d_hashes[s_name] = get_hash(fr.read())
+        with open(get_path(self.s_manifest), 'w') as fw:
+            json.dump(d_hashes, fw, indent=2, sort_keys=True)
+            fw.write('\n')
+        self.d_expected = d_hashes
+
+
+# the artefacts of the current process
+REGISTRY = ArtefactRegistry()
+
+
+def get_artefact(s_name):
+    '''
+    Return the object of an artefact, shared by the whole process
+    :param s_name: string. Path relative to the base dir of the package
+    '''
+    return REGISTRY.get(s_name)
+
+
+def prewarm(l_scalers=None):
+    '''
+    Load the artefacts of the scalers in the current process, so the
+    processes forked from it inherit them. Return their hashes
+    :*param l_scalers: list. Name of the scalers. All of them if None
+    '''
+    return REGISTRY.prewarm(l_scalers)
+
+
+def get_forkserver_context(l_scalers=None, l_modules=None, d_environ=None):
+    '''
+    Return a multiprocessing context whose processes are forked from a server
+    that already imported the modules passed and loaded the artefacts of the
+    scalers. The server is started here, with the variables that drive the
+    preload set just while it starts, so they do not leak to other processes
+    of the parent. The server is shared by the whole process: if it is
+    already running, it keeps what it preloaded the first time
+    :*param l_scalers: list. Name of the scalers. All of them if None
+    :*param l_modules: list. Other modules imported by the server
+    :*param d_environ: dictionary. Other variables read by the modules
+    '''
+    d_aux = {'QTRADER_PREWARM_ARTEFACTS': ','.join(
+        l_scalers or sorted(SCALER_ARTEFACTS))}
+    d_aux.update(d_environ or {})
+    ctx = multiprocessing.get_context('forkserver')
+    ctx.set_forkserver_preload(['artefacts'] + list(l_modules or []))
+    with set_environ(d_aux):
+        forkserver.ensure_running()
+    return ctx
+
+
+# the server started by get_forkserver_context() imports this module with the
+# variable set, so the processes forked from it start with the artefacts. It
+# is removed, so they do not pass it to their own children
+if environ.get('QTRADER_PREWARM_ARTEFACTS'):
+    prewarm(environ.pop('QTRADER_PREWARM_ARTEFACTS').split(','))
+
+
+if __name__ == '__main__':
+    s_txt = 'Check the model artefacts against the manifest of hashes'
+    parser = argparse.ArgumentParser(description=s_txt)
+    parser.add_argument('--update', action='store_true',
+                        help='rewrite the manifest with the current hashes')
+    args = parser.parse_args()
+    if args.update:
+        REGISTRY.write_manifest()
+        print('Manifest saved at {}'.format(get_path(MANIFEST)))
+    for s_name, s_hash in sorted(prewarm().items()):
+        print('{}  {}'.format(s_hash, s_name))
@@ -0,0 +1,228 @@
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from os import environ, makedirs
+from os.path import exists, join
+from queue import Empty, Full, Queue
+from sys import stdout
+import time
+
+
+'''
+Begin help functions
+'''
+
+
+class InvalidOptionException(Exception):
+    """
+    InvalidOptionException is raised when an unknown policy is used to handle
+    a full queue
+    """
+    pass
+
+
+# what to do with a new record when the queue is full
+QUEUE_POLICIES = ['drop', 'block']
+# functions that log once per decision of the agents
+DECISION_FUNCS = ['update', '_choose_an_action']
+
+
+class LazyFormat(object):
+    '''
+    A log message formatted just when it is written, so the simulation thread
+    does not pay for the formatting when the records are handled by a
+    listener thread (or dropped)
+    '''
+    __slots__ = ['s_fmt', 'args']
+
+    def __init__(self, s_fmt, *args):
+        '''
+        Initiate a LazyFormat object. Save all parameters as attributes
+        :param s_fmt: string. A message to be formatted by str.format()
+        :param args: any type. The values used in the message
+        '''
+        self.s_fmt = s_fmt
+        self.args = args
+
+    def __str__(self):
+        return self.s_fmt.format(*self.args)
+
+    def __repr__(self):
+        return repr(str(self))
+
+
+class BoundedQueueHandler(QueueHandler):
+    '''
+    Put the log records in a bounded queue, without formatting them. When the
+    queue is full, drop the record (and count it) or wait for a free slot
+    '''
+    def __init__(self, queue, s_policy='drop'):
+        '''
+        Initiate a BoundedQueueHandler object. Save all parameters as
+        attributes
+        :param queue: Queue object. Where to put the records
+        :*param s_policy: string. 'drop' or 'block' when the queue is full
+        '''
+        if s_policy not in QUEUE_POLICIES:
+            s_err = 'Select a policy between: {}'.format(QUEUE_POLICIES)
+            raise InvalidOptionException(s_err)
+        super(BoundedQueueHandler, self).__init__(queue)
+        self.s_policy = s_policy
+        self.i_dropped = 0
+
+    def prepare(self, record):
+        '''
+        Return the record as it is. It is formatted by the listener thread
+        :param record: LogRecord object. The record to be queued
+        '''
+        return record
+
+    def enqueue(self, record):
+        '''
+        Put the record in the queue, according to the policy of the handler
+        :param record: LogRecord object. The record to be queued
+        '''
+        if self.s_policy == 'block':
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.i_dropped += 1
+
+
+class BoundedQueueListener(QueueListener):
+    '''
+    QueueListener that waits for a free slot to put the sentinel that stops
+    it, as the bounded queue can be full when it is stopped
+    '''
+    # seconds waiting for a free slot before writing the records itself
+    f_timeout = 10.
+
+    def enqueue_sentinel(self):
+        '''
+        Put the sentinel at the end of the queue, waiting for the listener
+        thread to free a slot. If it does not, write the records waiting from
+        the current thread, so none is lost
+        '''
+        try:
+            self.queue.put(self._sentinel, timeout=self.f_timeout)
+            return
+        except Full:
+            pass
+        while True:
+            try:
+                record = self.queue.get_nowait()
+            except Empty:
+                break
+            if record is not self._sentinel:
+                self.handle(record)
+        self.queue.put(self._sentinel)
+
+
+class SamplingFilter(logging.Filter):
+    '''
+    Let pass just one of every i_every records logged by the functions that
+    run once per decision. The other records always pass
+    '''
+    def __init__(self, i_every=1, l_funcs=None):
+        '''
+        Initiate a SamplingFilter object. Save all parameters as attributes
+        :*param i_every: integer. Keep one of every i_every records
+        :*param l_funcs: list. Name of the functions sampled
+        '''
+        super(SamplingFilter, self).__init__()
+        self.i_every = max(1, int(i_every))
+        self.set_funcs = set(l_funcs or DECISION_FUNCS)
+        self.i_count = 0
+
+    def filter(self, record):
+        if self.i_every == 1 or record.funcName not in self.set_funcs:
+            return True
+        self.i_count += 1
+        return self.i_count % self.i_every == 1
+
+
+def start_async_logging(logger, l_sinks, i_queue_size=10000, s_policy='drop',
+                        i_sample_every=1):
+    '''
+    Replace the handlers of the logger by a bounded queue consumed by a
+    listener thread, that formats the records and writes them to the sinks.
+    Return the listener, that is also stopped (flushing the queue) at exit
+    :param logger: Logger object. Usually the root logger
+    :param l_sinks: list. Handlers that write the records
+    :*param i_queue_size: integer. Maximum number of records waiting
+    :*param s_policy: string. 'drop' or 'block' when the queue is full
+    :*param i_sample_every: integer. Keep one of every i_sample_every records
+        logged by each decision of the agents
+    '''
+    queue = Queue(maxsize=i_queue_size)
+    handler = BoundedQueueHandler(queue, s_policy=s_policy)
+    handler.addFilter(SamplingFilter(i_every=i_sample_every))
+    for old_handler in list(logger.handlers):
+        logger.removeHandler(old_handler)
+    logger.addHandler(handler)
+    listener = BoundedQueueListener(queue, *l_sinks,
+                                    respect_handler_level=True)
+    listener.handler = handler
+    listener.start()
+    atexit.register(stop_async_logging, listener)
+    return listener
+
+
+def stop_async_logging(listener):
+    '''
+    Write the records still in the queue and stop the listener thread. Report
+    how many records were dropped, if any
+    :param listener: QueueListener object. Returned by start_async_logging()
+    '''
+    if listener._thread is None:
+        return
+    listener.stop()
+    i_dropped = listener.handler.i_dropped
+    if i_dropped:
+        s_msg = 'stop_async_logging(): {} log records dropped'.format(i_dropped)
+        for sink in listener.handlers:
+            sink.handle(logging.makeLogRecord({'msg': s_msg,
+                                               'levelno': logging.WARNING,
+                                               'levelname': 'WARNING'}))
+
+
+def setup_logging(s_dir='log/train_test', s_format='%(asctime)s;%(message)s'):
+    '''
+    Configure the root logger to write the messages to stdout and to a file
+    named by the current time. It should be called by the entry points, as
+    importing the modules of the package does not configure the logging.
+    Set QTRADER_ASYNC_LOG to 'drop' or 'block' to format and write the records
+    in a listener thread. It sets what to do when the queue is full. Return
+    the path of the log file
+    :*param s_dir: string. Directory of the log file
+    :*param s_format: string. Format of the messages
+    '''
+    s_now = time.strftime('%c')
+    s_now = s_now.replace('/', '').replace(' ', '_').replace(':', '')
+    if not exists(s_dir):
+        makedirs(s_dir)
+    s_file = join(s_dir, 'sim_{}.log'.format(s_now))
+    logging.basicConfig(filename=s_file, format=s_format)
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+    ch = logging.StreamHandler(stdout)
+    ch.setLevel(logging.DEBUG)
+
+    formatter = logging.Formatter(s_format)
+    ch.setFormatter(formatter)
+    root.addHandler(ch)
+    s_policy = environ.get('QTRADER_ASYNC_LOG', '')
+    if s_policy:
+        start_async_logging(
+            root, list(root.handlers),
+            i_queue_size=int(environ.get('QTRADER_LOG_QUEUE_SIZE', 10000)),
+            s_policy=s_policy,
+            i_sample_every=int(environ.get('QTRADER_LOG_SAMPLE_EVERY', 1)))
+    return s_file
+
+
+'''
+End help functions
+'''
@@ -0,0 +1,368 @@
+import argparse
+import logging
+
+from numpy import (arange, array, concatenate, full, isnan, nan, sign, where,
+                   zeros, fmax)
+from numpy.random import RandomState
+from pandas import DataFrame
+
+import async_logging
+import preprocess
+import state_space
+from simulator import Simulator, load_qtables
+
+
+DEBUG = True
+
+'''
+Begin help functions
+'''
+
+
+class InvalidFillModelException(Exception):
+    """
+    InvalidFillModelException is raised by the FastBacktester class to
+    indicate that the passive fill model chose is invalid
+    """
+    pass
+
+
+def record_features(env, f_min_time=2., n_sessions=1, i_idx=None):
+    '''
+    Replay the market of an Environment without primary agent and return a
+    dataframe with the features available at each decision of an agent that
+    reacts every f_min_time seconds
+    :param env: Environment object. The environment to replay
+    :*param f_min_time: float. Minimum time in seconds to the agent react
+    :*param n_sessions: integer. Number of files to read
+    :*param i_idx: integer. start file of the envioronment
+    '''
+    scaler = preprocess.LessClustersScaler()
+    l_rtn = []
+    env.reset_order_matching_idx(i_idx=i_idx)
+    for i_sess in range(n_sessions):
+        env.reset()
+        f_next_time = 0.
+        while True:
+            try:
+                env.step()
+            except StopIteration:
+                break
+            if env.done:
+                break
+            my_ordmatch = env.order_matching
+            # the agent needs some rows to start and waits f_min_time
+            if env.i_nrow < 5 or not env.is_open_to_agents():
+                continue
+            if my_ordmatch.last_date < f_next_time:
+                continue
+            f_next_time = my_ordmatch.last_date + f_min_time
+            obs = env.observe()
+            d_data = {}
+            d_data['OFI'] = obs.qOfi
+            d_data['BOOK_RATIO'] = obs.qBid * 1. / obs.qAsk
+            l_rtn.append({'Date': my_ordmatch.row['Date'],
+                          'OFI': obs.qOfi,
+                          'BOOK_RATIO': d_data['BOOK_RATIO'],
+                          'cluster': scaler.transform(d_data),
+                          'best_bid': my_ordmatch.best_bid[0],
+                          'best_ask': my_ordmatch.best_ask[0],
+                          'mid': obs.midPrice})
+    l_cols = ['Date', 'OFI', 'BOOK_RATIO', 'cluster', 'best_bid', 'best_ask',
+              'mid']
+    return DataFrame(l_rtn, columns=l_cols).set_index('Date')
+
+
+def load_dense_qtables(l_fnames):
+    '''
+    Return a stacked array with shape (n_qtables, n_states, n_actions) of the
+    Q-tables saved by the simulator, indexed as in state_space
+    :param l_fnames: list. Paths to the qtables to be loaded
+    '''
+    l_states, l_actions, na_values = load_qtables(l_fnames)
+    l_idx = [state_space.state_to_index(state_space.parse_state(s_state))
+             for s_state in l_states]
+    l_cols = [state_space.get_action_index(s_action) for s_action in l_actions]
+    n_states = (max(l_idx + [0]) // state_space.N_SUBSTATES + 1)
+    n_states *= state_space.N_SUBSTATES
+    na_rtn = full((len(l_fnames), n_states, len(state_space.ACTIONS)), nan)
+    for i_row, i_idx in enumerate(l_idx):
+        na_rtn[:, i_idx, l_cols] = na_values[:, i_row, :]
+    return na_rtn
+
+
+def record_test_pnl(env, l_qtables, n_sessions=1, i_idx=None):
+    '''
+    Test each policy in the full simulator, one run of Simulator.test() by
+    qtable, and return a dataframe with the PnL of each policy, sampled every
+    time the market time changes. It is the reference of the approximations,
+    as Simulator.batch_test() also fills the orders of its replicas by a model
+    :param env: Environment object. The environment with the primary agent
+    :param l_qtables: list. paths to the qtables to be used
+    :*param n_sessions: integer. Number of files to read
+    :*param i_idx: integer. start file of the envioronment
+    '''
+    sim = Simulator(env, display=False, b_progress=False)
+    d_pnl = {}
+    for s_qtable in l_qtables:
+        d_pnl[s_qtable] = {}
+        sim.test(s_qtable, n_trials=1, n_sessions=n_sessions, i_idx=i_idx,
+                 d_pnl=d_pnl[s_qtable])
+    return DataFrame(d_pnl, columns=l_qtables)
+
+
+def record_frozen_actions(s_fname, s_qtable, i_idx=0, b_compiled=True,
+                          d_agent_kwargs=None):
+    '''
+    Replay a day with a LearningAgent_k using a frozen Q-table and return the
+    list of the actions it took, in order
+    :param s_fname: string. the container zip file to be used in simulation
+    :param s_qtable: string. path to the qtable to be used
+    :*param i_idx: integer. The index of the file (day) to be read
+    :*param b_compiled: boolean. If should decide by the policy compiled by
+        set_qtable(). By the loop over the Q-table dictionary if False
+    :*param d_agent_kwargs: dictionary. Parameters of the agent
+    '''
+    from agent import LearningAgent_k
+    from environment import Environment
+    l_rtn = []
+
+    class RecordingAgent(LearningAgent_k):
+        def _choose_an_action(self, t_state, valid_actions):
+            s_action = super(RecordingAgent, self)._choose_an_action(
+                t_state, valid_actions)
+            l_rtn.append(s_action)
+            return s_action
+
+    env = Environment(s_fname=s_fname, i_idx=i_idx, i_seed=0)
+    agent = env.create_agent(RecordingAgent, **(d_agent_kwargs or {
+        'f_min_time': 2., 'f_k': 0.8, 'f_gamma': 0.5}))
+    env.set_primary_agent(agent)
+    agent.set_qtable(s_qtable)
+    if not b_compiled:
+        agent.na_policy = None
+    env.reset()
+    while True:
+        try:
+            env.step()
+        except StopIteration:
+            break
+        if env.done:
+            break
+    return l_rtn
+
+
+def check_compiled_policy(s_fname, s_qtable, i_idx=0, d_agent_kwargs=None):
+    '''
+    Replay a day deciding by the compiled policy and again by the loop over
+    the Q-table dictionary, and raise AssertionError if the actions taken
+    differ. Return the number of decisions compared
+    :param s_fname: string. the container zip file to be used in simulation
+    :param s_qtable: string. path to the qtable to be used
+    :*param i_idx: integer. The index of the file (day) to be read
+    :*param d_agent_kwargs: dictionary. Parameters of the agent
+    '''
+    l_compiled = record_frozen_actions(s_fname, s_qtable, i_idx, True,
+                                       d_agent_kwargs)
+    l_loop = record_frozen_actions(s_fname, s_qtable, i_idx, False,
+                                   d_agent_kwargs)
+    i_diff = sum(s_a != s_b for s_a, s_b in zip(l_compiled, l_loop))
+    i_diff += abs(len(l_compiled) - len(l_loop))
+    s_msg = 'check_compiled_policy(): {} of {} decisions differ'
+    s_msg = s_msg.format(i_diff, len(l_loop))
+    if DEBUG:
+        logging.info(s_msg)
+    else:
+        print(s_msg)
+    assert i_diff == 0, s_msg
+    return len(l_loop)
+
+
+def report_divergence(df_fast, df_full):
+    '''
+    Return a dataframe comparing, by policy, the PnL curves produced by the
+    FastBacktester with the ones produced by the full simulator, running each
+    policy alone, as record_test_pnl()
+    :param df_fast: DataFrame. PnL by decision time (rows) and policy (cols)
+    :param df_full: DataFrame. PnL by market time (rows) and policy (cols)
+    '''
+    df_full = df_full.sort_index().ffill()
+    df_full = df_full.reindex(df_fast.index, method='ffill').fillna(0.)
+    df_full.columns = df_fast.columns
+    df_diff = df_fast - df_full
+    df_rtn = DataFrame({'final_fast': df_fast.iloc[-1],
+                        'final_full': df_full.iloc[-1],
+                        'final_diff': df_diff.iloc[-1],
+                        'mean_abs_diff': df_diff.abs().mean(),
+                        'max_abs_diff': df_diff.abs().max(),
+                        'corr': df_fast.corrwith(df_full)})
+    s_msg = 'report_divergence(): mean final PnL difference = {:0.2f}'
+    s_msg = s_msg.format(df_rtn['final_diff'].abs().mean())
+    if DEBUG:
+        logging.info(s_msg)
+    else:
+        print(s_msg)
+    return df_rtn
+
+
+'''
+End help functions
+'''
+
+
+class FastBacktester(object):
+    '''
+    Approximate backtester that simulates many frozen policies at once over
+    the features precomputed for each decision of a day. It does not interact
+    with the book: resting orders are filled by a configurable model
+    '''
+    l_fill_models = ['through', 'touch', 'prob']
+
+    def __init__(self, df_feat, s_fill_model='through', f_fill_prob=0.5,
+                 f_max_pos=100., f_qty=100., f_spread=0.01, f_cost=0.00035,
+                 i_seed=None):
+        '''
+        Initiate a FastBacktester object. Save all parameters as attributes
+        :param df_feat: DataFrame. Features by decision, as record_features()
+        :*param s_fill_model: string. 'through' fills a resting order when the
+            best price of its side moves beyond it, 'touch' when it reaches
+            its price and 'prob' with probability f_fill_prob by decision
+        :*param f_fill_prob: float. Probability of fill used by 'prob' model
+        :*param f_max_pos: float. The maximum position allowed
+        :*param f_qty: float. Quantity of each order
+        :*param f_spread: float. Distance of the limit orders to the best price
+        :*param f_cost: float. Costs by financial volume traded
+        :*param i_seed: integer. Seed used by the 'prob' model
+        '''
+        if s_fill_model not in self.l_fill_models:
+            s_err = 'fill model should be in {}'.format(self.l_fill_models)
+            raise InvalidFillModelException(s_err)
+        self.df_feat = df_feat
+        self.na_cluster = df_feat['cluster'].values.astype(int)
+        self.na_bid = df_feat['best_bid'].values.astype(float)
+        self.na_ask = df_feat['best_ask'].values.astype(float)
+        self.na_mid = df_feat['mid'].values.astype(float)
+        self.s_fill_model = s_fill_model
+        self.f_fill_prob = f_fill_prob
+        self.f_max_pos = f_max_pos
+        self.f_qty = f_qty
+        self.f_spread = f_spread
+        self.f_cost = f_cost
+        self.random_state = RandomState(i_seed)
+
+    def _fill(self, na_price, f_best, b_bid):
+        '''
+        Return a boolean array of the resting orders filled at this decision
+        :param na_price: numpy array. Price of the resting orders (NaN if none)
+        :param f_best: float. Current best price of the side of the orders
+        :param b_bid: boolean. If the orders are in the bid side
+        '''
+        b_rest = ~isnan(na_price)
+        if self.s_fill_model == 'prob':
+            na_draw = self.random_state.random_sample(na_price.shape[0])
+            return b_rest & (na_draw < self.f_fill_prob)
+        na_aux = where(b_rest, na_price, 0.)
+        if self.s_fill_model == 'through':
+            if b_bid:
+                return b_rest & (f_best < na_aux)
+            return b_rest & (f_best > na_aux)
+        if b_bid:
+            return b_rest & (f_best <= na_aux)
+        return b_rest & (f_best >= na_aux)
+
+    def run(self, na_qtables, l_names=None):
+        '''
+        Simulate the frozen policies and return a dataframe with the PnL of
+        each one by decision
+        :param na_qtables: numpy array. Q-tables with shape (n_states,
+            n_actions) or (n_policies, n_states, n_actions)
+        :*param l_names: list. Name of each policy
+        '''
+        na_qtables = array(na_qtables, dtype=float)
+        if na_qtables.ndim == 2:
+            na_qtables = na_qtables[None, :, :]
+        # make sure that every cluster observed has rows in the qtables
+        n_pol, n_states, n_actions = na_qtables.shape
+        n_need = (self.na_cluster.max() + 1) * state_space.N_SUBSTATES
+        if n_need > n_states:
+            na_pad = full((n_pol, n_need - n_states, n_actions), nan)
+            na_qtables = concatenate([na_qtables, na_pad], axis=1)
+        na_policy = state_space.compile_frozen_policy(na_qtables)
+        na_idx = arange(n_pol)
+        # positions, notional traded by side and resting orders
+        na_qbid = zeros(n_pol)
+        na_qask = zeros(n_pol)
+        na_vbid = zeros(n_pol)
+        na_vask = zeros(n_pol)
+        na_pbid = full(n_pol, nan)
+        na_pask = full(n_pol, nan)
+        na_max_pnl = full(n_pol, nan)
+        na_delta_pnl = zeros(n_pol)
+        na_rtn = zeros((len(self.na_mid), n_pol))
+        i_buy = state_space.get_action_index('BUY')
+        i_sell = state_space.get_action_index('SELL')
+        for i_t in range(len(self.na_mid)):
+            f_bid = self.na_bid[i_t]
+            f_ask = self.na_ask[i_t]
+            f_mid = self.na_mid[i_t]
+            # fill the resting orders at their prices
+            b_fill = self._fill(na_pbid, f_bid, True)
+            na_qbid += b_fill * self.f_qty
+            na_vbid += where(b_fill, na_pbid, 0.) * self.f_qty
+            na_pbid[b_fill] = nan
+            b_fill = self._fill(na_pask, f_ask, False)
+            na_qask += b_fill * self.f_qty
+            na_vask += where(b_fill, na_pask, 0.) * self.f_qty
+            na_pask[b_fill] = nan
+            # build the state and the valid actions of each policy
+            na_pos = na_qbid - na_qask
+            b_stop = abs(na_delta_pnl) >= (4.-1e-6)
+            na_set = zeros(n_pol, dtype=int)
+            na_set[na_pos <= -self.f_max_pos] = 1
+            na_set[(na_pos <= -self.f_max_pos) & b_stop] = 3
+            na_set[na_pos >= self.f_max_pos] = 2
+            na_set[(na_pos >= self.f_max_pos) & b_stop] = 4
+            na_state = self.na_cluster[i_t] * state_space.N_SUBSTATES
+            na_state += (sign(na_pos).astype(int) + 1) * 4
+            na_state += (~isnan(na_pbid)) * 2 + (~isnan(na_pask)) * 1
+            na_action = na_policy[na_idx, na_state, na_set]
+            # apply the actions as translate_to_agent() and translate_trades()
+            b_bid = (na_action == 1) | (na_action == 3)
+            b_ask = (na_action == 2) | (na_action == 3)
+            b_cancel = (na_action <= 3)
+            na_pbid[b_cancel & ~b_bid] = nan
+            na_pask[b_cancel & ~b_ask] = nan
+            na_pbid[b_bid] = f_bid - self.f_spread
+            na_pask[b_ask] = f_ask + self.f_spread
+            b_buy = na_action == i_buy
+            b_sell = na_action == i_sell
+            na_qbid += b_buy * self.f_qty
+            na_vbid += b_buy * self.f_qty * f_ask
+            na_qask += b_sell * self.f_qty
+            na_vask += b_sell * self.f_qty * f_bid
+            # measure the pnl as Environment.act()
+            na_pos = na_qbid - na_qask
+            na_pnl = na_vask - na_vbid + na_pos * f_mid
+            na_pnl -= (na_vask + na_vbid) * self.f_cost
+            # track the drawdown of the current position as BasicAgent
+            b_flat = na_pos == 0
+            na_max_pnl = where(b_flat, nan, fmax(na_max_pnl, na_pnl))
+            na_delta_pnl = where(b_flat, na_delta_pnl, na_pnl - na_max_pnl)
+            na_rtn[i_t] = na_pnl
+        if not l_names:
+            l_names = list(range(n_pol))
+        return DataFrame(na_rtn, index=self.df_feat.index, columns=l_names)
+
+
+if __name__ == '__main__':
+    s_txt = 'Check that the compiled frozen policy takes the same actions as'
+    s_txt += ' the loop over the Q-table'
+    parser = argparse.ArgumentParser(description=s_txt)
+    parser.add_argument('archive', help='zip file with the market data')
+    parser.add_argument('qtable', help='path to the qtable to be used')
+    parser.add_argument('--idx', type=int, default=0,
+                        help='index of the file (day) of the archive')
+    args = parser.parse_args()
+    if DEBUG:
+        async_logging.setup_logging()
+    check_compiled_policy(args.archive, args.qtable, args.idx)
@@ -0,0 +1,707 @@
+import argparse
+from copy import deepcopy
+import json
+import logging
+from os import makedirs
+from os.path import abspath, dirname, exists, join
+import platform
+from shutil import rmtree
+import subprocess
+import sys
+from tempfile import mkdtemp
+import time
+
+import numpy
+from numpy import median
+from numpy.random import RandomState
+
+import book
+import state_space
+from synthetic_data import make_synthetic_zip
+
+
+'''
+Begin help functions
+'''
+
+
+class InvalidOptionException(Exception):
+    """
+    InvalidOptionException is raised when a baseline can not be compared with
+    the current results
+    """
+    pass
+
+
+# benchmarks registered by the decorator below, in the order they are run
+BENCHMARKS = []
+
+
+def benchmark(s_kind, s_unit='ops/s'):
+    '''
+    Return a decorator that registers a benchmark function. The function
+    receives the BenchContext and returns (setup, run, i_ops): setup() builds
+    the objects used by run(obj), that is the only part timed
+    :param s_kind: string. 'micro' or 'macro'
+    :*param s_unit: string. The unit of the rate reported
+    '''
+    def decorator(func):
+        BENCHMARKS.append((func.__name__.replace('bench_', ''), s_kind, s_unit,
+                           func))
+        return func
+    return decorator
+
+
+def measure(setup, run, i_ops, i_repeat=5):
+    '''
+    Time run(setup()) i_repeat times and return a dictionary with the best and
+    the median times, in seconds, and the rate of the best time
+    :param setup: function. Build the objects used by run, not timed
+    :param run: function. The code to be measured
+    :param i_ops: integer. Number of operations done by each call of run
+    :*param i_repeat: integer. Number of measurements
+    '''
+    l_times = []
+    for i_rep in range(i_repeat):
+        obj = setup()
+        f_start = time.perf_counter()
+        run(obj)
+        l_times.append(time.perf_counter() - f_start)
+    f_best = min(l_times)
+    return {'ops': i_ops,
+            'best': f_best,
+            'median': float(median(l_times)),
+            'rate': i_ops / f_best if f_best > 0 else float('inf')}
+
+
+def make_order_msg(i_id, f_price, i_qty, s_status='New', s_side='BID',
+                   i_traded=0):
+    '''
+    Return a message in the format consumed by BookSide.update()
+    :param i_id: integer. The order id
+    :param f_price: float. The order price
+    :param i_qty: integer. The total quantity of the order
+    :*param s_status: string. The order status
+    :*param s_side: string. BID or ASK
+    :*param i_traded: integer. The quantity already traded
+    '''
+    return {'agent_id': 10,
+            'instrumento_symbol': 'PETR4',
+            'order_id': i_id,
+            'order_entry_step': i_id,
+            'new_order_id': i_id,
+            'order_price': f_price,
+            'order_side': s_side,
+            'order_status': s_status,
+            'total_qty_order': i_qty,
+            'traded_qty_order': i_traded,
+            'agressor_indicator': 'Neutral',
+            'action': None,
+            'original_id': i_id}
+
+
+def get_bench_agent_class(agent_class):
+    '''
+    Return a subclass of the agent passed that does not load the scaler, to
+    measure the parts of the agent that do not depend on it
+    :param agent_class: Agent class. The agent to be measured
+    '''
+    return type('Bench' + agent_class.__name__, (agent_class,),
+                {'USE_SCALER': False})
+
+
+def get_random_states(i_n, n_clusters=10, i_seed=0):
+    '''
+    Return a list of intern states of the agent drawn at random
+    :param i_n: integer. Number of states
+    :*param n_clusters: integer. Number of clusters of the scaler
+    :*param i_seed: integer. Seed of the random numbers
+    '''
+    random_state = RandomState(i_seed)
+    return [state_space.index_to_state(i_idx) for i_idx
+            in random_state.randint(0, n_clusters * state_space.N_SUBSTATES,
+                                    i_n)]
+
+
+def compare_to_baseline(d_results, d_baseline, f_tolerance=0.1):
+    '''
+    Return a list of (name, rate, baseline rate, ratio, status) comparing the
+    rates of the benchmarks to a baseline. The status is 'regression' when
+    the rate dropped more than the tolerance, 'improvement' when it rose more
+    than that and 'ok' otherwise
+    :param d_results: dictionary. The 'benchmarks' of the current run
+    :param d_baseline: dictionary. The 'benchmarks' of the baseline
+    :*param f_tolerance: float. Relative change accepted as noise
+    '''
+    l_rtn = []
+    for s_name, d_res in d_results.items():
+        d_base = d_baseline.get(s_name)
+        if 'error' in d_res:
+            l_rtn.append((s_name, None, None, None, 'error'))
+            continue
+        if not d_base or 'rate' not in d_base:
+            l_rtn.append((s_name, d_res['rate'], None, None, 'new'))
+            continue
+        f_ratio = d_res['rate'] / d_base['rate']
+        s_status = 'ok'
+        if f_ratio < 1. - f_tolerance:
+            s_status = 'regression'
+        elif f_ratio > 1. + f_tolerance:
+            s_status = 'improvement'
+        l_rtn.append((s_name, d_res['rate'], d_base['rate'], f_ratio,
+                      s_status))
+    return l_rtn
+
+
+'''
+End help functions
+'''
+
+
+class BenchContext(object):
+    '''
+    Hold the synthetic data and the warmed-up environment shared by the
+    benchmarks, so they are created just once by run
+    '''
+    def __init__(self, i_rows=20000, i_repeat=5, i_seed=0):
+        '''
+        Initiate a BenchContext object. Save all parameters as attributes
+        :*param i_rows: integer. Rows of the synthetic day used by macro ones
+        :*param i_repeat: integer. Number of measurements of each benchmark
+        :*param i_seed: integer. Seed of the synthetic data
+        '''
+        self.i_rows = i_rows
+        self.i_repeat = i_repeat
+        self.i_seed = i_seed
+        self.s_dir = mkdtemp(prefix='qtrader_bench_')
+        self.s_fname = join(self.s_dir, 'synthetic.zip')
+        make_synthetic_zip(self.s_fname, i_rows=i_rows, i_days=1,
+                           i_seed=i_seed)
+        self._env = None
+        self._i_session_rows = None
+
+    def get_session_rows(self):
+        '''
+        Return the rows of the synthetic day read by a session, that ends when
+        the market closes, before the last row of the file
+        '''
+        if self._i_session_rows is None:
+            from environment import Environment
+            e = Environment(s_fname=self.s_fname, i_idx=0)
+            e.reset()
+            _run_session(e)
+            self._i_session_rows = e.order_matching.i_rows_read
+        return self._i_session_rows
+
+    def get_warm_env(self, i_steps=2000):
+        '''
+        Return an environment whose book was built from the first rows of the
+        synthetic day. It is not stepped anymore by the benchmarks
+        :*param i_steps: integer. Rows processed before returning
+        '''
+        if self._env is None:
+            from environment import Environment
+            e = Environment(s_fname=self.s_fname, i_idx=0)
+            e.reset()
+            for i_step in range(i_steps):
+                e.step()
+            self._env = e
+        return self._env
+
+    def close(self):
+        '''
+        Remove the synthetic data created
+        '''
+        rmtree(self.s_dir, ignore_errors=True)
+
+
+def _bench_book_side(s_status, i_orders=5000, i_levels=20):
+    '''
+    Return the (setup, run, i_ops) of BookSide.update() for messages of the
+    status passed, applied over a side with i_orders resting orders
+    :param s_status: string. The status of the messages measured
+    :*param i_orders: integer. Number of orders (and messages)
+    :*param i_levels: integer. Number of price levels used
+    '''
+    l_prices = [10. + 0.01 * i_level for i_level in range(i_levels)]
+    l_new = [make_order_msg(i_id, l_prices[i_id % i_levels], 400)
+             for i_id in range(1, i_orders + 1)]
+    if s_status == 'Replaced':
+        # move every order to another price level
+        l_msg = [make_order_msg(d['order_id'],
+                                l_prices[-1 - d['order_id'] % i_levels], 300,
+                                'Replaced')
+                 for d in l_new]
+    elif s_status == 'Partially Filled':
+        l_msg = [make_order_msg(d['order_id'], d['order_price'], 400,
+                                'Partially Filled', i_traded=100)
+                 for d in l_new]
+    elif s_status in ['Canceled', 'Filled']:
+        l_msg = [make_order_msg(d['order_id'], d['order_price'], 400,
+                                s_status)
+                 for d in l_new]
+    else:
+        l_msg = l_new
+
+    def setup():
+        book_side = book.BookSide('BID')
+        if s_status != 'New':
+            for d_msg in l_new:
+                book_side.update(d_msg)
+        return book_side
+
+    def run(book_side):
+        for d_msg in l_msg:
+            book_side.update(d_msg)
+
+    return setup, run, len(l_msg)
+
+
+@benchmark('micro', 'msgs/s')
+def bench_book_update_new(ctx):
+    '''
+    New orders inserted in an empty side
+    '''
+    return _bench_book_side('New')
+
+
+@benchmark('micro', 'msgs/s')
+def bench_book_update_replaced(ctx):
+    '''
+    Resting orders moved to another price
+    '''
+    return _bench_book_side('Replaced')
+
+
+@benchmark('micro', 'msgs/s')
+def bench_book_update_canceled(ctx):
+    '''
+    Resting orders canceled
+    '''
+    return _bench_book_side('Canceled')
+
+
+@benchmark('micro', 'msgs/s')
+def bench_book_update_partially_filled(ctx):
+    '''
+    Resting orders partially filled
+    '''
+    return _bench_book_side('Partially Filled')
+
+
+@benchmark('micro', 'msgs/s')
+def bench_book_update_filled(ctx):
+    '''
+    Resting orders filled
+    '''
+    return _bench_book_side('Filled')
+
+
+@benchmark('micro', 'rows/s')
+def bench_translate_row(ctx):
+    '''
+    BID and ASK rows translated to book messages
+    '''
+    from translators import translate_row
+    e = ctx.get_warm_env()
+    my_ordmatch = e.order_matching
+    f_bid, f_ask = my_ordmatch.best_bid[0], my_ordmatch.best_ask[0]
+    l_rows = []
+    for i_row in range(2000):
+        # quotes at, above and below the best prices of each side
+        f_delta = 0.01 * (i_row % 3 - 1)
+        s_type = 'BID' if i_row % 2 else 'ASK'
+        f_price = (f_bid if s_type == 'BID' else f_ask) + f_delta
+        l_rows.append({'': str(i_row), 'Date': my_ordmatch.row['Date'],
+                       'Type': s_type, 'Price': '{:0.2f}'.format(f_price),
+                       'Size': str(100 * (1 + i_row % 5))})
+
+    def run(l_aux):
+        for row in l_aux:
+            translate_row(my_ordmatch.i_nrow, row, my_ordmatch)
+
+    return lambda: deepcopy(l_rows), run, len(l_rows)
+
+
+@benchmark('micro', 'rows/s')
+def bench_translate_trades(ctx):
+    '''
+    TRADE rows at the best prices translated to messages
+    '''
+    from translators import translate_trades
+    e = ctx.get_warm_env()
+    my_ordmatch = e.order_matching
+    l_rows = []
+    for i_row in range(2000):
+        s_side = 'BID' if i_row % 2 else 'ASK'
+        f_price = my_ordmatch.best_bid[0] if s_side == 'BID' else \
+            my_ordmatch.best_ask[0]
+        l_rows.append({'': str(i_row), 'Date': my_ordmatch.row['Date'],
+                       'Type': 'TRADE', 'Price': f_price, 'Size': 100.})
+
+    def run(l_aux):
+        for row in l_aux:
+            translate_trades(my_ordmatch.i_nrow, row, my_ordmatch)
+
+    return lambda: deepcopy(l_rows), run, len(l_rows)
+
+
+@benchmark('micro', 'actions/s')
+def bench_translate_to_agent(ctx):
+    '''
+    Actions of an agent without orders translated
+    '''
+    from agent import BasicAgent
+    from translators import translate_to_agent
+    e = ctx.get_warm_env()
+    agent = e.create_agent(get_bench_agent_class(BasicAgent), f_min_time=2.)
+    agent.reset()
+    l_actions = state_space.ACTIONS * 500
+
+    def run(obj):
+        for s_action in l_actions:
+            translate_to_agent(agent, s_action, e.order_matching)
+
+    return lambda: None, run, len(l_actions)
+
+
+@benchmark('micro', 'calls/s')
+def bench_scaler_transform(ctx):
+    '''
+    Features clustered by the LessClustersScaler
+    '''
+    import preprocess
+    scaler = preprocess.LessClustersScaler()
+    random_state = RandomState(ctx.i_seed)
+    l_feat = [{'OFI': f_ofi, 'BOOK_RATIO': f_ratio}
+              for f_ofi, f_ratio
+              in zip(random_state.normal(0., 5000., 1000),
+                     random_state.lognormal(0., 1., 1000))]
+
+    def run(obj):
+        for d_feat in l_feat:
+            scaler.transform(d_feat)
+
+    return lambda: None, run, len(l_feat)
+
+
+def _get_learner(ctx, b_frozen=False):
+    '''
+    Return a LearningAgent_k, without the scaler, with a random Q-table
+    :param ctx: BenchContext object. The benchmarks context
+    :*param b_frozen: boolean. If the policy should be compiled and frozen
+    '''
+    from agent import LearningAgent_k
+    e = ctx.get_warm_env()
+    agent = e.create_agent(get_bench_agent_class(LearningAgent_k),
+                           f_min_time=2., f_gamma=0.5, f_k=0.8)
+    agent.reset()
+    random_state = RandomState(ctx.i_seed)
+    na_qtable = random_state.normal(0., 1., (10 * state_space.N_SUBSTATES,
+                                             len(state_space.ACTIONS)))
+    l_states = [str(state_space.index_to_state(i_idx))
+                for i_idx in range(na_qtable.shape[0])]
+    if b_frozen:
+        agent.set_qtable_values(l_states, state_space.ACTIONS, na_qtable)
+    else:
+        for s_state, na_row in zip(l_states, na_qtable):
+            for s_action, f_val in zip(state_space.ACTIONS, na_row):
+                agent.q_table[s_state][s_action] = f_val
+    return agent
+
+
+@benchmark('micro', 'decisions/s')
+def bench_choose_an_action(ctx):
+    '''
+    Decisions of a LearningAgent_k still learning
+    '''
+    agent = _get_learner(ctx)
+    l_states = get_random_states(2000, i_seed=ctx.i_seed)
+
+    def run(obj):
+        for d_state in l_states:
+            agent._choose_an_action(d_state, state_space.ACTIONS_TO_OPEN)
+
+    return lambda: None, run, len(l_states)
+
+
+@benchmark('micro', 'decisions/s')
+def bench_choose_an_action_frozen(ctx):
+    '''
+    Decisions of a LearningAgent_k with a frozen policy
+    '''
+    agent = _get_learner(ctx, b_frozen=True)
+    l_states = get_random_states(2000, i_seed=ctx.i_seed)
+
+    def run(obj):
+        for d_state in l_states:
+            agent._choose_an_action(d_state, state_space.ACTIONS_TO_OPEN)
+
+    return lambda: None, run, len(l_states)
+
+
+@benchmark('micro', 'updates/s')
+def bench_apply_policy(ctx):
+    '''
+    Q-table updates of a LearningAgent_k
+    '''
+    agent = _get_learner(ctx)
+    l_states = get_random_states(2000, i_seed=ctx.i_seed)
+    random_state = RandomState(ctx.i_seed)
+    l_actions = [state_space.ACTIONS_TO_OPEN[i_action] for i_action
+                 in random_state.randint(0, 4, len(l_states))]
+    l_rewards = random_state.normal(0., 1., len(l_states))
+
+    def setup():
+        agent.old_state = None
+        return None
+
+    def run(obj):
+        for d_state, s_action, f_reward in zip(l_states, l_actions, l_rewards):
+            agent._apply_policy(d_state, s_action, f_reward)
+
+    return setup, run, len(l_states)
+
+
+def _run_session(e):
+    '''
+    Step an environment already reset until the end of the session
+    :param e: Environment object. The environment to step
+    '''
+    while True:
+        try:
+            e.step()
+        except StopIteration:
+            break
+        if e.done:
+            break
+
+
+def _bench_env_step(ctx, agent_class=None):
+    '''
+    Return the (setup, run, i_ops) of stepping an environment over a session
+    of the synthetic day, with or without a primary agent
+    :param ctx: BenchContext object. The benchmarks context
+    :*param agent_class: Agent class. The primary agent. None to not use any
+    '''
+    from environment import Environment
+
+    def setup():
+        e = Environment(s_fname=ctx.s_fname, i_idx=0)
+        if agent_class:
+            a = e.create_agent(agent_class, f_min_time=2.)
+            e.set_primary_agent(a)
+        e.reset()
+        return e
+
+    return setup, _run_session, ctx.get_session_rows()
+
+
+@benchmark('macro', 'rows/s')
+def bench_env_step(ctx):
+    '''
+    Rows of a day processed by an environment without agents
+    '''
+    return _bench_env_step(ctx)
+
+
+@benchmark('macro', 'rows/s')
+def bench_env_step_with_agent(ctx):
+    '''
+    Rows of a day processed with a LearningAgent_k as primary
+    '''
+    from agent import LearningAgent_k
+    return _bench_env_step(ctx, LearningAgent_k)
+
+
+@benchmark('macro', 'rows/s')
+def bench_simulator_train_day(ctx):
+    '''
+    A training day of a LearningAgent_k run by the Simulator
+    '''
+    from agent import LearningAgent_k
+    from environment import Environment
+    from simulator import Simulator
+
+    def setup():
+        e = Environment(s_fname=ctx.s_fname, i_idx=0)
+        a = e.create_agent(LearningAgent_k, f_min_time=2., f_k=0.8,
+                           f_gamma=0.5)
+        e.set_primary_agent(a)
+        return Simulator(e, update_delay=1.00, display=False,
+                         b_progress=False)
+
+    def run(sim):
+        sim.train(n_trials=1, n_sessions=1, b_save_qtable=False)
+
+    return setup, run, ctx.get_session_rows()
+
+
+def _bench_replicas(ctx, b_vec, i_replicas=4):
+    '''
+    Return the (setup, run, i_ops) of i_replicas LearningAgent_k trading a
+    session of the synthetic day, as the replicas of one VecEnvironment or in
+    one Environment after the other. Each row seen by an agent is an op
+    :param ctx: BenchContext object. The benchmarks context
+    :param b_vec: boolean. If the agents are replicas of a VecEnvironment
+    :*param i_replicas: integer. Number of agents
+    '''
+    from agent import LearningAgent_k
+    from environment import Environment
+    from vec_environment import VecEnvironment
+
+    def setup():
+        if b_vec:
+            e = VecEnvironment(s_fname=ctx.s_fname, i_idx=0)
+            for i_rep in range(i_replicas):
+                a = e.add_replica(LearningAgent_k, f_min_time=2.)
+            e.set_primary_agent(a)
+            e.reset()
+            return [e]
+        l_env = []
+        for i_rep in range(i_replicas):
+            e = Environment(s_fname=ctx.s_fname, i_idx=0)
+            a = e.create_agent(LearningAgent_k, f_min_time=2.)
+            e.set_primary_agent(a)
+            e.reset()
+            l_env.append(e)
+        return l_env
+
+    def run(l_env):
+        for e in l_env:
+            _run_session(e)
+
+    return setup, run, i_replicas * ctx.get_session_rows()
+
+
+@benchmark('macro', 'agent rows/s')
+def bench_vec_env_4_replicas(ctx):
+    '''
+    A session of 4 LearningAgent_k as replicas of a VecEnvironment
+    '''
+    return _bench_replicas(ctx, b_vec=True)
+
+
+@benchmark('macro', 'agent rows/s')
+def bench_env_4_sequential(ctx):
+    '''
+    A session of 4 LearningAgent_k, each one in its own Environment
+    '''
+    return _bench_replicas(ctx, b_vec=False)
+
+
+@benchmark('macro', 'imports/s')
+def bench_cold_import_agent(ctx):
+    '''
+    The agent module imported by a new interpreter, as a worker does
+    '''
+    s_dir = dirname(abspath(__file__))
+
+    def run(obj):
+        subprocess.check_call([sys.executable, '-c', 'import agent'],
+                              cwd=s_dir)
+
+    return lambda: None, run, 1
+
+
+def run_benchmarks(s_filter=None, i_rows=20000, i_repeat=5, i_seed=0):
+    '''
+    Run the benchmarks registered and return a dictionary ready to be saved
+    as JSON. Logging is disabled while they run. A benchmark that fails is
+    reported with its error and does not stop the others
+    :*param s_filter: string. Run just the benchmarks with it in the name
+    :*param i_rows: integer. Rows of the synthetic day used by macro ones
+    :*param i_repeat: integer. Number of measurements of each benchmark
+    :*param i_seed: integer. Seed of the synthetic data
+    '''
+    logging.disable(logging.INFO)
+    ctx = BenchContext(i_rows=i_rows, i_repeat=i_repeat, i_seed=i_seed)
+    d_results = {}
+    try:
+        for s_name, s_kind, s_unit, func in BENCHMARKS:
+            if s_filter and s_filter not in s_name:
+                continue
+            try:
+                setup, run, i_ops = func(ctx)
+                # the macro ones take long, so they are measured less times
+                i_aux = i_repeat
+                if s_kind == 'macro':
+                    i_aux = max(1, i_repeat // 2)
+                d_res = measure(setup, run, i_ops, i_aux)
+            except Exception as e:
+                d_res = {'error': '{}: {}'.format(type(e).__name__, e)}
+            d_res['kind'] = s_kind
+            d_res['unit'] = s_unit
+            d_results[s_name] = d_res
+    finally:
+        ctx.close()
+        logging.disable(logging.NOTSET)
+    d_meta = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(),
+              'numpy': numpy.__version__,
+              'platform': platform.platform(),
+              'rows': i_rows,
+              'repeat': i_repeat,
+              'seed': i_seed}
+    return {'meta': d_meta, 'benchmarks': d_results}
+
+
+def print_results(d_results, l_compare=None):
+    '''
+    Print a table with the rate of each benchmark and, if passed, how it
+    compares to the baseline
+    :param d_results: dictionary. The 'benchmarks' of a run
+    :*param l_compare: list. Returned by compare_to_baseline()
+    '''
+    d_compare = dict((x[0], x) for x in (l_compare or []))
+    for s_name, d_res in d_results.items():
+        if 'error' in d_res:
+            print('{:<32} {:>14}  {}'.format(s_name, 'ERROR', d_res['error']))
+            continue
+        s_line = '{:<32} {:>14,.1f} {:<12}'.format(s_name, d_res['rate'],
+                                                   d_res['unit'])
+        if s_name in d_compare and d_compare[s_name][3] is not None:
+            s_line += ' {:>7.2%} {}'.format(d_compare[s_name][3],
+                                            d_compare[s_name][4])
+        print(s_line)
+
+
+if __name__ == '__main__':
+    s_txt = 'Measure the throughput of the book, translators, environment'
+    s_txt += ' and agents on synthetic data'
+    parser = argparse.ArgumentParser(description=s_txt)
+    parser.add_argument('--filter', default=None,
+                        help='run just the benchmarks with it in the name')
+    parser.add_argument('--rows', type=int, default=20000,
+                        help='rows of the synthetic day')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='measurements of each benchmark')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='log/benchmark/latest.json',
+                        help='path of the JSON with the results')
+    parser.add_argument('--baseline', default=None,
+                        help='JSON of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative slowdown accepted as noise')
+    args = parser.parse_args()
+    d_run = run_benchmarks(s_filter=args.filter, i_rows=args.rows,
+                           i_repeat=args.repeat, i_seed=args.seed)
+    if dirname(args.out) and not exists(dirname(args.out)):
+        makedirs(dirname(args.out))
+    with open(args.out, 'w') as fw:
+        json.dump(d_run, fw, indent=2, sort_keys=True)
+    l_compare = None
+    if args.baseline:
+        with open(args.baseline) as fr:
+            d_baseline = json.load(fr)
+        if 'benchmarks' not in d_baseline:
+            s_err = '{} is not a benchmark output'.format(args.baseline)
+            raise InvalidOptionException(s_err)
+        l_compare = compare_to_baseline(d_run['benchmarks'],
+                                        d_baseline['benchmarks'],
+                                        args.tolerance)
+    print_results(d_run['benchmarks'], l_compare)
+    print('Results saved at {}'.format(args.out))
+    # a non-zero exit code flags the regressions to scripts
+    if l_compare and [x for x in l_compare if x[4] == 'regression']:
+        sys.exit(1)
@@ -1,5 +1,4 @@
 from bintrees import FastRBTree
-from pandas import DataFrame
 
 
 '''
@@ -390,6 +389,7 @@ class BidSide(BookSide):
         t_rtn = self.price_tree.nlargest(n)
         if not b_return_dataframe:
             return t_rtn
+        from pandas import DataFrame
         df_rtn = DataFrame(t_rtn)
         df_rtn.columns = ['PRICE', 'QTY']
         return df_rtn
@@ -403,6 +403,7 @@ class BidSide(BookSide):
         t_rtn = self.price_tree.nsmallest(n)
         if not b_return_dataframe:
             return t_rtn
+        from pandas import DataFrame
         df_rtn = DataFrame(t_rtn)
         df_rtn.columns = ['PRICE', 'QTY']
         return df_rtn
@@ -427,6 +428,7 @@ class AskSide(BookSide):
         t_rtn = self.price_tree.nsmallest(n)
         if not b_return_dataframe:
             return t_rtn
+        from pandas import DataFrame
         df_rtn = DataFrame(t_rtn)
         df_rtn.columns = ['PRICE', 'QTY']
         return df_rtn
@@ -440,6 +442,7 @@ class AskSide(BookSide):
         t_rtn = self.price_tree.nlargest(n)
         if not b_return_dataframe:
             return t_rtn
+        from pandas import DataFrame
         df_rtn = DataFrame(t_rtn)
         df_rtn.columns = ['PRICE', 'QTY']
         return df_rtn
@@ -483,6 +486,7 @@ class LimitOrderBook(object):
         '''
         t_rtn1 = self.book_bid.get_n_top_prices(n, b_return_dataframe=False)
         t_rtn2 = self.book_ask.get_n_top_prices(n, b_return_dataframe=False)
+        from pandas import DataFrame
         df1 = DataFrame(t_rtn1, columns=['Bid', 'qBid'])
         df2 = DataFrame(t_rtn2, columns=['Ask', 'qAsk'])
         df1 = df1.reset_index(drop=True)
@@ -533,17 +537,13 @@ class LimitOrderBook(object):
     def get_basic_stats(self):
         '''
         Return the number of price levels and number of orders remain in the
-        dictionaries and trees
-        '''
-        i_n_order_bid = len(list(self.book_bid.d_order_map.keys()))
-        i_n_order_ask = len(list(self.book_ask.d_order_map.keys()))
-        i_n_price_bid = len([x for x in list(self.book_bid.price_tree.keys())])
-        i_n_price_ask = len([x for x in list(self.book_ask.price_tree.keys())])
-        i_n_order_bid, i_n_order_ask, i_n_price_bid, i_n_price_ask
-        d_rtn = {'n_order_bid': i_n_order_bid,
-                 'n_order_ask': i_n_order_ask,
-                 'n_price_bid': i_n_price_bid,
-                 'n_price_ask': i_n_price_ask}
+        dictionaries and trees. The sizes are kept by the structures, so it
+        does not iterate over them
+        '''
+        d_rtn = {'n_order_bid': len(self.book_bid.d_order_map),
+                 'n_order_ask': len(self.book_ask.d_order_map),
+                 'n_price_bid': self.book_bid.price_tree.count,
+                 'n_price_ask': self.book_ask.price_tree.count}
         return d_rtn
 
     def update(self, d_data):
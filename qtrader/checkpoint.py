@@ -0,0 +1,201 @@
+import argparse
+from os import makedirs, remove, replace
+from os.path import dirname, exists
+import pickle
+import random
+import time
+
+import numpy
+
+from environment import Agent, Environment
+import preprocess
+
+
+# bump it when what is saved changes
+CHECKPOINT_FORMAT = 1
+# attributes of the environment kept from the live object on restore
+LIVE_ENV_ATTRS = ['feature_store', '_na_features']
+
+
+'''
+Begin help functions
+'''
+
+
+class InvalidCheckpointException(Exception):
+    """
+    InvalidCheckpointException is raised when a checkpoint does not belong to
+    the simulation that tries to resume from it
+    """
+    pass
+
+
+class CheckpointPickler(pickle.Pickler):
+    '''
+    Pickler that saves the environment, the agents and the scalers by
+    reference. They are the objects that already exist in the process that
+    resumes the simulation, so the state saved is restored into them
+    '''
+    def persistent_id(self, obj):
+        if isinstance(obj, Environment):
+            return ('env',)
+        if isinstance(obj, Agent):
+            return ('agent', obj.i_id)
+        if type(obj).__module__ == preprocess.__name__:
+            # the scalers just hold the artefacts shared by the process
+            return ('scaler', type(obj).__name__)
+        return None
+
+
+class CheckpointUnpickler(pickle.Unpickler):
+    '''
+    Unpickler that resolves the references saved by CheckpointPickler to the
+    objects of the environment passed
+    '''
+    def __init__(self, fr, env):
+        super(CheckpointUnpickler, self).__init__(fr)
+        self.env = env
+        self.d_agents = dict((agent.i_id, agent) for agent in env.agent_states)
+
+    def persistent_load(self, t_pid):
+        if t_pid[0] == 'env':
+            return self.env
+        if t_pid[0] == 'agent':
+            if t_pid[1] not in self.d_agents:
+                s_err = 'The agent {} is not in the environment'
+                raise InvalidCheckpointException(s_err.format(t_pid[1]))
+            return self.d_agents[t_pid[1]]
+        if t_pid[0] == 'scaler':
+            return getattr(preprocess, t_pid[1])()
+        raise pickle.UnpicklingError('Unknown reference {}'.format(t_pid))
+
+
+'''
+End help functions
+'''
+
+
+class Checkpoint(object):
+    '''
+    The state of a simulation in the middle of a run: the attributes of the
+    environment, that include the order matching and its position in the
+    file, the attributes of every agent, as the Q-table, the visit counts and
+    the last state, action and reward, and the state of the random numbers.
+    Restoring it and resuming the loop gives the same result as a run that
+    was never stopped
+    '''
+    def __init__(self, s_fname, i_every=100000):
+        '''
+        Initiate a Checkpoint object. Save all parameters as attributes
+        :param s_fname: string. Path to the file of the checkpoint
+        :*param i_every: integer. Steps of the environment between two saves
+        '''
+        self.s_fname = s_fname
+        self.i_every = i_every
+        self.i_steps = 0
+
+    def exists(self):
+        '''
+        Return if there is a checkpoint saved
+        '''
+        return exists(self.s_fname)
+
+    def step(self):
+        '''
+        Count a step of the environment and return if it is time to save
+        '''
+        self.i_steps += 1
+        return bool(self.i_every) and self.i_steps % self.i_every == 0
+
+    def save(self, env, d_position):
+        '''
+        Save the state of the simulation. The file is replaced atomically, so
+        a crash while saving keeps the previous checkpoint
+        :param env: Environment object. The environment simulated
+        :param d_position: dictionary. Where the simulation is: 'caller',
+            'trial', 'session', 'n_trials', 'n_sessions' and 'in_session'
+            (False when the session passed was not started yet)
+        '''
+        d_env = dict((s_key, val) for s_key, val in env.__dict__.items()
+                     if s_key not in LIVE_ENV_ATTRS)
+        d_agents = dict((agent.i_id, agent.__dict__)
+                        for agent in env.agent_states)
+        d_state = {'format': CHECKPOINT_FORMAT,
+                   'position': d_position,
+                   'saved_at': time.time(),
+                   'random': random.getstate(),
+                   'numpy_random': numpy.random.get_state(),
+                   'env': d_env,
+                   'agents': d_agents}
+        if dirname(self.s_fname) and not exists(dirname(self.s_fname)):
+            makedirs(dirname(self.s_fname))
+        s_tmp = self.s_fname + '.tmp'
+        with open(s_tmp, 'wb') as fw:
+            CheckpointPickler(fw, pickle.HIGHEST_PROTOCOL).dump(d_state)
+        replace(s_tmp, self.s_fname)
+
+    def load(self, env, s_caller=None, n_trials=None, n_sessions=None):
+        '''
+        Restore the state saved into the environment and its agents, that
+        should be created as in the run saved. Return the position saved
+        :param env: Environment object. The environment simulated
+        :*param s_caller: string. The method resuming. Not checked if None
+        :*param n_trials: integer. Trials of the run. Not checked if None
+        :*param n_sessions: integer. Sessions of the run. Not checked if None
+        '''
+        with open(self.s_fname, 'rb') as fr:
+            d_state = CheckpointUnpickler(fr, env).load()
+        if d_state['format'] != CHECKPOINT_FORMAT:
+            s_err = '{} was saved in the format {}, but {} was expected'
+            raise InvalidCheckpointException(s_err.format(
+                self.s_fname, d_state['format'], CHECKPOINT_FORMAT))
+        d_position = d_state['position']
+        for s_key, val in [('caller', s_caller), ('n_trials', n_trials),
+                           ('n_sessions', n_sessions)]:
+            if val is not None and d_position[s_key] != val:
+                s_err = '{} was saved with {} = {}, not {}'
+                raise InvalidCheckpointException(s_err.format(
+                    self.s_fname, s_key, d_position[s_key], val))
+        if set(d_state['agents']) != set(a.i_id for a in env.agent_states):
+            s_err = '{} was saved with the agents {}'
+            raise InvalidCheckpointException(s_err.format(
+                self.s_fname, sorted(d_state['agents'])))
+        env.__dict__.update(d_state['env'])
+        for agent in list(env.agent_states):
+            agent.__dict__.update(d_state['agents'][agent.i_id])
+        # the features precomputed are read again from the store
+        s_name = env.order_matching.get_trial_identification()
+        if env.feature_store and s_name:
+            env._na_features = env.feature_store.get_table(s_name)
+        random.setstate(d_state['random'])
+        numpy.random.set_state(d_state['numpy_random'])
+        return d_position
+
+    def remove(self):
+        '''
+        Remove the checkpoint saved, if any
+        '''
+        if exists(self.s_fname):
+            remove(self.s_fname)
+
+
+if __name__ == '__main__':
+    s_txt = 'Show where the simulation saved in a checkpoint stopped'
+    parser = argparse.ArgumentParser(description=s_txt)
+    parser.add_argument('checkpoint', help='path to the checkpoint')
+    args = parser.parse_args()
+    # just the position is read, without restoring the objects
+    with open(args.checkpoint, 'rb') as fr:
+        unpickler = pickle.Unpickler(fr)
+        unpickler.persistent_load = lambda t_pid: t_pid
+        d_state = unpickler.load()
+    d_position = d_state['position']
+    s_msg = '{caller}: trial {trial_}/{n_trials}, session {session_}/'
+    s_msg += '{n_sessions}, {s_where}, saved at {s_time}'
+    print(s_msg.format(
+        trial_=d_position['trial'] + 1, session_=d_position['session'] + 1,
+        s_where=('in the middle' if d_position['in_session']
+                 else 'not started'),
+        s_time=time.strftime('%Y-%m-%d %H:%M:%S',
+                             time.localtime(d_state['saved_at'])),
+        **d_position))
@@ -5,7 +5,9 @@ import logging
 from numpy import around, log
 from bintrees import FastRBTree
 
+import instrument
 from matching_engine import BloombergMatching
+from rng import AgentRandom, get_seed_sequence
 
 
 DEBUG = True
@@ -22,6 +24,63 @@ class Foo(Exception):
     pass
 
 
+class Observation(object):
+    '''
+    A fixed-layout record of the market inputs that the agents can sense at a
+    given step of the order matching
+    '''
+    __slots__ = ['i_version', 'qOfi', 'qAggr', 'qTraded', 'spread', 'qBid',
+                 'qAsk', 'midPrice', 'deltaMid', 'logret']
+    l_fields = ['qOfi', 'qAggr', 'qTraded', 'spread', 'qBid', 'qAsk',
+                'midPrice', 'deltaMid', 'logret']
+
+    def __init__(self, i_version, qOfi, qAggr, qTraded, spread, qBid, qAsk,
+                 midPrice, deltaMid, logret):
+        '''
+        Initiate a Observation object. Save all parameters as attributes
+        :param i_version: integer. Book version used to compute the record
+        :param qOfi: float. Order flow imbalance in the last bucket
+        :param qAggr: float. Net quantity aggressed in the last bucket
+        :param qTraded: float. Total quantity traded in the last bucket
+        :param spread: integer. Bid-ask spread in ticks
+        :param qBid: integer. Quantity at the best bid
+        :param qAsk: integer. Quantity at the best ask
+        :param midPrice: float. Mid price rounded to cents
+        :param deltaMid: float. Mid price change in the last bucket
+        :param logret: float. Log return of the mid in the last bucket
+        '''
+        self.i_version = i_version
+        self.qOfi = qOfi
+        self.qAggr = qAggr
+        self.qTraded = qTraded
+        self.spread = spread
+        self.qBid = qBid
+        self.qAsk = qAsk
+        self.midPrice = midPrice
+        self.deltaMid = deltaMid
+        self.logret = logret
+
+    def to_dict(self):
+        '''
+        Return a new dictionary with the inputs in the format used by sense()
+        '''
+        return {s_key: getattr(self, s_key) for s_key in self.l_fields}
+
+    def __eq__(self, other):
+        '''
+        Return if all the inputs of the Observation are equal to the other
+        :param other: Observation object. Observation to be compared
+        '''
+        return self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        '''
+        Return if some input of the Observation is different from the other
+        :param other: Observation object. Observation to be compared
+        '''
+        return not self.__eq__(other)
+
+
 '''
 End help functions
 '''
@@ -34,18 +93,46 @@ class Environment(object):
 
     valid_actions = [None, 'BEST_BID', 'BEST_OFFER', 'BEST_BOTH', 'SELL', 'BUY']
 
-    def __init__(self, s_fname, i_idx=None):
+    def __init__(self, s_fname, i_idx=None, b_debug_obs=False,
+                 feature_store=None, i_seed=None, i_stream=0,
+                 b_vectorized_rng=False):
         '''
         Initialize an Environment object
         :param s_fname: string. the container zip file to be used in simulation
         :*param i_idx: integer. The index of the start file to be read
-        '''
+        :*param b_debug_obs: boolean. If should check the cached observation
+            against a recomputed one every time it is reused
+        :*param feature_store: FeatureStore object. Where to read the features
+            precomputed, instead of computing them on each row
+        :*param i_seed: integer. Seed of the run, from where the random
+            numbers of the environment and of each agent are derived. Entropy
+            of the OS if None
+        :*param i_stream: integer. Sub-stream of the run used by this
+            environment, as the task run by a worker
+        :*param b_vectorized_rng: boolean. If the agents should draw their
+            random numbers in blocks with NumPy
+        '''
+        # the random numbers of the environment and its agents
+        self.seed_seq = get_seed_sequence(i_seed, (i_stream,))
+        self.i_stream = i_stream
+        self.b_vectorized_rng = b_vectorized_rng
+        self.rng = self.get_random()
         self.s_instrument = 'PETR4'
         self.done = False
         self.t = 0
+        # number of updates of the primary agents in the session
+        self.i_decisions = 0
         self.agent_states = OrderedDict()
         self.initial_idx = i_idx
         self.count_trials = 1
+        # observation cached for the current version of the book
+        self.b_debug_obs = b_debug_obs
+        self._obs = None
+        # features precomputed for the current file and the last bucket where
+        # the agents have changed the book
+        self.feature_store = feature_store
+        self._na_features = None
+        self._f_dirty_bucket = None
 
         # Include Dummy agents
         self.num_dummies = 1  # no. of dummy agents
@@ -91,6 +178,19 @@ class Environment(object):
         self._best_ask = self.order_matching.best_ask
         return self._best_ask
 
+    def get_random(self, i_id=None):
+        '''
+        Return the random numbers of an agent, that depend just on the seed of
+        the run, the sub-stream and the agent id, whatever order the agents
+        are created or the process that runs them
+        :*param i_id: integer. Agent id. The environment itself if None
+        '''
+        t_key = (self.i_stream,)
+        if i_id is not None:
+            t_key += (i_id,)
+        seed_seq = get_seed_sequence(self.seed_seq.entropy, t_key)
+        return AgentRandom(seed_seq, b_vectorized=self.b_vectorized_rng)
+
     def create_agent(self, agent_class, *args, **kwargs):
         '''
         Include a agent in the environment and initiate its env state
@@ -148,6 +248,7 @@ class Environment(object):
         '''
         self.done = False
         self.t = 0
+        self.i_decisions = 0
         self.order_matching.reset()
 
         # reset environment
@@ -158,6 +259,11 @@ class Environment(object):
                 logging.info(s_msg.format(s_name))
             else:
                 print((s_msg.format(s_name)))
+        # load the features precomputed to this file, if there are
+        self._na_features = None
+        self._f_dirty_bucket = None
+        if self.feature_store and s_name:
+            self._na_features = self.feature_store.get_table(s_name)
 
         # Initialize agent(s)
         for agent in list(self.agent_states.keys()):
@@ -169,27 +275,35 @@ class Environment(object):
         Perform a discreate step in the environment updating the state of all
         agents
         '''
+        b_timing = instrument.ENABLED
+        if b_timing:
+            f_t0 = instrument.clock()
         # Update agents asking to the order matching what each one has done
         l_msg = next(self.order_matching)
         l_msg_aux = []
+        # the features stored are not valid anymore in this bucket if the
+        # market traded with the agents or if the book differs from the one
+        # stored, as the counters were accumulated over another book
+        f_bucket = self.order_matching.f_last_bucket
+        if self._na_features is not None and self._f_dirty_bucket != f_bucket:
+            b_traded = self.primary_agent and any(
+                msg['agent_id'] == self.primary_agent.i_id for msg in l_msg)
+            if b_traded or self.feature_store.get_record(
+                    self._na_features, self) is None:
+                self._f_dirty_bucket = f_bucket
+        if b_timing:
+            f_t1 = instrument.clock()
+            instrument.STATS.add_time('env.matching', f_t1 - f_t0)
         # update the agents
         for msg in l_msg:
             agent_aux = self.agent_states[msg['agent_id']]['Agent']
             self.update_agent_state(agent=agent_aux, msg=msg)
         # check if should update the primary
-        if self.primary_agent:
-            # ensure that the market is opened
-            # TODO: modify this line
-            b_are_there_orders = True
-            if self.order_matching.my_book.book_ask.price_tree.count == 0:
-                b_are_there_orders = False
-            if self.order_matching.my_book.book_bid.price_tree.count == 0:
-                b_are_there_orders = False
-            if self.order_matching.last_date >= (10*60**2 + 30 * 60):
-                if b_are_there_orders:
-                    if self.primary_agent.should_update():
-                        self.update_agent_state(agent=self.primary_agent,
-                                                msg=None)
+        self.update_primary_agents()
+        if b_timing:
+            f_t2 = instrument.clock()
+            instrument.STATS.add_time('env.agents', f_t2 - f_t1)
+            instrument.STATS.add_time('env.step', f_t2 - f_t0)
         # check if the market is closed
         if self.order_matching.last_date >= (16*60**2 + 30 * 60):
             self.done = True
@@ -205,49 +319,130 @@ class Environment(object):
                 print(s_msg)
         self.t += 1
 
-    def sense(self, agent):
-        '''
-        Return the environment state that the agents can access
-        :param agent: Agent object. the agent that will perform the action
-        '''
-        assert agent in self.agent_states, 'Unknown agent!'
-
-        state = self.agent_states[agent]
+    def is_open_to_agents(self):
+        '''
+        Return if the market is opened and there are orders in both sides of
+        the book, so the primary agents are allowed to act
+        '''
+        # TODO: modify this line
+        my_book = self.order_matching.my_book
+        if my_book.book_ask.price_tree.count == 0:
+            return False
+        if my_book.book_bid.price_tree.count == 0:
+            return False
+        return self.order_matching.last_date >= (10*60**2 + 30 * 60)
+
+    def update_primary_agents(self):
+        '''
+        Update the primary agent, if it is time to do so
+        '''
+        if self.primary_agent and self.is_open_to_agents():
+            if self.primary_agent.should_update():
+                self.i_decisions += 1
+                self.update_agent_state(agent=self.primary_agent, msg=None)
+
+    def get_learning_agents(self):
+        '''
+        Return a list of the agents whose policies are tracked by simulation
+        '''
+        if not self.primary_agent:
+            return []
+        return [self.primary_agent]
+
+    def observe(self):
+        '''
+        Return the Observation related to the current state of the book. It is
+        computed just once per matching step and reused until the book changes
+        '''
+        i_version = self.order_matching.i_book_version
+        if not self._obs or self._obs.i_version != i_version:
+            self._obs = None
+            if self._should_read_features():
+                self._obs = self.feature_store.get_observation(
+                    self._na_features, self, i_version)
+            if not self._obs:
+                self._obs = self._compute_observation(i_version)
+            elif self.b_debug_obs:
+                obs_aux = self._compute_observation(i_version)
+                s_err = 'Stored observation differs: {} != {}'
+                s_err = s_err.format(self._obs.to_dict(), obs_aux.to_dict())
+                assert self._obs == obs_aux, s_err
+        elif self.b_debug_obs:
+            obs_aux = self._compute_observation(i_version)
+            s_err = 'Cached observation is stale: {} != {}'
+            s_err = s_err.format(self._obs.to_dict(), obs_aux.to_dict())
+            assert self._obs == obs_aux, s_err
+        return self._obs
+
+    def _should_read_features(self):
+        '''
+        Return if the features can be read from the feature store. They are
+        recomputed while the agents have changed the book in the current
+        bucket, as the counters can differ from the stored ones
+        '''
+        if self._na_features is None:
+            return False
+        if self._f_dirty_bucket is None:
+            return True
+        if self._f_dirty_bucket != self.order_matching.f_last_bucket:
+            self._f_dirty_bucket = None
+            return True
+        return False
+
+    def _compute_observation(self, i_version):
+        '''
+        Return a new Observation computed from the order matching attributes
+        :param i_version: integer. The current version of the book
+        '''
+        my_ordmatch = self.order_matching
         # total traded in the last 10 seconds
-        i_traded_qty = self.order_matching.i_qty_traded_at_bid
-        i_traded_qty += self.order_matching.i_qty_traded_at_ask
-        i_traded_qty -= self.order_matching.i_qty_traded_at_bid_10s
-        i_traded_qty -= self.order_matching.i_qty_traded_at_ask_10s
+        i_traded_qty = my_ordmatch.i_qty_traded_at_bid
+        i_traded_qty += my_ordmatch.i_qty_traded_at_ask
+        i_traded_qty -= my_ordmatch.i_qty_traded_at_bid_10s
+        i_traded_qty -= my_ordmatch.i_qty_traded_at_ask_10s
         # total aggressed in 10 seconds
-        i_aggr_qty = self.order_matching.i_qty_traded_at_bid
-        i_aggr_qty -= self.order_matching.i_qty_traded_at_bid_10s
-        i_aggr_qty -= self.order_matching.i_qty_traded_at_ask
-        i_aggr_qty += self.order_matching.i_qty_traded_at_ask_10s
+        i_aggr_qty = my_ordmatch.i_qty_traded_at_bid
+        i_aggr_qty -= my_ordmatch.i_qty_traded_at_bid_10s
+        i_aggr_qty -= my_ordmatch.i_qty_traded_at_ask
+        i_aggr_qty += my_ordmatch.i_qty_traded_at_ask_10s
         # ofi in 10 seconds
-        i_ofi = self.order_matching.i_ofi
-        i_ofi -= self.order_matching.i_ofi_10s
+        i_ofi = my_ordmatch.i_ofi
+        i_ofi -= my_ordmatch.i_ofi_10s
         # price related inputs
-        f_mid = self.order_matching.best_ask[0]
-        i_spread = (f_mid - self.order_matching.best_bid[0]) / 0.01
+        f_mid = my_ordmatch.best_ask[0]
+        i_spread = (f_mid - my_ordmatch.best_bid[0]) / 0.01
         i_spread = int(around(i_spread, 0))  # 0.01 is the minimum tick size
-        f_mid += self.order_matching.best_bid[0]
+        f_mid += my_ordmatch.best_bid[0]
         f_mid /= 2.
-        f_mid_change = f_mid - self.order_matching.mid_price_10s
+        f_mid_change = f_mid - my_ordmatch.mid_price_10s
         f_log_ret = 0.
-        if self.order_matching.mid_price_10s != 0.:
-            f_log_ret = log(f_mid/self.order_matching.mid_price_10s)
+        if my_ordmatch.mid_price_10s != 0.:
+            f_log_ret = log(f_mid/my_ordmatch.mid_price_10s)
+
+        return Observation(i_version=i_version,
+                           qOfi=i_ofi,
+                           qAggr=i_aggr_qty,
+                           qTraded=i_traded_qty,
+                           spread=i_spread,
+                           qBid=my_ordmatch.best_bid[1],
+                           qAsk=my_ordmatch.best_ask[1],
+                           midPrice=around(f_mid, 2),
+                           deltaMid=f_mid_change,
+                           logret=f_log_ret)
 
-        d_rtn = {'qOfi': i_ofi,
-                 'qAggr': i_aggr_qty,
-                 'qTraded': i_traded_qty,
-                 'spread': i_spread,
-                 'qBid': self.order_matching.best_bid[1],
-                 'qAsk': self.order_matching.best_ask[1],
-                 'midPrice': around(f_mid, 2),
-                 'deltaMid': f_mid_change,
-                 'logret': f_log_ret}
-
-        return d_rtn
+    def sense(self, agent):
+        '''
+        Return the environment state that the agents can access
+        :param agent: Agent object. the agent that will perform the action
+        '''
+        assert agent in self.agent_states, 'Unknown agent!'
+        if instrument.ENABLED:
+            f_t0 = instrument.clock()
+            d_rtn = self.observe().to_dict()
+            instrument.STATS.add_time('env.sense', instrument.clock() - f_t0)
+            return d_rtn
+        # the caller is free to change the dictionary returned
+        return self.observe().to_dict()
 
     def act(self, agent, action):
         '''
@@ -258,6 +453,12 @@ class Environment(object):
         :param action: dictionary. The current action of the agent
         '''
         assert agent in self.agent_states, 'Unknown agent!'
+        b_timing = instrument.ENABLED
+        if b_timing:
+            f_t0 = instrument.clock()
+            if action and action['order_status'] in ['Filled',
+                                                     'Partially Filled']:
+                instrument.STATS.count('agent_trades')
         if action:
             assert action['action'] in self.valid_actions, 'Invalid action!'
             # Update the position using action
@@ -286,9 +487,8 @@ class Environment(object):
             state['best_offer'] = True
 
         # calculate the current PnL
-        sense = self.sense(agent)
         f_pnl = state['Ask'] - state['Bid']
-        f_pnl += state['Position'] * sense['midPrice']
+        f_pnl += state['Position'] * self.observe().midPrice
         # include costs
         f_pnl -= ((state['Ask'] + state['Bid']) * 0.00035)
         # measure the reward
@@ -297,6 +497,8 @@ class Environment(object):
 
         # substitute the last pnl by the current value
         state['Pnl'] = f_pnl
+        if b_timing:
+            instrument.STATS.add_time('env.act', instrument.clock() - f_t0)
 
         # NOTE: I could include a stop loss here
 
@@ -319,6 +521,15 @@ class Environment(object):
         # execute new action that can change current position
         agent.update(msg_env=msg)
 
+    def get_order_ids(self, agent):
+        '''
+        Return the object whose i_last_order_id attribute numbers the new
+        orders of the agent passed. The orders of the agents share the ids of
+        the book, where they are sent
+        :param agent: Agent object. The agent that sends the orders
+        '''
+        return self.order_matching.my_book
+
     def get_order_book(self):
         '''
         Return a dataframe with the first 5 levels of the current order book
@@ -333,7 +544,12 @@ class Environment(object):
         if isinstance(l_msg, dict):
             l_msg = [l_msg]
         if len(l_msg) > 0:
+            t_top = (self.order_matching.best_bid, self.order_matching.best_ask)
             self.order_matching.update(l_msg, b_print=False)
+            # the features stored are not valid anymore in this bucket
+            if t_top != (self.order_matching.best_bid,
+                         self.order_matching.best_ask):
+                self._f_dirty_bucket = self.order_matching.f_last_bucket
 
 
 class Agent(object):
@@ -352,6 +568,8 @@ class Agent(object):
         '''
         self.env = env
         self.i_id = i_id
+        # the random numbers drawn by this agent alone
+        self.rng = env.get_random(i_id)
         self.state = None
         self.position = {'qAsk': 0., 'Ask': 0., 'qBid': 0., 'Bid': 0.}
         self.d_order_tree = {'BID': FastRBTree(), 'ASK': FastRBTree()}
@@ -0,0 +1,234 @@
+import argparse
+import logging
+from os import makedirs
+from os.path import exists, join, splitext
+import time
+
+from numpy import array, dtype, load, save
+
+import async_logging
+from environment import Environment, Observation
+
+
+DEBUG = True
+
+'''
+Begin help functions
+'''
+
+# one record by row read from the file by the order matching. The records
+# are indexed by the rows read, that do not count the messages of the agents
+FEATURE_FIELDS = ['row_id', 'last_date', 'best_bid', 'best_ask']
+FEATURE_FIELDS += Observation.l_fields
+FEATURE_DTYPE = dtype([(s_key, 'f8') for s_key in FEATURE_FIELDS])
+
+
+def get_store_fname(s_dir, s_day):
+    '''
+    Return the path of the feature table related to a file of the archive
+    :param s_dir: string. The directory of the feature store
+    :param s_day: string. Name of the file in the zip archive
+    '''
+    return join(s_dir, splitext(s_day)[0] + '.npy')
+
+
+def build_feature_store(s_fname, s_dir, l_idx=None):
+    '''
+    Run the order matching once over each file of the archive, without any
+    primary agent, and save the features observed after each row is applied
+    in a table that can be memory-mapped. Return the list of tables created
+    :param s_fname: string. the container zip file to be used in simulation
+    :param s_dir: string. The directory of the feature store
+    :*param l_idx: list. Index of the files to process. All files if None
+    '''
+    if not exists(s_dir):
+        makedirs(s_dir)
+    e = Environment(s_fname=s_fname)
+    if l_idx is None:
+        l_idx = list(range(e.order_matching.max_nfiles))
+    l_rtn = []
+    for i_idx in l_idx:
+        f_start = time.time()
+        e.order_matching.idx = i_idx
+        e.reset()
+        s_day = e.order_matching.get_trial_identification()
+        my_ordmatch = e.order_matching
+        l_rows = []
+        while True:
+            try:
+                e.step()
+            except StopIteration:
+                break
+            # a crossed book is corrected before the row is applied, in a
+            # step that reads no new row. Just the row applied is stored
+            if not my_ordmatch.b_get_new_row:
+                if e.done:
+                    break
+                continue
+            s_err = 'The rows of {} are out of order'.format(s_day)
+            assert len(l_rows) == my_ordmatch.i_rows_read - 1, s_err
+            obs = e.observe()
+            l_aux = [float(my_ordmatch.row['']),
+                     float(my_ordmatch.last_date),
+                     float(my_ordmatch.best_bid[0]),
+                     float(my_ordmatch.best_ask[0])]
+            l_aux += [float(getattr(obs, s_key)) for s_key in obs.l_fields]
+            l_rows.append(tuple(l_aux))
+            if e.done:
+                break
+        s_out = get_store_fname(s_dir, s_day)
+        save(s_out, array(l_rows, dtype=FEATURE_DTYPE))
+        l_rtn.append(s_out)
+        # make sure that the next file will start from its first line
+        my_ordmatch.reset()
+        s_msg = 'build_feature_store(): {} rows of {} saved in {:0.2f} seconds'
+        s_msg = s_msg.format(len(l_rows), s_day, time.time() - f_start)
+        if DEBUG:
+            logging.info(s_msg)
+        else:
+            print(s_msg)
+    return l_rtn
+
+
+'''
+End help functions
+'''
+
+
+class FeatureStore(object):
+    '''
+    Read-only access to the feature tables created by build_feature_store()
+    '''
+    def __init__(self, s_dir):
+        '''
+        Initiate a FeatureStore object. Save all parameters as attributes
+        :param s_dir: string. The directory of the feature store
+        '''
+        self.s_dir = s_dir
+        self.d_tables = {}
+        self.i_hits = 0
+        self.i_misses = 0
+
+    def get_table(self, s_day):
+        '''
+        Return the memory-mapped table of the file passed or None if it was
+        not built yet
+        :param s_day: string. Name of the file in the zip archive
+        '''
+        if s_day not in self.d_tables:
+            s_fname = get_store_fname(self.s_dir, s_day)
+            self.d_tables[s_day] = None
+            if exists(s_fname):
+                self.d_tables[s_day] = load(s_fname, mmap_mode='r')
+        return self.d_tables[s_day]
+
+    def get_record(self, na_table, env):
+        '''
+        Return the record stored to the current row of the environment or
+        None if the market seen by the environment differs from the stored one
+        :param na_table: numpy array. The table of the current file
+        :param env: Environment object. The environment that will use it
+        '''
+        my_ordmatch = env.order_matching
+        # the crossed book is corrected in a step that does not apply the row
+        if not my_ordmatch.b_get_new_row:
+            return None
+        # the orders of the agents are also counted by i_nrow, so the rows
+        # read from the file are used to find the record
+        i_row = int(my_ordmatch.i_rows_read) - 1
+        if i_row < 0 or i_row >= na_table.shape[0]:
+            return None
+        rec = na_table[i_row]
+        # the stored features are valid while the top of the book is the same
+        if rec['row_id'] != float(my_ordmatch.row['']):
+            return None
+        if rec['best_bid'] != my_ordmatch.best_bid[0]:
+            return None
+        if rec['best_ask'] != my_ordmatch.best_ask[0]:
+            return None
+        if rec['qBid'] != my_ordmatch.best_bid[1]:
+            return None
+        if rec['qAsk'] != my_ordmatch.best_ask[1]:
+            return None
+        return rec
+
+    def get_observation(self, na_table, env, i_version):
+        '''
+        Return the Observation stored to the current row of the environment or
+        None if the market seen by the environment differs from the stored one
+        :param na_table: numpy array. The table of the current file
+        :param env: Environment object. The environment that will use it
+        :param i_version: integer. The current version of the book
+        '''
+        rec = self.get_record(na_table, env)
+        if rec is None:
+            self.i_misses += 1
+            return None
+        self.i_hits += 1
+        d_aux = dict((s_key, rec[s_key].item())
+                     for s_key in Observation.l_fields)
+        d_aux['spread'] = int(d_aux['spread'])
+        return Observation(i_version=i_version, **d_aux)
+
+
+def check_feature_store(s_fname, s_dir, agent_class, i_idx=0, f_min_time=2.,
+                        f_min_hits=0.5):
+    '''
+    Run a session of an agent that trades over one file of the archive using
+    the feature store and return the hits and the misses of the store. The
+    orders of the agent change the book just now and then, so most of the
+    observations should be read from the store
+    :param s_fname: string. the container zip file to be used in simulation
+    :param s_dir: string. The directory of the feature store
+    :param agent_class: Agent class. The primary agent
+    :*param i_idx: integer. Index of the file to process
+    :*param f_min_time: float. Minimum time in seconds between decisions
+    :*param f_min_hits: float. Raise AssertionError if the share of the
+        decisions of the agent that were taken reading the store is smaller
+        than it
+    '''
+    store = FeatureStore(s_dir)
+    e = Environment(s_fname=s_fname, i_idx=i_idx, feature_store=store)
+    a = e.create_agent(agent_class, f_min_time=f_min_time)
+    e.set_primary_agent(a)
+    e.reset()
+    s_day = e.order_matching.get_trial_identification()
+    s_err = 'There is no feature table of {} in {}'.format(s_day, s_dir)
+    assert store.get_table(s_day) is not None, s_err
+    while True:
+        try:
+            e.step()
+        except StopIteration:
+            break
+        if e.done:
+            break
+    s_msg = 'check_feature_store(): {} hits and {} misses in {} decisions of'
+    s_msg += ' {}'
+    s_msg = s_msg.format(store.i_hits, store.i_misses, e.i_decisions, s_day)
+    if DEBUG:
+        logging.info(s_msg)
+    else:
+        print(s_msg)
+    s_err = 'Just {} of {} decisions read the feature store'
+    s_err = s_err.format(store.i_hits, e.i_decisions)
+    assert store.i_hits >= f_min_hits * e.i_decisions, s_err
+    return store.i_hits, store.i_misses
+
+
+if __name__ == '__main__':
+    s_txt = 'Precompute the features observed in each file of an archive'
+    parser = argparse.ArgumentParser(description=s_txt)
+    parser.add_argument('fname', help='zip archive with the market data')
+    parser.add_argument('out', help='directory of the feature store')
+    s_help = 'index of a file to process. All files if not passed'
+    parser.add_argument('-i', '--idx', type=int, action='append', help=s_help)
+    s_help = 'check that a LearningAgent_k trading hits the store'
+    parser.add_argument('--check', action='store_true', help=s_help)
+    args = parser.parse_args()
+    if DEBUG:
+        async_logging.setup_logging()
+    build_feature_store(args.fname, args.out, args.idx)
+    if args.check:
+        from agent import LearningAgent_k
+        for i_idx in (args.idx or [0]):
+            check_feature_store(args.fname, args.out, LearningAgent_k, i_idx)
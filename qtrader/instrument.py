@@ -0,0 +1,109 @@
+from collections import defaultdict
+import logging
+from os import environ
+import time
+
+
+DEBUG = True
+# the call sites test this flag before touching the clock, so the timers cost
+# just an attribute lookup when disabled. Use enable() to change it
+ENABLED = environ.get('QTRADER_STAGE_TIMERS', '') not in ['', '0']
+
+clock = time.perf_counter
+
+
+'''
+Begin help functions
+'''
+
+
+def enable(b_enable=True):
+    '''
+    Turn on (or off) the stage timers and event counters
+    :*param b_enable: boolean. If should collect the measures
+    '''
+    global ENABLED
+    ENABLED = b_enable
+    STATS.reset()
+
+
+'''
+End help functions
+'''
+
+
+class StageStats(object):
+    '''
+    Cumulative time spent by each stage of the simulation and counters of the
+    events observed. Stages can be nested, so their times are not summed up
+    '''
+    def __init__(self):
+        '''
+        Initiate a StageStats object
+        '''
+        self.reset()
+
+    def reset(self):
+        '''
+        Forget all the measures taken
+        '''
+        self.d_time = defaultdict(float)
+        self.d_calls = defaultdict(int)
+        self.d_count = defaultdict(int)
+        self.f_start = clock()
+
+    def add_time(self, s_stage, f_elapsed):
+        '''
+        Include the time spent in one call of a stage
+        :param s_stage: string. The name of the stage
+        :param f_elapsed: float. Seconds spent
+        '''
+        self.d_time[s_stage] += f_elapsed
+        self.d_calls[s_stage] += 1
+
+    def count(self, s_event, i_n=1):
+        '''
+        Increment the counter of an event
+        :param s_event: string. The name of the event
+        :*param i_n: integer. How many events happened
+        '''
+        self.d_count[s_event] += i_n
+
+    def get_report(self):
+        '''
+        Return a string with the time of each stage, as a share of the wall
+        time since the last reset, and the counters of the events
+        '''
+        f_wall = max(clock() - self.f_start, 1e-9)
+        l_rtn = ['{:<24} {:>10} {:>10} {:>7} {:>10}'.format(
+            'stage', 'calls', 'seconds', '% wall', 'us/call')]
+        for s_stage in sorted(self.d_time):
+            f_time = self.d_time[s_stage]
+            i_calls = self.d_calls[s_stage]
+            l_rtn.append('{:<24} {:>10,d} {:>10.3f} {:>6.1f}% {:>10.2f}'.format(
+                s_stage, i_calls, f_time, 100. * f_time / f_wall,
+                1e6 * f_time / max(i_calls, 1)))
+        i_rows = self.d_count.get('rows_read', 0)
+        for s_event in sorted(self.d_count):
+            i_count = self.d_count[s_event]
+            s_line = '{:<24} {:>10,d}'.format(s_event, i_count)
+            if i_rows and s_event != 'rows_read':
+                s_line += ' ({:0.3f} by row)'.format(i_count * 1. / i_rows)
+            l_rtn.append(s_line)
+        l_rtn.append('{:<24} {:>21.3f}'.format('wall time', f_wall))
+        return '\n'.join(l_rtn)
+
+    def log_report(self, s_title='Stage timers'):
+        '''
+        Log the report of the measures taken
+        :*param s_title: string. The first line of the report
+        '''
+        s_msg = '{}:\n{}'.format(s_title, self.get_report())
+        if DEBUG:
+            logging.info(s_msg)
+        else:
+            print(s_msg)
+
+
+# the measures of the current process
+STATS = StageStats()
@@ -0,0 +1,447 @@
+from csv import reader
+from fcntl import LOCK_EX, LOCK_UN, flock
+from hashlib import sha1
+from io import TextIOWrapper
+import json
+import logging
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from os import environ, fstat, getpid, kill, remove, stat
+from os.path import abspath, join
+from tempfile import gettempdir
+import time
+import weakref
+from zipfile import ZipFile
+
+from numpy import array, dtype, int64, ndarray
+
+
+DEBUG = True
+
+# columns decoded as numbers. The others are kept as text, as the DictReader
+# used by the order matching yields them
+NUMERIC_FIELDS = ['Price', 'Size']
+
+# rows converted to dictionaries at a time, so a day is never fully copied
+# out of the arrays
+CHUNK_ROWS = 4096
+# the days decoded by this process, by (archive path, file name)
+DAYS = {}
+
+# the shared memory segments start by the size of the JSON that describes
+# the columns that follow and by the pid of each user attached (0 if free)
+SEGMENT_PREFIX = 'qtrader_'
+MAX_USERS = 1023
+HEADER_BYTES = 8 * (1 + MAX_USERS)
+
+
+'''
+Begin help functions
+'''
+
+
+def get_day_key(s_fname, s_day):
+    '''
+    Return the key of a day in the DAYS cache
+    :param s_fname: string. The container zip file
+    :param s_day: string. Name of the file in the zip archive
+    '''
+    return (abspath(s_fname), s_day)
+
+
+def get_segment_name(s_fname, s_day):
+    '''
+    Return the name of the shared memory segment of a day. It changes when the
+    archive is modified, so a stale segment is never attached
+    :param s_fname: string. The container zip file
+    :param s_day: string. Name of the file in the zip archive
+    '''
+    s_path = abspath(s_fname)
+    st = stat(s_path)
+    s_key = '{}:{}:{}:{}'.format(s_path, st.st_size, int(st.st_mtime), s_day)
+    return SEGMENT_PREFIX + sha1(s_key.encode()).hexdigest()[:20]
+
+
+def align(i_offset, i_bytes=64):
+    '''
+    Return the first offset multiple of i_bytes not smaller than i_offset
+    :param i_offset: integer. An offset in bytes
+    :*param i_bytes: integer. The alignment
+    '''
+    return -(-i_offset // i_bytes) * i_bytes
+
+
+class SegmentLock(object):
+    '''
+    A lock on a file, held while a shared memory segment is created, attached
+    or detached, so its reference count is updated by one process at a time,
+    even by processes that were not forked from the same parent. The file is
+    removed together with the segment
+    '''
+    def __init__(self, s_name):
+        '''
+        Initiate a SegmentLock object
+        :param s_name: string. The name of the segment
+        '''
+        self.s_fname = join(gettempdir(), s_name + '.lock')
+        self.fw = None
+
+    def __enter__(self):
+        while True:
+            self.fw = open(self.s_fname, 'a')
+            flock(self.fw, LOCK_EX)
+            # the file may have been removed by the holder of the lock while
+            # this process waited for it. Then lock the new one
+            try:
+                if stat(self.s_fname).st_ino == fstat(self.fw.fileno()).st_ino:
+                    return self
+            except FileNotFoundError:
+                pass
+            flock(self.fw, LOCK_UN)
+            self.fw.close()
+
+    def remove(self):
+        '''
+        Remove the file of the lock. Call it holding the lock
+        '''
+        try:
+            remove(self.s_fname)
+        except FileNotFoundError:
+            pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        flock(self.fw, LOCK_UN)
+        self.fw.close()
+
+
+def is_alive(i_pid):
+    '''
+    Return if a process is running
+    :param i_pid: integer. The process id
+    '''
+    try:
+        kill(i_pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def open_segment(s_name, i_size=0):
+    '''
+    Return a shared memory segment, created if a size is passed. Its lifetime
+    is ruled by the reference count, so the resource tracker of the process
+    must not destroy it at exit. Call it holding the SegmentLock
+    :param s_name: string. The name of the segment
+    :*param i_size: integer. Size of the segment to be created, in bytes
+    '''
+    if i_size:
+        shm = SharedMemory(name=s_name, create=True, size=i_size)
+    else:
+        shm = SharedMemory(name=s_name)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+def purge_users(na_head):
+    '''
+    Free the slots of the users that died without detaching. Return the
+    number of users still attached. Call it holding the SegmentLock
+    :param na_head: numpy array. The header of the segment
+    '''
+    na_users = na_head[1:]
+    for i_pid in set(na_users[na_users != 0].tolist()):
+        if not is_alive(i_pid):
+            na_users[na_users == i_pid] = 0
+    return int((na_users != 0).sum())
+
+
+def release_segment(s_name, shm):
+    '''
+    Stop counting the current process as a user of the segment, destroying it
+    if no one else is attached. It is the finalizer of the SharedDay objects,
+    so it runs once, on detach(), when the object is collected or at exit
+    :param s_name: string. The name of the segment
+    :param shm: SharedMemory object. The segment
+    '''
+    with SegmentLock(s_name) as lock:
+        na_head = ndarray((1 + MAX_USERS,), dtype=int64, buffer=shm.buf)
+        na_users = na_head[1:]
+        na_mine = (na_users == getpid()).nonzero()[0]
+        if len(na_mine):
+            na_users[na_mine[0]] = 0
+        i_users = purge_users(na_head)
+        del na_users, na_head
+        if not i_users:
+            # unlink() tells the resource tracker it is gone
+            resource_tracker.register(shm._name, 'shared_memory')
+            shm.unlink()
+            lock.remove()
+    try:
+        shm.close()
+    except BufferError:
+        # some column is still referenced. The memory is released by the
+        # garbage collector instead
+        pass
+
+
+'''
+End help functions
+'''
+
+
+class MarketDay(object):
+    '''
+    The rows of one file of the archive decoded once and kept by column, so
+    many simulations of the same day skip the unzip and the CSV parsing
+    '''
+    def __init__(self, s_day, l_fields, d_columns):
+        '''
+        Initiate a MarketDay object. Save all parameters as attributes
+        :param s_day: string. Name of the file in the zip archive
+        :param l_fields: list. The header of the file
+        :param d_columns: dictionary. An array by field
+        '''
+        self.s_day = s_day
+        self.l_fields = l_fields
+        self.d_columns = d_columns
+
+    @classmethod
+    def from_archive(cls, archive, info):
+        '''
+        Return a MarketDay with the rows of a file of the archive
+        :param archive: ZipFile object. The container zip file
+        :param info: ZipInfo object. The file to be decoded
+        '''
+        fr_csv = reader(TextIOWrapper(archive.open(info)))
+        l_fields = next(fr_csv)
+        l_cols = list(zip(*fr_csv)) or [()] * len(l_fields)
+        d_columns = {}
+        for s_key, t_col in zip(l_fields, l_cols):
+            if s_key in NUMERIC_FIELDS:
+                d_columns[s_key] = array(t_col, dtype=float)
+            else:
+                d_columns[s_key] = array(t_col, dtype=str)
+        return cls(info.filename, l_fields, d_columns)
+
+    def __len__(self):
+        return len(self.d_columns[self.l_fields[0]])
+
+    def iter_rows(self):
+        '''
+        Yield a new dictionary by row, as the DictReader does. The order
+        matching changes the rows it reads, so they can not be reused
+        '''
+        l_fields = self.l_fields
+        l_arrays = [self.d_columns[s_key] for s_key in l_fields]
+        for i_start in range(0, len(self), CHUNK_ROWS):
+            l_cols = [na[i_start:i_start + CHUNK_ROWS].tolist()
+                      for na in l_arrays]
+            for t_row in zip(*l_cols):
+                yield dict(zip(l_fields, t_row))
+
+
+class SharedDay(object):
+    '''
+    A MarketDay whose columns live in a named shared memory segment, so all
+    the simulations of a host read the same copy of the day. The segment
+    counts the processes attached to it and is destroyed by the last one to
+    detach. A process that does not call detach() is detached when the object
+    is collected or, at the latest, when the interpreter exits
+    '''
+    def __init__(self, s_name, shm):
+        '''
+        Initiate a SharedDay object. Build the arrays of the columns over the
+        buffer of the segment. The caller counts it as attached
+        :param s_name: string. The name of the segment
+        :param shm: SharedMemory object. The segment
+        '''
+        self.s_name = s_name
+        self.shm = shm
+        self.na_head = ndarray((1 + MAX_USERS,), dtype=int64, buffer=shm.buf)
+        i_json = int(self.na_head[0])
+        d_desc = json.loads(bytes(shm.buf[HEADER_BYTES:HEADER_BYTES + i_json]))
+        i_data = align(HEADER_BYTES + i_json)
+        d_columns = {}
+        for s_key, s_dtype, i_offset in d_desc['columns']:
+            d_columns[s_key] = ndarray((d_desc['rows'],), dtype=dtype(s_dtype),
+                                       buffer=shm.buf,
+                                       offset=i_data + i_offset)
+            d_columns[s_key].setflags(write=False)
+        self.day = MarketDay(d_desc['day'], d_desc['fields'], d_columns)
+        # a finalizer, unlike __del__, also runs at exit while the modules
+        # it uses are still available
+        self._finalizer = weakref.finalize(self, release_segment, s_name, shm)
+
+    @classmethod
+    def publish(cls, s_fname, day):
+        '''
+        Copy a decoded day to its segment, unless another process did it
+        already, and return it attached
+        :param s_fname: string. The container zip file
+        :param day: MarketDay object. The day to be shared
+        '''
+        s_name = get_segment_name(s_fname, day.s_day)
+        with SegmentLock(s_name):
+            try:
+                shm = open_segment(s_name)
+            except FileNotFoundError:
+                l_desc = []
+                i_offset = 0
+                for s_key in day.l_fields:
+                    na_col = day.d_columns[s_key]
+                    i_offset = align(i_offset, 8)
+                    l_desc.append([s_key, na_col.dtype.str, i_offset])
+                    i_offset += na_col.nbytes
+                d_desc = {'day': day.s_day, 'fields': day.l_fields,
+                          'rows': len(day), 'columns': l_desc}
+                s_json = json.dumps(d_desc).encode()
+                i_data = align(HEADER_BYTES + len(s_json))
+                shm = open_segment(s_name, max(i_data + i_offset, 1))
+                na_head = ndarray((1 + MAX_USERS,), dtype=int64,
+                                  buffer=shm.buf)
+                na_head[:] = 0
+                na_head[0] = len(s_json)
+                del na_head
+                shm.buf[HEADER_BYTES:HEADER_BYTES + len(s_json)] = s_json
+                for s_key, s_dtype, i_offset in l_desc:
+                    na_col = day.d_columns[s_key]
+                    na_aux = ndarray(na_col.shape, dtype=na_col.dtype,
+                                     buffer=shm.buf, offset=i_data + i_offset)
+                    na_aux[:] = na_col
+                    del na_aux
+            obj = cls(s_name, shm)
+            obj._add_user()
+        return obj
+
+    @classmethod
+    def attach(cls, s_fname, s_day):
+        '''
+        Return the day attached to its segment, or None if it was not
+        published
+        :param s_fname: string. The container zip file
+        :param s_day: string. Name of the file in the zip archive
+        '''
+        s_name = get_segment_name(s_fname, s_day)
+        # look for the segment before taking the lock, so the runs that do
+        # not publish days do not create lock files
+        try:
+            shm = open_segment(s_name)
+        except FileNotFoundError:
+            return None
+        shm.close()
+        with SegmentLock(s_name):
+            try:
+                shm = open_segment(s_name)
+            except FileNotFoundError:
+                return None
+            obj = cls(s_name, shm)
+            obj._add_user()
+        return obj
+
+    def _add_user(self):
+        '''
+        Count the current process as attached. Call it holding the
+        SegmentLock
+        '''
+        purge_users(self.na_head)
+        na_users = self.na_head[1:]
+        na_free = (na_users == 0).nonzero()[0]
+        if not len(na_free):
+            raise MemoryError('{} has no free user slot'.format(self.s_name))
+        na_users[na_free[0]] = getpid()
+
+    def get_refcount(self):
+        '''
+        Return the number of users attached to the segment. A process counts
+        once for each time it attached
+        '''
+        return int((self.na_head[1:] != 0).sum())
+
+    def detach(self):
+        '''
+        Stop using the segment, destroying it if no one else is attached.
+        The rows yielded by the day must not be read anymore
+        '''
+        if self.shm is None:
+            return
+        self.day.d_columns = {}
+        self.day = None
+        self.na_head = None
+        self.shm = None
+        self._finalizer()
+
+
+def preload_days(s_fname, l_idx=None):
+    '''
+    Decode the files of the archive and keep them in the DAYS cache, where
+    the order matching looks for a day before reading the archive. Return the
+    number of rows decoded
+    :param s_fname: string. The container zip file
+    :*param l_idx: list. Index of the files to decode. All files if None
+    '''
+    f_start = time.time()
+    i_rows = 0
+    with ZipFile(s_fname, 'r') as archive:
+        l_infos = archive.infolist()
+        if l_idx is None:
+            l_idx = list(range(len(l_infos)))
+        for i_idx in l_idx:
+            info = l_infos[i_idx]
+            s_key = get_day_key(s_fname, info.filename)
+            if s_key not in DAYS:
+                DAYS[s_key] = MarketDay.from_archive(archive, info)
+            i_rows += len(DAYS[s_key])
+    s_msg = 'preload_days(): {} rows of {} files decoded in {:0.2f} seconds'
+    s_msg = s_msg.format(i_rows, len(l_idx), time.time() - f_start)
+    if DEBUG:
+        logging.info(s_msg)
+    else:
+        print(s_msg)
+    return i_rows
+
+
+def get_day(s_fname, s_day):
+    '''
+    Return the MarketDay of a file of the archive, if it was preloaded, or
+    None
+    :param s_fname: string. The container zip file
+    :param s_day: string. Name of the file in the zip archive
+    '''
+    return DAYS.get(get_day_key(s_fname, s_day))
+
+
+def publish_days(s_fname, l_idx=None):
+    '''
+    Decode the files of the archive into shared memory segments, that the
+    order matching of any process of the host attaches to instead of
+    reading the archive. Return the SharedDay objects, that must be detached
+    when the days are not needed anymore
+    :param s_fname: string. The container zip file
+    :*param l_idx: list. Index of the files to publish. All files if None
+    '''
+    l_rtn = []
+    with ZipFile(s_fname, 'r') as archive:
+        l_infos = archive.infolist()
+        if l_idx is None:
+            l_idx = list(range(len(l_infos)))
+        for i_idx in l_idx:
+            info = l_infos[i_idx]
+            shared_day = SharedDay.attach(s_fname, info.filename)
+            if shared_day is None:
+                day = get_day(s_fname, info.filename)
+                if day is None:
+                    day = MarketDay.from_archive(archive, info)
+                shared_day = SharedDay.publish(s_fname, day)
+            l_rtn.append(shared_day)
+    return l_rtn
+
+
+# a forkserver started with these variables set imports this module before
+# forking the workers, so they start with the days already decoded. They are
+# removed, so the workers do not pass them to their own children
+if environ.get('QTRADER_PRELOAD_ARCHIVE'):
+    s_aux = environ.pop('QTRADER_PRELOAD_DAYS', '')
+    preload_days(environ.pop('QTRADER_PRELOAD_ARCHIVE'),
+                 [int(x) for x in s_aux.split(',') if x] or None)
@@ -1,9 +1,12 @@
 import logging
 from zipfile import ZipFile
 from csv import DictReader
+from io import TextIOWrapper
 from pprint import pprint
 
 import book
+import instrument
+import market_data
 from translators import translate_trades, translate_row
 
 
@@ -106,6 +109,15 @@ class BloombergMatching(OrderMatching):
         self.b_get_new_row = True
         self.f_last_bucket = 0.
         self.f_seconds_to_group = 21.
+        # incremented every time the book is touched. Used to invalidate
+        # the observations cached by the environment
+        self.i_book_version = 0
+        # the day in shared memory being read, if any
+        self.shared_day = None
+        self.fr_open = None
+        # rows read from the current file, to find the position again when
+        # the object is restored from a checkpoint
+        self.i_rows_read = 0
         if i_idx:
             self.idx = i_idx
 
@@ -117,6 +129,54 @@ class BloombergMatching(OrderMatching):
             return None
         return self.l_fnames[int(self.idx)].filename
 
+    def __getstate__(self):
+        '''
+        Return the attributes to be pickled. The archive and the file being
+        read are opened again by the restored object
+        '''
+        d_state = dict(self.__dict__)
+        for s_key in ['archive', 'fr_open', 'shared_day']:
+            d_state[s_key] = None
+        return d_state
+
+    def __setstate__(self, d_state):
+        '''
+        Restore the attributes pickled and open the archive again
+        :param d_state: dictionary. Returned by __getstate__()
+        '''
+        self.__dict__.update(d_state)
+        self.archive = ZipFile(self.s_fname, 'r')
+
+    def open_day(self):
+        '''
+        Open the current file to be read from its first row, using the day
+        already decoded by this process or published in shared memory, if any
+        '''
+        s_fname = self.l_fnames[int(self.idx)]
+        self.fr_open = None
+        self.detach_shared_day()
+        self.i_rows_read = 0
+        day = market_data.get_day(self.s_fname, s_fname.filename)
+        if day is None:
+            self.shared_day = market_data.SharedDay.attach(
+                self.s_fname, s_fname.filename)
+            if self.shared_day:
+                day = self.shared_day.day
+        if day is not None:
+            self.fr_open = day.iter_rows()
+        else:
+            self.fr_open = DictReader(
+                TextIOWrapper(self.archive.open(s_fname)))
+
+    def detach_shared_day(self):
+        '''
+        Stop reading the day attached in shared memory, if any
+        '''
+        if self.shared_day:
+            self.fr_open = None
+            self.shared_day.detach()
+            self.shared_day = None
+
     def reshape_row(self, idx, row, s_side=None):
         '''
         Translate a line from a file of the bloomberg level I data
@@ -147,6 +207,8 @@ class BloombergMatching(OrderMatching):
             self.obj_best_ask = None
             self.mid_price_10s = 0.
             self.f_last_bucket = 0.
+            self.i_book_version += 1
+            self.detach_shared_day()
 
     def update(self, l_msg, b_print=False):
         '''
@@ -154,6 +216,9 @@ class BloombergMatching(OrderMatching):
         :param l_msg: list. messages to use to update the book
         :*param b_print: boolean. If should print the messaged generated
         '''
+        b_timing = instrument.ENABLED
+        if b_timing:
+            f_t0 = instrument.clock()
         if l_msg:
             # process each message generated by translator
             for msg in l_msg:
@@ -171,6 +236,9 @@ class BloombergMatching(OrderMatching):
                         self.i_qty_traded_at_ask += msg['order_qty']
                     else:
                         self.i_qty_traded_at_bid += msg['order_qty']
+        if b_timing:
+            f_t1 = instrument.clock()
+            instrument.STATS.add_time('book.update', f_t1 - f_t0)
         # keep the best- bid and offer in a variable
         i_bid_count = self.my_book.book_bid.price_tree.count
         i_ask_count = self.my_book.book_ask.price_tree.count
@@ -210,8 +278,17 @@ class BloombergMatching(OrderMatching):
             self.i_qty_traded_at_ask_10s = self.i_qty_traded_at_ask
             self.i_qty_traded_at_ask_10s += 1 - 1
             self.mid_price_10s = (self.best_bid[0] + self.best_ask[0])/2.
+        if b_timing:
+            instrument.STATS.add_time('book.ofi', instrument.clock() - f_t1)
         # terminate
         self.i_nrow += 1
+        self.i_book_version += 1
+
+    def __next__(self):
+        '''
+        Return a list of messages from the agents related to the current step
+        '''
+        return self.next()
 
     def next(self, b_print=False):
         '''
@@ -225,16 +302,30 @@ class BloombergMatching(OrderMatching):
             raise StopIteration
         # if it is the first line of the file, open it and cerate a new book
         if self.i_nrow == 0:
-            s_fname = self.l_fnames[int(self.idx)]
-            self.fr_open = DictReader(self.archive.open(s_fname))
+            self.open_day()
             self.my_book = book.LimitOrderBook(self.s_instrument)
+        elif self.fr_open is None:
+            # restored from a checkpoint. Skip the rows already read
+            i_rows_read = self.i_rows_read
+            self.open_day()
+            for _ in range(i_rows_read):
+                next(self.fr_open)
+            self.i_rows_read = i_rows_read
+        b_timing = instrument.ENABLED
         # try to read a row of an already opened file
         try:
             # check if should get a new row form the file
             l_msg = []
             if self.b_get_new_row:
+                if b_timing:
+                    f_t0 = instrument.clock()
                 row = next(self.fr_open)
                 self.row = row
+                self.i_rows_read += 1
+                if b_timing:
+                    instrument.STATS.add_time('matching.read_row',
+                                              instrument.clock() - f_t0)
+                    instrument.STATS.count('rows_read')
             else:
                 row = self.row
                 self.b_get_new_row = True
@@ -257,6 +348,9 @@ class BloombergMatching(OrderMatching):
                 if self.best_bid[0] >= self.best_ask[0]:
                     # set to not get a new row before correct that
                     self.b_get_new_row = False
+                    if b_timing:
+                        instrument.STATS.count('crossed_corrections')
+                        f_t0 = instrument.clock()
                     row_aux = row.copy()
                     row_aux['Type'] = 'TRADE'
                     row_aux['Size'] = min(self.best_ask[1], self.best_bid[1])
@@ -268,6 +362,9 @@ class BloombergMatching(OrderMatching):
                     row['Price'] = self.best_ask[0]
                     l_msg = self.reshape_row(self.i_nrow, row, 'ASK')
                     l_msg += l_msg_aux
+                    if b_timing:
+                        instrument.STATS.add_time('matching.translate',
+                                                  instrument.clock() - f_t0)
                     # [debug] start PRINT BOOKS WHEN THE BID-ASK CROSSED
                     # print 'id: {}, date: {}'.format(self.row[''],
                     #                                 self.row['Date'])
@@ -280,14 +377,21 @@ class BloombergMatching(OrderMatching):
                     pass
             # reshape the row to messages to order book when it wasnt yet
             if len(l_msg) == 0:
+                if b_timing:
+                    f_t0 = instrument.clock()
                 # reshape the row to messages to order book
                 l_msg = self.reshape_row(self.i_nrow, row)
+                if b_timing:
+                    instrument.STATS.add_time('matching.translate',
+                                              instrument.clock() - f_t0)
             # measure the time in seconds
             l_aux = row['Date'].split(' ')[1].split(':')
             i_aux = sum([int(a)*60**b for a, b in zip(l_aux, [2, 1, 0])])
             self.last_date = i_aux
             # update the book
             self.update(l_msg, b_print=b_print)
+            if b_timing:
+                instrument.STATS.count('messages', len(l_msg))
             return l_msg
         except StopIteration:
             self.i_nrow = 0
@@ -304,4 +408,6 @@ class BloombergMatching(OrderMatching):
             self.obj_best_bid = None
             self.obj_best_ask = None
             self.mid_price_10s = 0.
+            self.i_book_version += 1
+            self.detach_shared_day()
             raise StopIteration
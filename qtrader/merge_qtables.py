@@ -0,0 +1,137 @@
+from collections import defaultdict
+from os.path import exists
+from sys import argv
+
+from numpy import isnan, load
+from pandas import DataFrame, read_csv
+
+import state_space
+from simulator import get_nvisits_fname
+
+
+'''
+Begin help functions
+'''
+
+
+class InvalidOptionException(Exception):
+    """
+    InvalidOptionException is raised when the merge tool is called without
+    the files needed
+    """
+    pass
+
+
+def get_canonical_state(s_state):
+    '''
+    Return the state key in the order used by the agents, so tables saved with
+    a different key order are merged. Unknown keys are returned as they are
+    :param s_state: string. The key of the state in the Q-table
+    '''
+    try:
+        d_state = state_space.parse_state(s_state)
+        return str(state_space.index_to_state(state_space.state_to_index(d_state)))
+    except (ValueError, SyntaxError, TypeError, KeyError):
+        return s_state
+
+
+def iter_qtable(s_fname):
+    '''
+    Iterate over the (state, action, Q-value, visits) of a Q-table. The
+    visits are None when they were not saved with the Q-table
+    :param s_fname: string. Path to a qtable log or to a shared snapshot
+    '''
+    # snapshots of the shared Q-table hold both tables as dense arrays
+    if s_fname.endswith('.npz'):
+        d_aux = load(s_fname)
+        q_table = state_space.array_to_qtable(d_aux['qtable'])
+        nvisits = state_space.array_to_qtable(d_aux['nvisits'])
+        for s_state, d_actions in q_table.items():
+            for s_action, f_val in d_actions.items():
+                f_n = nvisits.get(s_state, {}).get(s_action, 0.)
+                yield s_state, s_action, f_val, f_n
+        return
+    df_q = read_csv(s_fname, sep='\t', index_col=0)
+    df_n = None
+    s_nvisits = get_nvisits_fname(s_fname)
+    if s_nvisits != s_fname and exists(s_nvisits):
+        df_n = read_csv(s_nvisits, sep='\t', index_col=0)
+    for s_state, row in df_q.iterrows():
+        for s_key, f_val in row.items():
+            if isnan(f_val):
+                continue
+            f_n = None
+            if df_n is not None:
+                f_n = 0.
+                if s_state in df_n.index and s_key in df_n.columns:
+                    f_n = df_n.at[s_state, s_key]
+                    f_n = 0. if isnan(f_n) else f_n
+            # the None action is saved without a name
+            s_action = s_key
+            if s_key.startswith('Unnamed'):
+                s_action = None
+            yield s_state, s_action, f_val, f_n
+
+
+def merge_qtables(l_fnames):
+    '''
+    Merge many Q-tables into a single one, averaging each Q-value weighted by
+    its number of visits. The values of (state, action) that were not visited
+    in any table are simply averaged. The tables are read one at a time, so
+    the memory used is bounded by the size of the state space. Return the
+    merged Q-table and visits as dictionaries
+    :param l_fnames: list. Paths to the qtables (or shared snapshots)
+    '''
+    d_wq = defaultdict(lambda: defaultdict(float))
+    d_w = defaultdict(lambda: defaultdict(float))
+    d_q = defaultdict(lambda: defaultdict(float))
+    d_count = defaultdict(lambda: defaultdict(float))
+    for s_fname in l_fnames:
+        for s_state, s_action, f_val, f_n in iter_qtable(s_fname):
+            s_state = get_canonical_state(s_state)
+            # tables without visits count as one visit by value
+            if f_n is None:
+                f_n = 1.
+            d_wq[s_state][s_action] += f_n * f_val
+            d_w[s_state][s_action] += f_n
+            d_q[s_state][s_action] += f_val
+            d_count[s_state][s_action] += 1.
+    q_table = defaultdict(dict)
+    nvisits = defaultdict(dict)
+    for s_state in d_count:
+        for s_action, f_count in d_count[s_state].items():
+            f_w = d_w[s_state][s_action]
+            if f_w > 0:
+                f_val = d_wq[s_state][s_action] / f_w
+            else:
+                f_val = d_q[s_state][s_action] / f_count
+            q_table[s_state][s_action] = f_val
+            nvisits[s_state][s_action] = f_w
+    return dict(q_table), dict(nvisits)
+
+
+def save_merged_qtable(l_fnames, s_out):
+    '''
+    Merge many Q-tables and save the result (and its visits) in the same
+    format used by the simulator, so it can be loaded by set_qtable()
+    :param l_fnames: list. Paths to the qtables (or shared snapshots)
+    :param s_out: string. Path of the merged qtable
+    '''
+    q_table, nvisits = merge_qtables(l_fnames)
+    DataFrame(q_table).T.to_csv(s_out, sep='\t')
+    DataFrame(nvisits).T.to_csv(get_nvisits_fname(s_out), sep='\t')
+    return s_out
+
+
+'''
+End help functions
+'''
+
+
+if __name__ == '__main__':
+    if len(argv) < 3:
+        s_err = '\nRun "python qtrader/merge_qtables.py <OUTPUT> <QTABLE>'
+        s_err += ' [<QTABLE> ...]" to merge Q-tables saved by the simulator.'
+        raise InvalidOptionException(s_err)
+    s_rtn = save_merged_qtable(l_fnames=argv[2:], s_out=argv[1])
+    print('Merged {} Q-tables into {}'.format(len(argv) - 2, s_rtn))
@@ -0,0 +1,187 @@
+from os import getpid, makedirs, replace, sysconf
+from os.path import dirname, exists
+import resource
+
+
+'''
+Begin help functions
+'''
+
+
+def get_rss_bytes():
+    '''
+    Return the resident memory of the current process, in bytes. Fall back to
+    the peak resident memory where /proc is not available
+    '''
+    try:
+        with open('/proc/{}/statm'.format(getpid())) as fr:
+            i_pages = int(fr.read().split()[1])
+        return i_pages * sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def format_labels(d_labels):
+    '''
+    Return the labels of a sample in the Prometheus text format
+    :param d_labels: dictionary. Label values by name
+    '''
+    if not d_labels:
+        return ''
+    l_aux = []
+    for s_key in sorted(d_labels):
+        s_val = str(d_labels[s_key]).replace('\\', '\\\\').replace('"', '\\"')
+        l_aux.append('{}="{}"'.format(s_key, s_val))
+    return '{' + ','.join(l_aux) + '}'
+
+
+def get_agent_label(agent):
+    '''
+    Return the label used to identify an agent in the metrics
+    :param agent: Agent object. The agent
+    '''
+    return '{}_{}'.format(getattr(agent, 's_agent_name', 'Agent'), agent.i_id)
+
+
+'''
+End help functions
+'''
+
+
+class MetricsFile(object):
+    '''
+    A file with metrics in the Prometheus text format, rewritten atomically
+    every time write() is called, so a scraper (or watch) never reads it half
+    written
+    '''
+    def __init__(self, s_fname, s_prefix='qtrader'):
+        '''
+        Initiate a MetricsFile object. Save all parameters as attributes
+        :param s_fname: string. Path of the metrics file
+        :*param s_prefix: string. Prefix of the name of the metrics
+        '''
+        self.s_fname = s_fname
+        self.s_prefix = s_prefix
+        self.d_metrics = {}
+        s_dir = dirname(s_fname)
+        if s_dir and not exists(s_dir):
+            makedirs(s_dir)
+
+    def set(self, s_name, f_value, d_labels=None, s_help='', s_type='gauge'):
+        '''
+        Set the value of a sample of a metric
+        :param s_name: string. The name of the metric, without the prefix
+        :param f_value: float. The value of the sample
+        :*param d_labels: dictionary. Label values by name
+        :*param s_help: string. The description of the metric
+        :*param s_type: string. The Prometheus type of the metric
+        '''
+        s_name = '{}_{}'.format(self.s_prefix, s_name)
+        if s_name not in self.d_metrics:
+            self.d_metrics[s_name] = {'help': s_help, 'type': s_type,
+                                      'samples': {}}
+        d_metric = self.d_metrics[s_name]
+        d_metric['samples'][format_labels(d_labels)] = f_value
+
+    def get_text(self):
+        '''
+        Return all the metrics set in the Prometheus text format
+        '''
+        l_rtn = []
+        for s_name in sorted(self.d_metrics):
+            d_metric = self.d_metrics[s_name]
+            if d_metric['help']:
+                l_rtn.append('# HELP {} {}'.format(s_name, d_metric['help']))
+            l_rtn.append('# TYPE {} {}'.format(s_name, d_metric['type']))
+            for s_labels, f_value in sorted(d_metric['samples'].items()):
+                l_rtn.append('{}{} {}'.format(s_name, s_labels,
+                                              repr(float(f_value))))
+        return '\n'.join(l_rtn) + '\n'
+
+    def write(self):
+        '''
+        Write the metrics to a temporary file and rename it over the metrics
+        file, that is an atomic operation
+        '''
+        s_tmp = '{}.{}.tmp'.format(self.s_fname, getpid())
+        with open(s_tmp, 'w') as fw:
+            fw.write(self.get_text())
+        replace(s_tmp, self.s_fname)
+
+    def set_simulation(self, env, d_report):
+        '''
+        Set the metrics of a simulation: the throughput and progress reported
+        by the Simulator, the PnL, reward and Q-table size of each learning
+        agent, the size of the book and the memory used
+        :param env: Environment object. The environment simulated
+        :param d_report: dictionary. Returned by ProgressReport.get_report()
+        '''
+        self.set('rows_per_second', d_report['rows_per_sec'],
+                 s_help='Rows of the market data processed by second')
+        self.set('decisions_per_second', d_report['decisions_per_sec'],
+                 s_help='Updates of the primary agents by second')
+        self.set('rows', d_report['rows'],
+                 s_help='Rows processed in the current session')
+        self.set('trial', d_report['trial'], s_help='Current trial')
+        self.set('trials', d_report['n_trials'], s_help='Trials to be run')
+        self.set('session', d_report['session'], s_help='Current session')
+        self.set('sessions', d_report['n_sessions'],
+                 s_help='Sessions by trial')
+        self.set('market_time_seconds', env.order_matching.last_date,
+                 s_help='Market time of the last row, in seconds')
+        for s_key, s_what in [('eta_trial', 'trial'), ('eta_run', 'run')]:
+            # NaN while there is no progress to estimate from
+            if d_report[s_key] == d_report[s_key]:
+                self.set(s_key + '_seconds', d_report[s_key],
+                         s_help='Estimated seconds to finish the ' + s_what)
+        for agent in env.get_learning_agents():
+            d_labels = {'agent': get_agent_label(agent)}
+            self.set('agent_pnl', env.agent_states[agent]['Pnl'], d_labels,
+                     s_help='PnL of the agent in the current session')
+            # a gauge, as the sum of the rewards can decrease. The suffix
+            # _total is kept to the counters
+            self.set('agent_reward_sum',
+                     getattr(agent, 'f_total_reward', 0.), d_labels,
+                     s_help='Sum of the rewards received by the agent')
+            if hasattr(agent, 'q_table'):
+                self.set('agent_qtable_states', len(agent.q_table), d_labels,
+                         s_help='States in the Q-table of the agent')
+        my_book = getattr(env.order_matching, 'my_book', None)
+        if my_book:
+            d_stats = my_book.get_basic_stats()
+            for s_side in ['bid', 'ask']:
+                d_labels = {'side': s_side}
+                self.set('book_orders', d_stats['n_order_' + s_side],
+                         d_labels, s_help='Orders resting in the book')
+                self.set('book_price_levels', d_stats['n_price_' + s_side],
+                         d_labels, s_help='Price levels in the book')
+        self.set('resident_memory_bytes', get_rss_bytes(),
+                 s_help='Resident memory of the process')
+
+    def set_search(self, d_search):
+        '''
+        Set the metrics of a search by successive halving: the current round,
+        its budget and the configurations that survived to it, the best score
+        of the last round finished and the throughput of the tasks
+        :param d_search: dictionary. 'round', 'budget', 'survivors',
+            'best_score' (None before the first round finishes),
+            'round_tasks', 'round_tasks_done', 'tasks_done' and
+            'tasks_per_sec'
+        '''
+        self.set('search_round', d_search['round'], s_help='Current round')
+        self.set('search_budget', d_search['budget'],
+                 s_help='Budget of each configuration in the current round')
+        self.set('search_survivors', d_search['survivors'],
+                 s_help='Configurations run in the current round')
+        if d_search['best_score'] is not None:
+            self.set('search_best_score', d_search['best_score'],
+                     s_help='Best score of the last round finished')
+        self.set('search_round_tasks', d_search['round_tasks'],
+                 s_help='Tasks of the current round')
+        self.set('search_round_tasks_done', d_search['round_tasks_done'],
+                 s_help='Tasks of the current round finished')
+        self.set('search_tasks_done_total', d_search['tasks_done'],
+                 s_help='Tasks finished by the search', s_type='counter')
+        self.set('search_tasks_per_second', d_search['tasks_per_sec'],
+                 s_help='Tasks finished by second since the search started')
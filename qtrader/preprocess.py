@@ -1,11 +1,11 @@
-from os.path import join, dirname
+from os.path import dirname
 from zipfile import ZipFile
 from csv import DictReader
-from pickle import load
 import time
 
 from numpy import array, log
-from pandas import Series
+
+from artefacts import get_artefact
 
 BASE_DIR = dirname(dirname(__file__))
 
@@ -163,14 +163,14 @@ class ClusterScaler(object):
         '''
         Initialize a Scaler object
         '''
-        self.kmeans = load(open('data/kmeans.dat', 'r'))
-        self.pca = load(open('data/pca.dat', 'r'))
+        self.kmeans = get_artefact('data/kmeans.dat')
+        self.pca = get_artefact('data/pca.dat')
         self.d_scale = {}
-        self.d_scale['OFI'] = load(open('data/scale_ofi.dat', 'r'))
-        self.d_scale['qBID'] = load(open('data/scale_qbid.dat', 'r'))
-        scale_aux = load(open('data/scale_bookratio.dat', 'r'))
+        self.d_scale['OFI'] = get_artefact('data/scale_ofi.dat')
+        self.d_scale['qBID'] = get_artefact('data/scale_qbid.dat')
+        scale_aux = get_artefact('data/scale_bookratio.dat')
         self.d_scale['BOOK_RATIO'] = scale_aux
-        self.d_scale['LOG_RET'] = load(open('data/logret.dat', 'r'))
+        self.d_scale['LOG_RET'] = get_artefact('data/logret.dat')
 
     def transform(self, d_feat):
         '''
@@ -186,12 +186,13 @@ class ClusterScaler(object):
         d_data['LOG_RET'] = d_feat['LOG_RET']
         for s_key in ['OFI', 'qBID', 'BOOK_RATIO', 'LOG_RET']:
             f_value = array([1. * d_data[s_key]]).reshape(1, -1)
-            d_data[s_key] = float(self.d_scale[s_key].transform(f_value))
+            d_data[s_key] = self.d_scale[s_key].transform(f_value)[0, 0]
         # aplpy PCA to reduce to two dimensions
-        na_val_pca = Series(d_data).values.reshape(1, -1)
+        # the features are ordered by name, as the models were fitted
+        na_val_pca = array([[d_data[s_key] for s_key in sorted(d_data)]])
         na_val_pca = self.pca.transform(na_val_pca)
         # return the cluster (from 10) using kmeans
-        return int(self.kmeans.predict(na_val_pca))
+        return int(self.kmeans.predict(na_val_pca)[0])
 
 
 class LessClustersScaler(object):
@@ -202,10 +203,10 @@ class LessClustersScaler(object):
         '''
         Initialize a Scaler object
         '''
-        self.kmeans = load(open('data/kmeans_2.dat', 'r'))
+        self.kmeans = get_artefact('data/kmeans_2.dat')
         self.d_scale = {}
-        self.d_scale['OFI'] = load(open('data/scale_ofi_2.dat', 'r'))
-        scale_aux = load(open('data/scale_bookratio_2.dat', 'r'))
+        self.d_scale['OFI'] = get_artefact('data/scale_ofi_2.dat')
+        scale_aux = get_artefact('data/scale_bookratio_2.dat')
         self.d_scale['BOOK_RATIO'] = scale_aux
 
     def transform(self, d_feat):
@@ -220,15 +221,15 @@ class LessClustersScaler(object):
         d_data['BOOK_RATIO'] = log(d_feat['BOOK_RATIO'])
         for s_key in ['OFI', 'BOOK_RATIO']:
             f_value = array([1. * d_data[s_key]]).reshape(1, -1)
-            d_data[s_key] = float(self.d_scale[s_key].transform(f_value))
+            d_data[s_key] = self.d_scale[s_key].transform(f_value)[0, 0]
             if d_data[s_key] > 1.:
                 d_data[s_key] = 1.
             if d_data[s_key] < 0.:
                 d_data[s_key] = 0.
 
         # return the cluster (from 10) using kmeans
-        na_val = Series(d_data).values.reshape(1, -1)
-        return int(self.kmeans.predict(na_val))
+        na_val = array([[d_data[s_key] for s_key in sorted(d_data)]])
+        return int(self.kmeans.predict(na_val)[0])
 
 
 class ZeroOneScaler(object):
@@ -240,8 +241,8 @@ class ZeroOneScaler(object):
         Initialize a Scaler object
         '''
         self.d_scale = {}
-        self.d_scale['OFI'] = load(open('data/scale_ofi.dat', 'r'))
-        scale_aux = load(open('data/scale_bookratio.dat', 'r'))
+        self.d_scale['OFI'] = get_artefact('data/scale_ofi.dat')
+        scale_aux = get_artefact('data/scale_bookratio.dat')
         self.d_scale['BOOK_RATIO'] = scale_aux
 
     def transform(self, d_feat):
@@ -256,7 +257,7 @@ class ZeroOneScaler(object):
         d_data['BOOK_RATIO'] = log(d_feat['BOOK_RATIO'])
         for s_key in ['OFI', 'BOOK_RATIO']:
             f_value = array([1. * d_data[s_key]]).reshape(1, -1)
-            d_data[s_key] = float(self.d_scale[s_key].transform(f_value))
+            d_data[s_key] = self.d_scale[s_key].transform(f_value)[0, 0]
         # round the numbers
         l_rtn = [int(d_data['OFI'] * 10), int(d_data['BOOK_RATIO'] * 10)]
         # limit the numbers
@@ -0,0 +1,223 @@
+import argparse
+import cProfile
+from collections import defaultdict
+import logging
+from os import makedirs
+from os.path import basename, exists, join
+import pstats
+import sys
+import threading
+import time
+
+
+'''
+Begin help functions
+'''
+
+
+class InvalidOptionException(Exception):
+    """
+    InvalidOptionException is raised when the profile is called with an
+    option that is not known or without the files it needs
+    """
+    pass
+
+
+PROFILE_OPTIONS = ['train', 'test', 'random']
+
+
+def get_frame_name(frame):
+    '''
+    Return the name of the function of a frame as module:function
+    :param frame: frame object. A frame of the stack
+    '''
+    s_module = basename(frame.f_code.co_filename)
+    if s_module.endswith('.py'):
+        s_module = s_module[:-3]
+    return '{}:{}'.format(s_module, frame.f_code.co_name)
+
+
+def run_profiled_option(s_option, s_fname, i_start=0, n_days=1, n_trials=1,
+                        s_qtable=None):
+    '''
+    Run one of the simulations used by agent.run() over the days passed
+    :param s_option: string. 'train', 'test' or 'random'
+    :param s_fname: string. the container zip file to be used in simulation
+    :*param i_start: integer. Index of the first file (day) to be used
+    :*param n_days: integer. Number of files (days) to be used
+    :*param n_trials: integer. Iterations over the same files
+    :*param s_qtable: string. Path to the qtable used by the test option
+    '''
+    from agent import BasicAgent, LearningAgent_k
+    from environment import Environment
+    from simulator import Simulator
+    e = Environment(s_fname=s_fname, i_idx=i_start)
+    if s_option == 'random':
+        a = e.create_agent(BasicAgent, f_min_time=2.)
+    else:
+        a = e.create_agent(LearningAgent_k, f_min_time=2., f_k=0.8,
+                           f_gamma=0.5)
+    e.set_primary_agent(a)
+    sim = Simulator(e, update_delay=1.00, display=False,
+                    b_progress=False)
+    if s_option == 'train':
+        sim.train(n_trials=n_trials, n_sessions=n_days, b_save_qtable=False)
+    else:
+        sim.test(s_qtable, n_trials=n_trials, n_sessions=n_days,
+                 i_idx=i_start)
+
+
+'''
+End help functions
+'''
+
+
+class StackSampler(object):
+    '''
+    Sample the stack of a thread periodically and count how many times each
+    stack was seen, to be drawn as a flame graph
+    '''
+    def __init__(self, f_interval=0.005, i_thread_id=None):
+        '''
+        Initiate a StackSampler object. Save all parameters as attributes
+        :*param f_interval: float. Seconds between each sample
+        :*param i_thread_id: integer. Thread sampled. The caller one if None
+        '''
+        self.f_interval = f_interval
+        self.i_thread_id = i_thread_id or threading.get_ident()
+        self.d_stacks = defaultdict(int)
+        self.i_samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        '''
+        Count the current stack of the thread sampled
+        '''
+        frame = sys._current_frames().get(self.i_thread_id)
+        l_names = []
+        while frame is not None:
+            l_names.append(get_frame_name(frame))
+            frame = frame.f_back
+        if l_names:
+            self.d_stacks[';'.join(reversed(l_names))] += 1
+            self.i_samples += 1
+
+    def _run(self):
+        '''
+        Sample the stack until stop() is called
+        '''
+        while not self._stop.wait(self.f_interval):
+            self._sample()
+
+    def start(self):
+        '''
+        Start sampling in a daemon thread
+        '''
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stop sampling
+        '''
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def write_collapsed(self, s_fname):
+        '''
+        Save the stacks seen in the collapsed format, one "frame;frame count"
+        by line, read by flamegraph.pl and speedscope
+        :param s_fname: string. Path of the file
+        '''
+        with open(s_fname, 'w') as fw:
+            for s_stack, i_count in sorted(self.d_stacks.items()):
+                fw.write('{} {}\n'.format(s_stack, i_count))
+
+
+def profile_option(s_option, s_fname, i_start=0, n_days=1, n_trials=1,
+                   s_qtable=None, s_out_dir='log/profile', f_interval=0.005,
+                   i_top=25):
+    '''
+    Profile a simulation with cProfile and a stack sampler at the same time,
+    with the logging disabled. Save the cProfile stats, the collapsed stacks
+    and a summary of the top functions by cumulative time. Return the path of
+    the summary
+    :param s_option: string. 'train', 'test' or 'random'
+    :param s_fname: string. the container zip file to be used in simulation
+    :*param i_start: integer. Index of the first file (day) to be used
+    :*param n_days: integer. Number of files (days) to be used
+    :*param n_trials: integer. Iterations over the same files
+    :*param s_qtable: string. Path to the qtable used by the test option
+    :*param s_out_dir: string. Directory where the outputs are saved
+    :*param f_interval: float. Seconds between each stack sample
+    :*param i_top: integer. Number of functions in the summary
+    '''
+    if s_option not in PROFILE_OPTIONS:
+        s_err = 'Select an <OPTION> between: \n{}'.format(PROFILE_OPTIONS)
+        raise InvalidOptionException(s_err)
+    if s_option == 'test' and not s_qtable:
+        raise InvalidOptionException('The test option needs a qtable')
+    if not exists(s_out_dir):
+        makedirs(s_out_dir)
+    s_prefix = join(s_out_dir, '{}_{}'.format(s_option, i_start))
+    # the sinks would dominate the profile, so nothing is logged
+    logging.disable(logging.CRITICAL)
+    profiler = cProfile.Profile()
+    sampler = StackSampler(f_interval=f_interval)
+    f_start = time.time()
+    try:
+        sampler.start()
+        profiler.enable()
+        run_profiled_option(s_option, s_fname, i_start=i_start, n_days=n_days,
+                            n_trials=n_trials, s_qtable=s_qtable)
+    finally:
+        profiler.disable()
+        sampler.stop()
+        logging.disable(logging.NOTSET)
+    f_total = time.time() - f_start
+    profiler.dump_stats(s_prefix + '.prof')
+    sampler.write_collapsed(s_prefix + '.collapsed')
+    # summarise the top functions by cumulative time
+    s_summary = s_prefix + '.txt'
+    with open(s_summary, 'w') as fw:
+        s_msg = '{} on {} (files {} to {}, {} trial(s)): {:0.2f} seconds,'
+        s_msg += ' {} stack samples\n'
+        fw.write(s_msg.format(s_option, s_fname, i_start,
+                              i_start + n_days - 1, n_trials, f_total,
+                              sampler.i_samples))
+        stats = pstats.Stats(profiler, stream=fw)
+        stats.sort_stats('cumulative').print_stats(i_top)
+    with open(s_summary) as fr:
+        print(fr.read())
+    print('cProfile stats saved at {}.prof'.format(s_prefix))
+    print('Collapsed stacks saved at {}.collapsed'.format(s_prefix))
+    return s_summary
+
+
+if __name__ == '__main__':
+    s_txt = 'Profile a simulated day with cProfile and stack sampling'
+    parser = argparse.ArgumentParser(description=s_txt)
+    parser.add_argument('option', choices=PROFILE_OPTIONS)
+    parser.add_argument('archive', help='zip file with the market data')
+    parser.add_argument('--start', type=int, default=0,
+                        help='index of the first file (day) of the archive')
+    parser.add_argument('--days', type=int, default=1,
+                        help='number of files (days) to simulate')
+    parser.add_argument('--trials', type=int, default=1)
+    parser.add_argument('--qtable', default=None,
+                        help='qtable used by the test option')
+    parser.add_argument('--out', default='log/profile',
+                        help='directory where the outputs are saved')
+    parser.add_argument('--interval', type=float, default=0.005,
+                        help='seconds between each stack sample')
+    parser.add_argument('--top', type=int, default=25,
+                        help='functions listed in the summary')
+    args = parser.parse_args()
+    profile_option(args.option, args.archive, i_start=args.start,
+                   n_days=args.days, n_trials=args.trials,
+                   s_qtable=args.qtable, s_out_dir=args.out,
+                   f_interval=args.interval, i_top=args.top)
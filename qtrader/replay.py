@@ -0,0 +1,114 @@
+from numpy import add, concatenate, isinf, isnan, inf, int64, where, zeros
+from numpy.random import RandomState
+
+
+'''
+Begin help functions
+'''
+
+
+def max_q_values(na_qtable, na_states):
+    '''
+    Return max_a' Q(s', a') for each state passed. Zero to the states that
+    have no action observed yet, as done by LearningAgent._apply_policy()
+    :param na_qtable: numpy array. Q-values with shape (n_states, n_actions)
+    :param na_states: numpy array. Index of the states
+    '''
+    na_aux = na_qtable[na_states]
+    na_aux = where(isnan(na_aux), -inf, na_aux).max(axis=1)
+    return where(isinf(na_aux), 0., na_aux)
+
+
+def batch_q_update(na_qtable, na_nvisits, na_s, na_a, na_r, na_s2, f_gamma):
+    '''
+    Apply, in place, the Q-learning update to a mini-batch of transitions
+    using a learning rate that decays with the number of visits to (s, a):
+    Q <- (1-a_n) Q(s,a) + a_n [r + y max_a' Q(s', a')], a_n = 1/(1+n). The
+    visits are the transitions observed, counted by the caller. Replaying a
+    transition is not a visit, so a_n decays as in LearningAgent
+    :param na_qtable: numpy array. Q-values with shape (n_states, n_actions)
+    :param na_nvisits: numpy array. Visits with shape (n_states, n_actions).
+        It is not changed
+    :param na_s: numpy array. Index of the states
+    :param na_a: numpy array. Index of the actions taken
+    :param na_r: numpy array. Rewards received
+    :param na_s2: numpy array. Index of the states reached
+    :param f_gamma: float. weight of delayed versus immediate rewards
+    '''
+    # the targets are computed before any change in the table
+    na_target = na_r + f_gamma * max_q_values(na_qtable, na_s2)
+    na_alpha = 1. / (1. + na_nvisits[na_s, na_a])
+    na_qhat = na_qtable[na_s, na_a]
+    na_qhat = where(isnan(na_qhat), 0., na_qhat)
+    # fill the actions never seen before adding the deltas
+    na_qtable[na_s, na_a] = na_qhat
+    add.at(na_qtable, (na_s, na_a), na_alpha * (na_target - na_qhat))
+
+
+'''
+End help functions
+'''
+
+
+class ReplayBuffer(object):
+    '''
+    A circular buffer of transitions (state, action, reward, next state),
+    represented by the index of the states and actions in the dense Q-table
+    '''
+    def __init__(self, i_size=10000, i_seed=None):
+        '''
+        Initiate a ReplayBuffer object. Save all parameters as attributes
+        :*param i_size: integer. Maximum number of transitions kept
+        :*param i_seed: integer. Seed used to sample the transitions
+        '''
+        self.i_size = i_size
+        self.na_s = zeros(i_size, dtype=int64)
+        self.na_a = zeros(i_size, dtype=int64)
+        self.na_r = zeros(i_size)
+        self.na_s2 = zeros(i_size, dtype=int64)
+        self.i_next = 0
+        self.i_count = 0
+        self.random_state = RandomState(i_seed)
+
+    def __len__(self):
+        '''
+        Return the number of transitions kept
+        '''
+        return self.i_count
+
+    def add(self, i_s, i_a, f_r, i_s2):
+        '''
+        Include a transition, overwriting the oldest one if the buffer is full
+        :param i_s: integer. Index of the state
+        :param i_a: integer. Index of the action taken
+        :param f_r: float. Reward received
+        :param i_s2: integer. Index of the state reached
+        '''
+        self.na_s[self.i_next] = i_s
+        self.na_a[self.i_next] = i_a
+        self.na_r[self.i_next] = f_r
+        self.na_s2[self.i_next] = i_s2
+        self.i_next = (self.i_next + 1) % self.i_size
+        self.i_count = min(self.i_count + 1, self.i_size)
+
+    def sample(self, i_batch, b_include_last=True):
+        '''
+        Return arrays of states, actions, rewards and next states of a random
+        mini-batch of transitions
+        :param i_batch: integer. Size of the mini-batch
+        :*param b_include_last: boolean. If should include the last transition
+        '''
+        i_batch = min(i_batch, self.i_count)
+        na_idx = self.random_state.randint(0, self.i_count, i_batch)
+        if b_include_last and i_batch > 0:
+            i_last = (self.i_next - 1) % self.i_size
+            na_idx = concatenate([na_idx[:-1], [i_last]])
+        return (self.na_s[na_idx], self.na_a[na_idx], self.na_r[na_idx],
+                self.na_s2[na_idx])
+
+    def reset(self):
+        '''
+        Forget all the transitions kept
+        '''
+        self.i_next = 0
+        self.i_count = 0
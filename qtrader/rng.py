@@ -0,0 +1,92 @@
+import random
+
+from numpy import uint32
+from numpy.random import PCG64, Generator, SeedSequence
+
+
+# uniform numbers drawn at once by the vectorized streams
+BLOCK_SIZE = 1024
+
+
+'''
+Begin help functions
+'''
+
+
+def get_seed_sequence(i_seed, t_key=()):
+    '''
+    Return the SeedSequence of a sub-stream of a run. The same run seed and
+    key always give the same numbers, whatever process draws them, and
+    different keys give independent streams
+    :param i_seed: integer. The seed of the run. Entropy of the OS if None
+    :*param t_key: tuple. Integers that identify the sub-stream, as the
+        task and the agent id
+    '''
+    return SeedSequence(i_seed, spawn_key=tuple(int(i) for i in t_key))
+
+
+'''
+End help functions
+'''
+
+
+class AgentRandom(object):
+    '''
+    The random numbers of one agent or environment. By default they are
+    drawn one at a time by a random.Random. The vectorized option draws them
+    in blocks from a NumPy Generator, what is cheaper when many replicas draw
+    in lock-step
+    '''
+    def __init__(self, seed_seq, b_vectorized=False, i_block=BLOCK_SIZE):
+        '''
+        Initiate an AgentRandom object. Save all parameters as attributes
+        :param seed_seq: SeedSequence object. The stream. See
+            get_seed_sequence()
+        :*param b_vectorized: boolean. If should draw blocks with NumPy
+        :*param i_block: integer. Numbers drawn by block when vectorized
+        '''
+        self.seed_seq = seed_seq
+        self.b_vectorized = b_vectorized
+        self.i_block = i_block
+        self.generator = None
+        self.obj_random = None
+        if b_vectorized:
+            self.generator = Generator(PCG64(seed_seq))
+            self.na_block = self.generator.random(i_block)
+            self.i_next = 0
+        else:
+            na_state = seed_seq.generate_state(4, dtype=uint32)
+            self.obj_random = random.Random(
+                int.from_bytes(na_state.tobytes(), 'little'))
+
+    def random(self):
+        '''
+        Return a float uniformly distributed in [0, 1)
+        '''
+        if not self.b_vectorized:
+            return self.obj_random.random()
+        if self.i_next == self.i_block:
+            self.na_block = self.generator.random(self.i_block)
+            self.i_next = 0
+        f_rtn = float(self.na_block[self.i_next])
+        self.i_next += 1
+        return f_rtn
+
+    def choice(self, l_values):
+        '''
+        Return an element of a non-empty list chosen uniformly
+        :param l_values: list. The values to choose from
+        '''
+        if not self.b_vectorized:
+            return self.obj_random.choice(l_values)
+        return l_values[int(self.random() * len(l_values))]
+
+    def randint(self, i_low, i_high):
+        '''
+        Return an integer uniformly distributed in [i_low, i_high]
+        :param i_low: integer. The lowest value
+        :param i_high: integer. The highest value
+        '''
+        if not self.b_vectorized:
+            return self.obj_random.randint(i_low, i_high)
+        return i_low + int(self.random() * (i_high - i_low + 1))
@@ -0,0 +1,294 @@
+import argparse
+from contextlib import contextmanager
+from fcntl import LOCK_EX, LOCK_UN, flock
+from glob import glob
+from hashlib import sha256
+import json
+from os import getpid, makedirs, replace, stat, walk
+from os.path import abspath, basename, dirname, exists, getsize, join
+import random
+from shutil import copyfile, rmtree
+import time
+
+import numpy
+from numpy import load, savez
+
+from artefacts import MANIFEST, get_path
+
+
+# bump it when the layout of the entries changes
+CACHE_FORMAT = 1
+# digests already computed by this process, by (path, size, mtime)
+DIGESTS = {}
+CODE_VERSION = None
+
+
+'''
+Begin help functions
+'''
+
+
+def seed_all(i_seed):
+    '''
+    Seed the random numbers used by the agents, so a run can be reproduced
+    and cached
+    :param i_seed: integer. The seed
+    '''
+    random.seed(i_seed)
+    numpy.random.seed(i_seed)
+
+
+def get_file_digest(s_fname):
+    '''
+    Return the SHA-256 of the content of a file, computed once by process
+    while the file is not modified
+    :param s_fname: string. Path to the file
+    '''
+    st = stat(s_fname)
+    t_key = (abspath(s_fname), st.st_size, st.st_mtime)
+    if t_key not in DIGESTS:
+        obj_hash = sha256()
+        with open(s_fname, 'rb') as fr:
+            for s_chunk in iter(lambda: fr.read(1 << 20), b''):
+                obj_hash.update(s_chunk)
+        DIGESTS[t_key] = obj_hash.hexdigest()
+    return DIGESTS[t_key]
+
+
+def get_code_version():
+    '''
+    Return the SHA-256 of the source files of the package, so a change in
+    the code does not reuse runs made before it
+    '''
+    global CODE_VERSION
+    if CODE_VERSION is None:
+        obj_hash = sha256()
+        for s_fname in sorted(glob(join(dirname(abspath(__file__)), '*.py'))):
+            obj_hash.update(basename(s_fname).encode())
+            obj_hash.update(get_file_digest(s_fname).encode())
+        CODE_VERSION = obj_hash.hexdigest()
+    return CODE_VERSION
+
+
+def get_run_key(s_fname, d_config):
+    '''
+    Return the key of a run: the hash of its config together with the
+    digests of the market data, the scaler artefacts and the code
+    :param s_fname: string. the container zip file used in simulation
+    :param d_config: dictionary. Everything else that defines the run (days,
+        agent, its parameters, trials and seed). Must be JSON serializable
+    '''
+    s_manifest = get_path(MANIFEST)
+    d_aux = {'format': CACHE_FORMAT,
+             'config': d_config,
+             'data': get_file_digest(s_fname),
+             'artefacts': (get_file_digest(s_manifest)
+                           if exists(s_manifest) else None),
+             'code': get_code_version()}
+    s_aux = json.dumps(d_aux, sort_keys=True, default=str)
+    return sha256(s_aux.encode()).hexdigest()
+
+
+def get_dir_size(s_dir):
+    '''
+    Return the size of the files of a directory, in bytes
+    :param s_dir: string. Path to the directory
+    '''
+    return sum(getsize(join(s_root, s_file))
+               for s_root, l_dirs, l_files in walk(s_dir)
+               for s_file in l_files)
+
+
+'''
+End help functions
+'''
+
+
+class RunCache(object):
+    '''
+    Results of whole simulation runs stored by the hash of what defines them,
+    so an identical run is read instead of simulated. Each entry holds a
+    summary, arrays (as Q-tables and PnL paths) and files (as the Q-table
+    logs). A manifest keeps the size and the last use of each entry, and the
+    least recently used ones are evicted when the cache gets too big
+    '''
+    def __init__(self, s_dir='log/run_cache', i_max_bytes=2 ** 30):
+        '''
+        Initiate a RunCache object. Save all parameters as attributes
+        :*param s_dir: string. The directory of the cache
+        :*param i_max_bytes: integer. Size of the cache that triggers eviction
+        '''
+        self.s_dir = s_dir
+        self.i_max_bytes = i_max_bytes
+        self.s_manifest = join(s_dir, 'manifest.json')
+        if not exists(s_dir):
+            makedirs(s_dir)
+
+    @contextmanager
+    def _locked_manifest(self):
+        '''
+        Hold a lock on the manifest, as many workers can use the same cache,
+        and yield its content. Changes made to it are saved atomically
+        '''
+        with open(join(self.s_dir, 'manifest.lock'), 'a') as fw:
+            flock(fw, LOCK_EX)
+            try:
+                d_manifest = {}
+                if exists(self.s_manifest):
+                    with open(self.s_manifest) as fr:
+                        d_manifest = json.load(fr)
+                yield d_manifest
+                s_tmp = '{}.{}.tmp'.format(self.s_manifest, getpid())
+                with open(s_tmp, 'w') as fw_tmp:
+                    json.dump(d_manifest, fw_tmp, indent=2, sort_keys=True)
+                replace(s_tmp, self.s_manifest)
+            finally:
+                flock(fw, LOCK_UN)
+
+    def get_entry_dir(self, s_key):
+        '''
+        Return the directory of an entry
+        :param s_key: string. The key of the run
+        '''
+        return join(self.s_dir, s_key[:2], s_key)
+
+    def get(self, s_key):
+        '''
+        Return a dictionary with the 'summary', the 'arrays' and the paths of
+        the 'files' of a run, or None if it is not cached
+        :param s_key: string. The key of the run
+        '''
+        s_entry = self.get_entry_dir(s_key)
+        with self._locked_manifest() as d_manifest:
+            if s_key not in d_manifest or not exists(s_entry):
+                d_manifest.pop(s_key, None)
+                return None
+            d_manifest[s_key]['last_used'] = time.time()
+            d_manifest[s_key]['hits'] += 1
+        with open(join(s_entry, 'summary.json')) as fr:
+            d_summary = json.load(fr)
+        d_arrays = {}
+        if exists(join(s_entry, 'arrays.npz')):
+            with load(join(s_entry, 'arrays.npz')) as npz:
+                d_arrays = dict((s_name, npz[s_name]) for s_name in npz.files)
+        l_files = sorted(glob(join(s_entry, 'files', '*')))
+        return {'summary': d_summary, 'arrays': d_arrays, 'files': l_files}
+
+    def put(self, s_key, d_summary, d_arrays=None, l_files=None,
+            d_config=None):
+        '''
+        Store the results of a run and evict the least recently used entries
+        if the cache got too big
+        :param s_key: string. The key of the run
+        :param d_summary: dictionary. Metrics of the run, JSON serializable
+        :*param d_arrays: dictionary. Numpy arrays by name
+        :*param l_files: list. Paths of files produced by the run
+        :*param d_config: dictionary. What defines the run, to be listed
+        '''
+        s_entry = self.get_entry_dir(s_key)
+        # write to a temporary dir and rename it, so a half written entry is
+        # never read
+        s_tmp = '{}.{}.tmp'.format(s_entry, getpid())
+        if exists(s_tmp):
+            rmtree(s_tmp)
+        makedirs(join(s_tmp, 'files'))
+        with open(join(s_tmp, 'summary.json'), 'w') as fw:
+            json.dump(d_summary, fw, indent=2, default=str)
+        if d_arrays:
+            savez(join(s_tmp, 'arrays.npz'), **d_arrays)
+        for s_fname in (l_files or []):
+            copyfile(s_fname, join(s_tmp, 'files', basename(s_fname)))
+        i_size = get_dir_size(s_tmp)
+        with self._locked_manifest() as d_manifest:
+            if exists(s_entry):
+                rmtree(s_entry)
+            replace(s_tmp, s_entry)
+            f_now = time.time()
+            d_manifest[s_key] = {'config': d_config, 'size': i_size,
+                                 'created': f_now, 'last_used': f_now,
+                                 'hits': 0}
+            self._evict(d_manifest, self.i_max_bytes)
+
+    def _evict(self, d_manifest, i_max_bytes):
+        '''
+        Remove the least recently used entries until the cache fits in the
+        size passed. Return the number of entries removed. Call it holding the
+        lock of the manifest
+        :param d_manifest: dictionary. The content of the manifest
+        :param i_max_bytes: integer. The maximum size of the cache
+        '''
+        i_total = sum(d['size'] for d in d_manifest.values())
+        i_removed = 0
+        for s_key in sorted(d_manifest,
+                            key=lambda s: d_manifest[s]['last_used']):
+            if i_total <= i_max_bytes:
+                break
+            i_total -= d_manifest[s_key]['size']
+            rmtree(self.get_entry_dir(s_key), ignore_errors=True)
+            del d_manifest[s_key]
+            i_removed += 1
+        return i_removed
+
+    def list_entries(self):
+        '''
+        Return a list of (key, manifest record) from the most recently used
+        '''
+        with self._locked_manifest() as d_manifest:
+            return sorted(d_manifest.items(), reverse=True,
+                          key=lambda t: t[1]['last_used'])
+
+    def prune(self, i_max_bytes=None, f_max_age=None):
+        '''
+        Remove the entries not used for more than f_max_age seconds and then
+        the least recently used ones until the cache fits in i_max_bytes.
+        Return the number of entries removed
+        :*param i_max_bytes: integer. The maximum size. Of the cache if None
+        :*param f_max_age: float. Seconds since the last use of an entry
+        '''
+        if i_max_bytes is None:
+            i_max_bytes = self.i_max_bytes
+        with self._locked_manifest() as d_manifest:
+            i_removed = 0
+            if f_max_age is not None:
+                f_limit = time.time() - f_max_age
+                for s_key in list(d_manifest):
+                    if d_manifest[s_key]['last_used'] < f_limit:
+                        rmtree(self.get_entry_dir(s_key), ignore_errors=True)
+                        del d_manifest[s_key]
+                        i_removed += 1
+            i_removed += self._evict(d_manifest, i_max_bytes)
+        return i_removed
+
+
+if __name__ == '__main__':
+    s_txt = 'List or prune the cache of simulation runs'
+    parser = argparse.ArgumentParser(description=s_txt)
+    parser.add_argument('command', choices=['list', 'prune', 'clear'])
+    parser.add_argument('--dir', default='log/run_cache')
+    parser.add_argument('--max-mb', type=float, default=None,
+                        help='size of the cache after pruning')
+    parser.add_argument('--max-days', type=float, default=None,
+                        help='remove entries not used for more days')
+    args = parser.parse_args()
+    cache = RunCache(args.dir)
+    if args.command == 'list':
+        i_total = 0
+        for s_key, d_rec in cache.list_entries():
+            i_total += d_rec['size']
+            print('{}  {:>10,d} bytes  {:>4d} hits  {}  {}'.format(
+                s_key[:16], d_rec['size'], d_rec['hits'],
+                time.strftime('%Y-%m-%d %H:%M',
+                              time.localtime(d_rec['last_used'])),
+                json.dumps(d_rec['config'], sort_keys=True)))
+        print('{:,d} bytes in total'.format(i_total))
+    else:
+        i_max_bytes = None
+        f_max_age = None
+        if args.command == 'clear':
+            i_max_bytes = 0
+        else:
+            if args.max_mb is not None:
+                i_max_bytes = int(args.max_mb * 2 ** 20)
+            if args.max_days is not None:
+                f_max_age = args.max_days * 86400.
+        print('{} entries removed'.format(cache.prune(i_max_bytes, f_max_age)))
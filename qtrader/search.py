@@ -0,0 +1,259 @@
+import argparse
+from itertools import product
+import json
+import logging
+from math import ceil
+from os import makedirs
+from os.path import dirname, exists
+import time
+
+from numpy import mean
+
+from metrics import MetricsFile
+from worker_pool import DEFAULT_AGENT_KWARGS, WorkerPool
+
+
+DEBUG = True
+
+# how the configurations are ranked. The higher the better
+METRICS = ['reward', 'pnl', 'sharpe']
+# what the budget of a configuration counts
+BUDGET_UNITS = ['trials', 'days']
+
+
+'''
+Begin help functions
+'''
+
+
+class InvalidOptionException(Exception):
+    """
+    InvalidOptionException is raised when the search is set with a metric or
+    a budget unit that is not known
+    """
+    pass
+
+
+def get_configs(d_grid, s_agent='LearningAgent_k', d_base=None):
+    '''
+    Return a config, as used by run_task(), for each combination of the
+    values of the grid
+    :param d_grid: dictionary. A list of values by parameter of the agent
+    :*param s_agent: string. Name of the class in the agent module
+    :*param d_base: dictionary. Parameters of the agent not in the grid.
+        DEFAULT_AGENT_KWARGS if None
+    '''
+    l_keys = sorted(d_grid)
+    l_rtn = []
+    for t_values in product(*[d_grid[s_key] for s_key in l_keys]):
+        d_kwargs = dict(d_base or DEFAULT_AGENT_KWARGS)
+        d_kwargs.update(zip(l_keys, t_values))
+        l_rtn.append({'agent': s_agent, 'agent_kwargs': d_kwargs})
+    return l_rtn
+
+
+def get_config_id(d_config):
+    '''
+    Return a string that identifies a config
+    :param d_config: dictionary. The config
+    '''
+    return json.dumps(d_config['agent_kwargs'], sort_keys=True)
+
+
+def get_tasks(d_config, i_budget, s_unit, l_days, l_seeds):
+    '''
+    Return the (config, day, seed) tasks that spend the budget passed. With
+    'trials', the agent trains i_budget trials on every day. With 'days', it
+    trains one trial on each of the first i_budget days
+    :param d_config: dictionary. The config
+    :param i_budget: integer. The budget of the config in this round
+    :param s_unit: string. 'trials' or 'days'
+    :param l_days: list. Index of the files (days) that can be used
+    :param l_seeds: list. Seeds of each run
+    '''
+    d_aux = dict(d_config)
+    if s_unit == 'trials':
+        d_aux['n_trials'] = i_budget
+    else:
+        d_aux['n_trials'] = 1
+        l_days = l_days[:i_budget]
+    return [(d_aux, i_idx, i_seed) for i_idx in l_days for i_seed in l_seeds]
+
+
+def get_score(d_res, s_metric):
+    '''
+    Return the metric of one task
+    :param d_res: dictionary. Returned by run_task()
+    :param s_metric: string. 'reward', 'pnl' or 'sharpe'
+    '''
+    if s_metric == 'reward':
+        return d_res['mean_reward']
+    return d_res[s_metric]
+
+
+'''
+End help functions
+'''
+
+
+def successive_halving(s_fname, d_grid, l_days, l_seeds=None,
+                       s_metric='reward', s_unit='trials', i_min_budget=1,
+                       i_max_budget=None, f_eta=2., n_workers=None,
+                       s_start_method='forkserver', s_out=None,
+                       s_cache_dir=None, s_metrics_fname=None):
+    '''
+    Search the grid by successive halving: every configuration runs with the
+    minimum budget, the best 1/f_eta of them (by the mean metric of their
+    tasks) survive and run again with f_eta times the budget, until just one
+    is left. All the tasks of a round are run by the same pool of workers.
+    The survivors train again from scratch with the larger budget, so a
+    configuration that reaches the last round spends up to
+    f_eta / (f_eta - 1) times its final budget. The cache just saves the runs
+    identical to previous ones. Return a list of rounds, each one with the
+    budget and the score of the configurations that ran in it, sorted from
+    the best one
+    :param s_fname: string. the container zip file to be used in simulation
+    :param d_grid: dictionary. A list of values by parameter of the agent
+    :param l_days: list. Index of the files (days) used
+    :*param l_seeds: list. Seeds of the runs of each config. [0] if None
+    :*param s_metric: string. 'reward', 'pnl' or 'sharpe'
+    :*param s_unit: string. 'trials' or 'days'
+    :*param i_min_budget: integer. The budget of the first round
+    :*param i_max_budget: integer. The largest budget of a round. Unlimited
+        for 'trials' and the number of days for 'days', if None
+    :*param f_eta: float. The ratio between the budget of two rounds
+    :*param n_workers: integer. Worker processes. All cores if None
+    :*param s_start_method: string. 'forkserver' or 'fork'
+    :*param s_out: string. Path of a JSON where the rounds are saved
+    :*param s_cache_dir: string. Directory of the RunCache, so the runs done
+        by a previous search are reused. No cache if None
+    :*param s_metrics_fname: string. File rewritten, in the Prometheus text
+        format, every time a task or a round finishes. Not written if None
+    '''
+    if s_metric not in METRICS:
+        s_err = 'Select a metric between: {}'.format(METRICS)
+        raise InvalidOptionException(s_err)
+    if s_unit not in BUDGET_UNITS:
+        s_err = 'Select a budget unit between: {}'.format(BUDGET_UNITS)
+        raise InvalidOptionException(s_err)
+    l_seeds = l_seeds or [0]
+    if s_unit == 'days':
+        i_max_budget = min(i_max_budget or len(l_days), len(l_days))
+    l_configs = get_configs(d_grid)
+    i_budget = i_min_budget
+    l_rounds = []
+    f_start = time.time()
+    f_cpu = 0.
+    metrics = None
+    if s_metrics_fname:
+        metrics = MetricsFile(s_metrics_fname)
+    d_search = {'best_score': None, 'tasks_done': 0}
+    with WorkerPool(s_fname, l_idx=l_days, n_workers=n_workers,
+                    s_start_method=s_start_method,
+                    s_cache_dir=s_cache_dir) as pool:
+        while True:
+            l_tasks = []
+            for d_config in l_configs:
+                l_tasks += get_tasks(d_config, i_budget, s_unit, l_days,
+                                     l_seeds)
+            d_scores = dict((get_config_id(d_config), [])
+                            for d_config in l_configs)
+            d_search.update({'round': len(l_rounds) + 1, 'budget': i_budget,
+                             'survivors': len(l_configs),
+                             'round_tasks': len(l_tasks),
+                             'round_tasks_done': 0})
+            for d_res in pool.map(l_tasks):
+                d_scores[get_config_id(d_res['config'])].append(
+                    get_score(d_res, s_metric))
+                f_cpu += d_res['seconds']
+                if metrics:
+                    d_search['round_tasks_done'] += 1
+                    d_search['tasks_done'] += 1
+                    f_elapsed = time.time() - f_start
+                    d_search['tasks_per_sec'] = d_search['tasks_done']
+                    d_search['tasks_per_sec'] /= f_elapsed
+                    metrics.set_search(d_search)
+                    metrics.write()
+            l_rank = sorted(l_configs, reverse=True,
+                            key=lambda d: mean(d_scores[get_config_id(d)]))
+            l_rounds.append({
+                'budget': i_budget,
+                'configs': [{'agent_kwargs': d['agent_kwargs'],
+                             'score': float(mean(d_scores[get_config_id(d)]))}
+                            for d in l_rank]})
+            s_msg = 'successive_halving(): round {} with budget {} {}, best'
+            s_msg += ' {} = {:0.4f} by {}'
+            s_msg = s_msg.format(len(l_rounds), i_budget, s_unit, s_metric,
+                                 l_rounds[-1]['configs'][0]['score'],
+                                 get_config_id(l_rank[0]))
+            if DEBUG:
+                logging.info(s_msg)
+            else:
+                print(s_msg)
+            if metrics:
+                d_search['best_score'] = l_rounds[-1]['configs'][0]['score']
+                metrics.set_search(d_search)
+                metrics.write()
+            # stop when there is a winner or the budget can not grow
+            if len(l_rank) == 1:
+                break
+            if i_max_budget and i_budget >= i_max_budget:
+                break
+            l_configs = l_rank[:max(1, int(ceil(len(l_rank) / f_eta)))]
+            if len(l_configs) == 1:
+                break
+            i_budget = int(ceil(i_budget * f_eta))
+            if i_max_budget:
+                i_budget = min(i_budget, i_max_budget)
+    s_msg = 'successive_halving(): {} rounds in {:0.2f} seconds, {:0.2f}'
+    s_msg += ' seconds of simulation'
+    s_msg = s_msg.format(len(l_rounds), time.time() - f_start, f_cpu)
+    if DEBUG:
+        logging.info(s_msg)
+    else:
+        print(s_msg)
+    if s_out:
+        if dirname(s_out) and not exists(dirname(s_out)):
+            makedirs(dirname(s_out))
+        with open(s_out, 'w') as fw:
+            json.dump({'metric': s_metric, 'unit': s_unit, 'grid': d_grid,
+                       'days': l_days, 'seeds': l_seeds, 'rounds': l_rounds},
+                      fw, indent=2)
+    return l_rounds
+
+
+if __name__ == '__main__':
+    s_txt = 'Search the parameters of the agent by successive halving'
+    parser = argparse.ArgumentParser(description=s_txt)
+    parser.add_argument('archive', help='zip file with the market data')
+    parser.add_argument('--grid', default='{"f_k": [0.3, 0.8, 1.3, 2.0]}',
+                        help='JSON with a list of values by parameter')
+    parser.add_argument('--days', type=int, nargs='+', default=[0],
+                        help='index of the files (days) of the archive')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0])
+    parser.add_argument('--metric', choices=METRICS, default='reward')
+    parser.add_argument('--unit', choices=BUDGET_UNITS, default='trials')
+    parser.add_argument('--min-budget', type=int, default=1)
+    parser.add_argument('--max-budget', type=int, default=None)
+    parser.add_argument('--eta', type=float, default=2.)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cache', default=None,
+                        help='directory of the cache of runs')
+    parser.add_argument('--out', default='log/search/latest.json',
+                        help='path of the JSON with the rounds')
+    parser.add_argument('--metrics', default=None,
+                        help='path of a file with the progress in the'
+                        ' Prometheus text format')
+    args = parser.parse_args()
+    l_rounds = successive_halving(
+        args.archive, json.loads(args.grid), args.days, l_seeds=args.seeds,
+        s_metric=args.metric, s_unit=args.unit, i_min_budget=args.min_budget,
+        i_max_budget=args.max_budget, f_eta=args.eta, n_workers=args.workers,
+        s_out=args.out, s_cache_dir=args.cache,
+        s_metrics_fname=args.metrics)
+    for i_round, d_round in enumerate(l_rounds):
+        print('round {} (budget {}):'.format(i_round + 1, d_round['budget']))
+        for d_conf in d_round['configs']:
+            print('  {:>10.4f}  {}'.format(
+                d_conf['score'], json.dumps(d_conf['agent_kwargs'],
+                                            sort_keys=True)))
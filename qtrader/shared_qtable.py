@@ -0,0 +1,288 @@
+from collections.abc import Mapping, MutableMapping
+import logging
+from multiprocessing import Lock, Process, cpu_count, get_start_method
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from os import replace
+import time
+
+from numpy import float64, isnan, nan, ndarray, savez
+
+import state_space
+
+
+DEBUG = True
+
+'''
+Begin help functions
+'''
+
+
+def run_actor(d_handle, s_fname, i_idx, n_trials, d_agent_kwargs):
+    '''
+    Train a SharedLearningAgent on one file of the archive, updating the
+    Q-table in shared memory. It is the target of each actor process
+    :param d_handle: dict. What is needed to attach to the shared Q-table
+    :param s_fname: string. the container zip file to be used in simulation
+    :param i_idx: integer. The index of the file to be read
+    :param n_trials: integer. Iterations over the same file
+    :param d_agent_kwargs: dict. Parameters passed to the agent
+    '''
+    # imported here to keep the parent free of the agent module side effects
+    from agent import SharedLearningAgent
+    from environment import Environment
+    from simulator import Simulator
+    shared_qtable = SharedQTable.attach(d_handle)
+    e = Environment(s_fname=s_fname, i_idx=i_idx)
+    a = e.create_agent(SharedLearningAgent, shared_qtable=shared_qtable,
+                       **d_agent_kwargs)
+    e.set_primary_agent(a)
+    sim = Simulator(e, update_delay=1.00, display=False,
+                    b_progress=False)
+    sim.train(n_trials=n_trials, n_sessions=1, b_save_qtable=False)
+    shared_qtable.close()
+
+
+def train_parallel(s_fname, l_idx, n_trials=1, n_workers=None,
+                   f_snapshot_every=60., n_clusters=10,
+                   s_snapshot='log/qtable/shared_qtable.npz',
+                   **d_agent_kwargs):
+    '''
+    Train one Q-table using an actor process by file of the archive, all of
+    them updating the same Q-table in shared memory. Snapshot the Q-table to
+    disk periodically and return the path of the last snapshot
+    :param s_fname: string. the container zip file to be used in simulation
+    :param l_idx: list. Index of the files to be used, one by actor
+    :*param n_trials: integer. Iterations of each actor over its file
+    :*param n_workers: integer. Actors running at the same time. All cores
+        if None
+    :*param f_snapshot_every: float. Seconds between each snapshot
+    :*param n_clusters: integer. Number of clusters of the scaler
+    :*param s_snapshot: string. Path of the snapshot file
+    :*param d_agent_kwargs: any type. Any other parameter needed by the agent
+    '''
+    if not n_workers:
+        n_workers = cpu_count()
+    shared_qtable = SharedQTable(n_clusters=n_clusters)
+    d_handle = shared_qtable.get_handle()
+    l_pending = [Process(target=run_actor,
+                         args=(d_handle, s_fname, i_idx, n_trials,
+                               d_agent_kwargs))
+                 for i_idx in l_idx]
+    l_running = []
+    f_last_snapshot = time.time()
+    try:
+        while l_pending or l_running:
+            # keep at most n_workers actors running
+            l_running = [proc for proc in l_running if proc.is_alive()]
+            while l_pending and len(l_running) < n_workers:
+                proc = l_pending.pop(0)
+                proc.start()
+                l_running.append(proc)
+            if time.time() - f_last_snapshot >= f_snapshot_every:
+                shared_qtable.snapshot(s_snapshot)
+                f_last_snapshot = time.time()
+            time.sleep(0.1)
+        shared_qtable.snapshot(s_snapshot)
+    finally:
+        shared_qtable.close()
+        shared_qtable.unlink()
+    return s_snapshot
+
+
+'''
+End help functions
+'''
+
+
+class DenseRowView(MutableMapping):
+    '''
+    Dictionary-like access to the actions of a single state of a dense table,
+    keyed by the action names. Missing actions read as zero, as in the
+    defaultdict(float) used by the agents
+    '''
+    def __init__(self, na_table, i_state, b_counts=False):
+        '''
+        Initiate a DenseRowView object. Save all parameters as attributes
+        :param na_table: numpy array. Values with shape (n_states, n_actions)
+        :param i_state: integer. The row of the state
+        :*param b_counts: boolean. If missing values are zeros instead of NaN
+        '''
+        self.na_table = na_table
+        self.i_state = i_state
+        self.b_counts = b_counts
+
+    def _is_set(self, f_val):
+        '''
+        Return if the value passed was set before
+        :param f_val: float. a value from the table
+        '''
+        if self.b_counts:
+            return f_val != 0.
+        return not isnan(f_val)
+
+    def __getitem__(self, s_action):
+        f_val = self.na_table[self.i_state, state_space.get_action_index(s_action)]
+        if not self._is_set(f_val):
+            return 0.
+        return float(f_val)
+
+    def __setitem__(self, s_action, f_val):
+        self.na_table[self.i_state, state_space.get_action_index(s_action)] = f_val
+
+    def __delitem__(self, s_action):
+        f_empty = 0. if self.b_counts else nan
+        self.na_table[self.i_state, state_space.get_action_index(s_action)] = f_empty
+
+    def __iter__(self):
+        na_row = self.na_table[self.i_state]
+        return iter([s_action for s_action, f_val
+                     in zip(state_space.ACTIONS, na_row)
+                     if self._is_set(f_val)])
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+
+class DenseTableView(Mapping):
+    '''
+    Dictionary-like access to a dense table, keyed by the string
+    representation of the states, as the q_table of the agents
+    '''
+    def __init__(self, na_table, b_counts=False):
+        '''
+        Initiate a DenseTableView object. Save all parameters as attributes
+        :param na_table: numpy array. Values with shape (n_states, n_actions)
+        :*param b_counts: boolean. If missing values are zeros instead of NaN
+        '''
+        self.na_table = na_table
+        self.b_counts = b_counts
+        self.d_index = {}
+
+    def __getitem__(self, s_state):
+        if s_state not in self.d_index:
+            d_state = state_space.parse_state(s_state)
+            self.d_index[s_state] = state_space.state_to_index(d_state)
+        return DenseRowView(self.na_table, self.d_index[s_state], self.b_counts)
+
+    def __iter__(self):
+        for i_state in range(self.na_table.shape[0]):
+            if len(DenseRowView(self.na_table, i_state, self.b_counts)):
+                yield str(state_space.index_to_state(i_state))
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+
+class SharedQTable(object):
+    '''
+    A dense Q-table and its visit counts living in shared memory, so many
+    processes can update them. Writes are protected by striped locks chosen by
+    the state and reads are lock-free
+    '''
+    def __init__(self, n_clusters=10, i_nlocks=16, d_handle=None):
+        '''
+        Initiate a SharedQTable object. Create the shared memory segments or
+        attach to the ones described by d_handle
+        :*param n_clusters: integer. Number of clusters of the scaler
+        :*param i_nlocks: integer. Number of lock stripes
+        :*param d_handle: dict. Returned by get_handle() of the creator
+        '''
+        b_create = d_handle is None
+        if not b_create:
+            n_clusters = d_handle['n_clusters']
+        self.n_clusters = n_clusters
+        t_shape = (n_clusters * state_space.N_SUBSTATES,
+                   len(state_space.ACTIONS))
+        i_nbytes = t_shape[0] * t_shape[1] * 8
+        if b_create:
+            self.shm_q = SharedMemory(create=True, size=i_nbytes)
+            self.shm_n = SharedMemory(create=True, size=i_nbytes)
+            self.l_locks = [Lock() for i in range(i_nlocks)]
+        else:
+            self.shm_q = SharedMemory(name=d_handle['s_name_q'])
+            self.shm_n = SharedMemory(name=d_handle['s_name_n'])
+            self.l_locks = d_handle['l_locks']
+            # just the creator should destroy the segments at exit. Forked
+            # children share the resource tracker of the creator
+            if not d_handle['b_fork']:
+                for shm in [self.shm_q, self.shm_n]:
+                    resource_tracker.unregister(shm._name, 'shared_memory')
+        self.na_qtable = ndarray(t_shape, dtype=float64, buffer=self.shm_q.buf)
+        self.na_nvisits = ndarray(t_shape, dtype=float64, buffer=self.shm_n.buf)
+        if b_create:
+            self.na_qtable[:] = nan
+            self.na_nvisits[:] = 0.
+
+    @classmethod
+    def attach(cls, d_handle):
+        '''
+        Return a SharedQTable attached to the segments of another process
+        :param d_handle: dict. Returned by get_handle() of the creator
+        '''
+        return cls(d_handle=d_handle)
+
+    def get_handle(self):
+        '''
+        Return what the other processes need to attach to this Q-table
+        '''
+        return {'n_clusters': self.n_clusters,
+                's_name_q': self.shm_q.name,
+                's_name_n': self.shm_n.name,
+                'l_locks': self.l_locks,
+                'b_fork': get_start_method() == 'fork'}
+
+    def get_qtable_view(self):
+        '''
+        Return a view of the Q-values that can be used as agent.q_table
+        '''
+        return DenseTableView(self.na_qtable)
+
+    def get_nvisits_view(self):
+        '''
+        Return a view of the visits that can be used as agent.nvisits_table
+        '''
+        return DenseTableView(self.na_nvisits, b_counts=True)
+
+    def get_locks(self, l_states):
+        '''
+        Return the locks protecting the states passed, sorted to be acquired
+        always in the same order
+        :param l_states: list. The intern states of the agent
+        '''
+        i_nlocks = len(self.l_locks)
+        l_idx = set(state_space.state_to_index(d_state) % i_nlocks
+                    for d_state in l_states)
+        return [self.l_locks[i_lock] for i_lock in sorted(l_idx)]
+
+    def snapshot(self, s_fname):
+        '''
+        Save a copy of the Q-table and visits to disk. The file is replaced
+        atomically, so it can be read while the training is running
+        :param s_fname: string. Path of the snapshot file
+        '''
+        s_tmp = s_fname + '.tmp.npz'
+        savez(s_tmp, qtable=self.na_qtable.copy(),
+              nvisits=self.na_nvisits.copy())
+        replace(s_tmp, s_fname)
+        s_msg = 'SharedQTable.snapshot(): Q-table saved at {}'.format(s_fname)
+        if DEBUG:
+            logging.info(s_msg)
+        else:
+            print(s_msg)
+
+    def close(self):
+        '''
+        Detach from the shared memory segments
+        '''
+        del self.na_qtable
+        del self.na_nvisits
+        self.shm_q.close()
+        self.shm_n.close()
+
+    def unlink(self):
+        '''
+        Destroy the shared memory segments. Called just by their creator
+        '''
+        self.shm_q.unlink()
+        self.shm_n.unlink()
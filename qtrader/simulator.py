@@ -1,8 +1,14 @@
 import importlib
+import json
 import logging
+import sys
 import time
 
-from pandas import DataFrame
+from numpy import full, nan
+
+from checkpoint import Checkpoint
+import instrument
+from metrics import MetricsFile
 
 
 DEBUG = True
@@ -13,38 +19,242 @@ Begin help functions
 '''
 
 
+def get_nvisits_fname(s_qtable):
+    '''
+    Return the path of the visit counts saved together with a Q-table
+    :param s_qtable: string. path to the qtable
+    '''
+    s_head, s_sep, s_tail = s_qtable.rpartition('_qtable_')
+    if not s_sep:
+        s_head, s_sep, s_tail = s_qtable.rpartition('.')
+        return s_head + '_nvisits.' + s_tail
+    return s_head + '_nvisits_' + s_tail
+
+
 def save_q_table(e, i_trial):
     '''
-    Log the final Q-table of the algorithm
+    Log the final Q-table of the algorithm and the visit counts of each state
+    and action, when the agent keeps them
     :param e: Environment object. The order book
     :param i_trial: integer. id of the current trial
     '''
-    agent = e.primary_agent
-    try:
-        q_table = agent.q_table
-        # define the name of the files
-        s_fname = 'log/qtable/{}_qtable_{}.log'
-        s_fname = s_fname.format(agent.s_agent_name, i_trial)
-        # save data structures
-        DataFrame(q_table).T.to_csv(s_fname, sep='\t')
-    except:
-        print('No Q-table to be printed')
+    # pandas is imported just by the code paths that need it
+    from pandas import DataFrame
+    l_agents = e.get_learning_agents()
+    for i_rep, agent in enumerate(l_agents):
+        try:
+            q_table = dict((s_state, dict(d_actions))
+                           for s_state, d_actions in agent.q_table.items())
+            # define the name of the files. Replicas get their own files
+            s_fname = 'log/qtable/{}_qtable_{}.log'
+            s_fname = s_fname.format(agent.s_agent_name, i_trial)
+            if len(l_agents) > 1:
+                s_fname = 'log/qtable/{}_r{}_qtable_{}.log'
+                s_fname = s_fname.format(agent.s_agent_name, i_rep, i_trial)
+            # save data structures
+            DataFrame(q_table).T.to_csv(s_fname, sep='\t')
+        except:
+            print('No Q-table to be printed')
+            continue
+        if hasattr(agent, 'nvisits_table'):
+            nvisits = dict((s_state, dict(d_actions))
+                           for s_state, d_actions
+                           in agent.nvisits_table.items())
+            DataFrame(nvisits).T.to_csv(get_nvisits_fname(s_fname), sep='\t')
+
+
+def load_qtables(l_fnames):
+    '''
+    Load many Q-tables saved by save_q_table() into a single stacked array.
+    Return the list of states, the list of actions and an array with shape
+    (n_qtables, n_states, n_actions), NaN where a table has no value
+    :param l_fnames: list. Paths to the qtables to be loaded
+    '''
+    from pandas import read_csv
+    l_df = [read_csv(s_fname, sep='\t', index_col=0) for s_fname in l_fnames]
+    l_states = sorted(set().union(*[set(df.index) for df in l_df]))
+    l_cols = sorted(set().union(*[set(df.columns) for df in l_df]))
+    na_rtn = full((len(l_df), len(l_states), len(l_cols)), nan)
+    for i_table, df in enumerate(l_df):
+        na_rtn[i_table] = df.reindex(index=l_states, columns=l_cols).values
+    # the None action is saved without a name, in any column
+    l_actions = [None if s_key.startswith('Unnamed: ') else s_key
+                 for s_key in l_cols]
+    return l_states, l_actions, na_rtn
+
+
+def format_seconds(f_seconds):
+    '''
+    Return the seconds passed as H:MM:SS
+    :param f_seconds: float. Number of seconds
+    '''
+    i_min, i_sec = divmod(int(max(f_seconds, 0)), 60)
+    i_hour, i_min = divmod(i_min, 60)
+    return '{}:{:02d}:{:02d}'.format(i_hour, i_min, i_sec)
+
 
 '''
 End help functions
 '''
 
 
+class ProgressReport(object):
+    '''
+    Report the throughput of a simulation and an estimate of the time to
+    finish it. The clock is checked just every CHECK_EVERY rows and a report
+    is written at most once by interval
+    '''
+    CHECK_EVERY = 256
+    # market hours used to estimate the progress of a session, in seconds
+    MARKET_CLOSE = 16*60**2 + 30 * 60
+
+    def __init__(self, s_caller, n_trials, n_sessions, f_interval=1.,
+                 s_fname=None, b_write=True, metrics=None):
+        '''
+        Initiate a ProgressReport object. Save all parameters as attributes
+        :param s_caller: string. The method that runs the simulation
+        :param n_trials: integer. Iterations over the same files
+        :param n_sessions: integer. Number of files to read by trial
+        :*param f_interval: float. Minimum seconds between reports
+        :*param s_fname: string. File where to append the reports as JSON
+            lines. Write them to stderr if None
+        :*param b_write: boolean. If should write the reports to the sink
+        :*param metrics: MetricsFile object. Also export each report there
+        '''
+        self.s_caller = s_caller
+        self.n_trials = n_trials
+        self.n_sessions = n_sessions
+        self.f_interval = f_interval
+        self.s_fname = s_fname
+        self.b_write = b_write
+        self.metrics = metrics
+        self.f_run_start = time.time()
+        self.f_trial_start = self.f_run_start
+        self.f_session_start = self.f_run_start
+        self.f_last_report = self.f_run_start
+        self.i_trial = 0
+        self.i_session = 0
+        self.f_first_date = None
+
+    def start_trial(self, i_trial):
+        '''
+        Mark the start of a trial
+        :param i_trial: integer. The index of the trial, starting at 0
+        '''
+        self.i_trial = i_trial
+        self.f_trial_start = time.time()
+
+    def start_session(self, i_session):
+        '''
+        Mark the start of a session
+        :param i_session: integer. The index of the session, starting at 0
+        '''
+        self.i_session = i_session
+        self.f_session_start = time.time()
+        self.f_first_date = None
+
+    def check(self, env):
+        '''
+        Write a report if the interval has elapsed since the last one. It is
+        cheap to call it on every row
+        :param env: Environment object. The environment simulated
+        '''
+        if env.t % self.CHECK_EVERY != 0:
+            return
+        my_ordmatch = env.order_matching
+        if self.f_first_date is None:
+            self.f_first_date = my_ordmatch.last_date
+        f_now = time.time()
+        if f_now - self.f_last_report < self.f_interval:
+            return
+        self.f_last_report = f_now
+        d_report = self.get_report(env, f_now)
+        if self.b_write:
+            self.write(d_report)
+        if self.metrics:
+            self.metrics.set_simulation(env, d_report)
+            self.metrics.write()
+
+    def get_report(self, env, f_now):
+        '''
+        Return a dictionary with the progress of the simulation
+        :param env: Environment object. The environment simulated
+        :param f_now: float. The current time
+        '''
+        my_ordmatch = env.order_matching
+        f_elapsed = max(f_now - self.f_session_start, 1e-9)
+        # progress of the session measured by the market time
+        f_len = self.MARKET_CLOSE - self.f_first_date
+        f_frac = 0.
+        if f_len > 0:
+            f_frac = (my_ordmatch.last_date - self.f_first_date) * 1. / f_len
+            f_frac = min(max(f_frac, 0.), 1.)
+        f_trial_done = (self.i_session + f_frac) / self.n_sessions
+        f_run_done = (self.i_trial + f_trial_done) / self.n_trials
+        f_eta_trial = f_eta_run = float('nan')
+        if f_trial_done > 0:
+            f_aux = f_now - self.f_trial_start
+            f_eta_trial = f_aux / f_trial_done * (1. - f_trial_done)
+        if f_run_done > 0:
+            f_aux = f_now - self.f_run_start
+            f_eta_run = f_aux / f_run_done * (1. - f_run_done)
+        return {'caller': self.s_caller,
+                'trial': self.i_trial + 1,
+                'n_trials': self.n_trials,
+                'session': self.i_session + 1,
+                'n_sessions': self.n_sessions,
+                'rows': env.t,
+                'market_time': format_seconds(my_ordmatch.last_date),
+                'rows_per_sec': env.t / f_elapsed,
+                'decisions_per_sec': env.i_decisions / f_elapsed,
+                'eta_trial': f_eta_trial,
+                'eta_run': f_eta_run}
+
+    def write(self, d_report):
+        '''
+        Write the report to the sink of the object
+        :param d_report: dictionary. Returned by get_report()
+        '''
+        if self.s_fname:
+            with open(self.s_fname, 'a') as fw:
+                fw.write(json.dumps(d_report) + '\n')
+            return
+        s_msg = '{caller}: trial {trial}/{n_trials}, session {session}/'
+        s_msg += '{n_sessions}, {rows:,d} rows, market time {market_time}, '
+        s_msg += '{rows_per_sec:,.0f} rows/s, {decisions_per_sec:,.0f} '
+        s_msg += 'decisions/s, ETA trial {s_eta_trial}, ETA run {s_eta_run}\n'
+        d_aux = dict(d_report)
+        for s_key in ['eta_trial', 'eta_run']:
+            f_aux = d_report[s_key]
+            # NaN while there is no progress to estimate from
+            d_aux['s_' + s_key] = '-'
+            if f_aux == f_aux:
+                d_aux['s_' + s_key] = format_seconds(f_aux)
+        sys.stderr.write(s_msg.format(**d_aux))
+
+
 class Simulator(object):
     """
     Simulates agents in a dynamic order book environment.
     """
-    def __init__(self, env, update_delay=1.0, display=True):
+    def __init__(self, env, update_delay=1.0, display=True, b_progress=True,
+                 s_progress_fname=None, s_metrics_fname=None,
+                 s_checkpoint=None, i_checkpoint_every=100000):
         '''
         Initiate a Simulator object. Save all parameters as attributes
         Environment Object. The Environment where the agent acts
         :*param update_delay: Float. Seconds elapsed to print out the book
         :*param display: Boolean. If should open a visualizer
+        :*param b_progress: Boolean. If should report the throughput and ETA
+            every update_delay seconds
+        :*param s_progress_fname: string. File where to append the reports.
+            They are written to stderr if None
+        :*param s_metrics_fname: string. File rewritten every update_delay
+            seconds with metrics in the Prometheus text format
+        :*param s_checkpoint: string. File where the state of the simulation
+            is saved, to be resumed by train() and test(). Not saved if None
+        :*param i_checkpoint_every: integer. Steps of the environment between
+            two checkpoints. They are also saved at the end of each session
         '''
         self.env = env
 
@@ -55,39 +265,140 @@ class Simulator(object):
         self.update_delay = update_delay
 
         self.display = display
+        self.b_progress = b_progress
+        self.s_progress_fname = s_progress_fname
+        self.metrics = None
+        if s_metrics_fname:
+            self.metrics = MetricsFile(s_metrics_fname)
+        self.progress = None
+        self.checkpoint = None
+        if s_checkpoint:
+            self.checkpoint = Checkpoint(s_checkpoint, i_checkpoint_every)
 
-    def train(self, n_trials=1, n_sessions=1):
+    def _resume(self, s_caller, n_trials, n_sessions):
+        '''
+        Restore the environment from the checkpoint, if there is one, and
+        return the trial and the session where the simulation stopped and if
+        that session was already started
+        :param s_caller: string. The method that runs the simulation
+        :param n_trials: integer. Iterations over the same files
+        :param n_sessions: integer. Number of files to read by trial
+        '''
+        if not self.checkpoint or not self.checkpoint.exists():
+            return 0, 0, False
+        d_position = self.checkpoint.load(self.env, s_caller, n_trials,
+                                          n_sessions)
+        s_msg = '{}: Resuming from the trial {}, session {}'
+        s_msg = s_msg.format(s_caller, d_position['trial'] + 1,
+                             d_position['session'] + 1)
+        if DEBUG:
+            logging.info(s_msg)
+        else:
+            print(s_msg)
+        return (d_position['trial'], d_position['session'],
+                d_position['in_session'])
+
+    def _save_checkpoint(self, s_caller, i_trial, i_sess, n_trials,
+                         n_sessions, b_in_session=True):
+        '''
+        Save the checkpoint of the simulation, if it is enabled. A session
+        that just ended is saved as the start of the next one
+        :param s_caller: string. The method that runs the simulation
+        :param i_trial: integer. The current trial
+        :param i_sess: integer. The current session
+        :param n_trials: integer. Iterations over the same files
+        :param n_sessions: integer. Number of files to read by trial
+        :*param b_in_session: boolean. If the session is in the middle
+        '''
+        if not self.checkpoint:
+            return
+        if not b_in_session:
+            i_sess += 1
+            if i_sess == n_sessions:
+                i_trial += 1
+                i_sess = 0
+        self.checkpoint.save(self.env, {'caller': s_caller,
+                                        'trial': i_trial,
+                                        'session': i_sess,
+                                        'n_trials': n_trials,
+                                        'n_sessions': n_sessions,
+                                        'in_session': b_in_session})
+
+    def _start_progress(self, s_caller, n_trials, n_sessions):
+        '''
+        Create the progress report of a simulation, if it is enabled
+        :param s_caller: string. The method that runs the simulation
+        :param n_trials: integer. Iterations over the same files
+        :param n_sessions: integer. Number of files to read by trial
+        '''
+        self.progress = None
+        if self.b_progress or self.metrics:
+            self.progress = ProgressReport(s_caller, n_trials, n_sessions,
+                                           f_interval=self.update_delay,
+                                           s_fname=self.s_progress_fname,
+                                           b_write=self.b_progress,
+                                           metrics=self.metrics)
+        return self.progress
+
+    def log_stage_timers(self, s_caller):
+        '''
+        Log the time spent by each stage in the session just ended. Do nothing
+        if the timers are disabled
+        :param s_caller: string. The method that ran the session
+        '''
+        if not instrument.ENABLED:
+            return
+        s_title = '{}: Stage timers of the session'.format(s_caller)
+        instrument.STATS.log_report(s_title)
+
+    def train(self, n_trials=1, n_sessions=1, b_save_qtable=True,
+              b_resume=False):
         '''
         Run the simulation to train the algorithm
         :*param n_sessions: integer. Number of files to read
         :*param n_trials: integer. Iterations over the same files
+        :*param b_save_qtable: boolean. If should save the Q-table each trial
+        :*param b_resume: boolean. If should continue from the checkpoint
         '''
+        s_caller = 'Simulator.train()'
         n_sessions = min(n_sessions, self.env.order_matching.max_nfiles)
-
-        for trial in range(n_trials):
-            # reset the order matching to the initial point
-            self.env.reset_order_matching_idx()
-            for i_sess in range(n_sessions):
+        progress = self._start_progress(s_caller, n_trials, n_sessions)
+        i_trial0, i_sess0, b_in_session = 0, 0, False
+        if b_resume:
+            i_trial0, i_sess0, b_in_session = self._resume(
+                s_caller, n_trials, n_sessions)
+        for trial in range(i_trial0, n_trials):
+            if progress:
+                progress.start_trial(trial)
+            # reset the order matching to the initial point, unless resuming
+            # a trial already started
+            if trial > i_trial0 or (i_sess0 == 0 and not b_in_session):
+                self.env.reset_order_matching_idx()
+            for i_sess in range(i_sess0 if trial == i_trial0 else 0,
+                                n_sessions):
                 self.quit = False
                 # [debug]
                 # print 'Simulator.run(): Trial {}'.format(trial + 1)
-                self.env.reset()
+                if not b_in_session:
+                    self.env.reset()
+                b_in_session = False
                 self.current_time = 0.0
                 self.last_updated = 0.0
                 self.start_time = time.time()
+                instrument.STATS.reset()
+                if progress:
+                    progress.start_session(i_sess)
                 # iterate over the current dataset
                 while True:
                     try:
-                        # Update current time
-                        self.current_time = time.time() - self.start_time
                         # Update environment
-                        f_time_step = self.current_time - self.last_updated
                         l_msg = self.env.step()
-                        # print information to be used by a visualization
-                        if f_time_step >= self.update_delay:
-                            # TODO: Print out the scenario to be visualized
-                            pass
-                            self.last_updated = self.current_time
+                        # report the throughput from time to time
+                        if progress:
+                            progress.check(self.env)
+                        if self.checkpoint and self.checkpoint.step():
+                            self._save_checkpoint(s_caller, trial, i_sess,
+                                                  n_trials, n_sessions)
                     except StopIteration:
                         self.quit = True
                     except KeyboardInterrupt:
@@ -95,50 +406,82 @@ class Simulator(object):
                     finally:
                         if self.quit or self.env.done:
                             break
+                self.log_stage_timers(s_caller)
                 # save the current Q-table
-                save_q_table(self.env, trial+1)
+                if b_save_qtable:
+                    save_q_table(self.env, trial+1)
+                self._save_checkpoint(s_caller, trial, i_sess, n_trials,
+                                      n_sessions, b_in_session=False)
                 # if self.quit:
                 #     break
             # log the end of the trial
             self.env.log_trial()
+        # the run is complete
+        if self.checkpoint:
+            self.checkpoint.remove()
 
-    def test(self, s_qtable, n_trials=1, n_sessions=1, i_idx=None):
+    def test(self, s_qtable, n_trials=1, n_sessions=1, i_idx=None,
+             b_resume=False, d_pnl=None):
         '''
         Run the simulation to test the policy learned
         :param s_qtable: string. path to the qtable to be used
         :*param n_sessions: integer. Number of files to read
         :*param n_trials: integer. Iterations over the same files
         :*param i_idx: integer. start file of the envioronment
+        :*param b_resume: boolean. If should continue from the checkpoint
+        :*param d_pnl: dictionary. Where to save the PnL of the primary agent
+            every time the market time changes, by date, as batch_test()
         '''
+        s_caller = 'Simulator.test()'
         n_sessions = min(n_sessions, self.env.order_matching.max_nfiles)
         agent = self.env.primary_agent
         if agent.s_agent_name != 'BasicAgent':
             agent.set_qtable(s_qtable)
 
-        for trial in range(n_trials):
-            # reset the order matching to the initial point
-            self.env.reset_order_matching_idx(i_idx=i_idx)
-            for i_sess in range(n_sessions):
+        progress = self._start_progress(s_caller, n_trials, n_sessions)
+        i_trial0, i_sess0, b_in_session = 0, 0, False
+        if b_resume:
+            i_trial0, i_sess0, b_in_session = self._resume(
+                s_caller, n_trials, n_sessions)
+        for trial in range(i_trial0, n_trials):
+            if progress:
+                progress.start_trial(trial)
+            # reset the order matching to the initial point, unless resuming
+            # a trial already started
+            if trial > i_trial0 or (i_sess0 == 0 and not b_in_session):
+                self.env.reset_order_matching_idx(i_idx=i_idx)
+            for i_sess in range(i_sess0 if trial == i_trial0 else 0,
+                                n_sessions):
                 self.quit = False
                 # [debug]
                 # print 'Simulator.run(): Trial {}'.format(trial + 1)
-                self.env.reset()
+                if not b_in_session:
+                    self.env.reset()
+                b_in_session = False
                 self.current_time = 0.0
                 self.last_updated = 0.0
                 self.start_time = time.time()
+                i_last_date = None
+                instrument.STATS.reset()
+                if progress:
+                    progress.start_session(i_sess)
                 # iterate over the current dataset
                 while True:
                     try:
-                        # Update current time
-                        self.current_time = time.time() - self.start_time
                         # Update environment
-                        f_time_step = self.current_time - self.last_updated
                         l_msg = self.env.step()
-                        # print information to be used by a visualization
-                        if f_time_step >= self.update_delay:
-                            # TODO: Print out the scenario to be visualized
-                            pass
-                            self.last_updated = self.current_time
+                        # report the throughput from time to time
+                        if progress:
+                            progress.check(self.env)
+                        my_ordmatch = self.env.order_matching
+                        if d_pnl is not None and \
+                           my_ordmatch.last_date != i_last_date:
+                            i_last_date = my_ordmatch.last_date
+                            s_date = my_ordmatch.row['Date']
+                            d_pnl[s_date] = self.env.agent_states[agent]['Pnl']
+                        if self.checkpoint and self.checkpoint.step():
+                            self._save_checkpoint(s_caller, trial, i_sess,
+                                                  n_trials, n_sessions)
                     except StopIteration:
                         self.quit = True
                     except KeyboardInterrupt:
@@ -146,8 +489,109 @@ class Simulator(object):
                     finally:
                         if self.quit or self.env.done:
                             break
+                self.log_stage_timers(s_caller)
+                self._save_checkpoint(s_caller, trial, i_sess, n_trials,
+                                      n_sessions, b_in_session=False)
             # log the end of the trial
             self.env.log_trial()
+        # the run is complete
+        if self.checkpoint:
+            self.checkpoint.remove()
+
+    def batch_test(self, l_qtables, n_sessions=1, i_idx=None):
+        '''
+        Run the simulation once to test many policies learned at the same time.
+        Each qtable is loaded in one of the replicas of a VecEnvironment, that
+        trades in lock-step with the others. Return a dataframe with the PnL
+        of each policy, sampled every time the market time changes. It is an
+        approximation of test(): the orders of the replicas never reach the
+        book and are filled when the market trades through or crosses them,
+        so the PnL differs from a test() of each qtable alone (as done by
+        backtest.record_test_pnl())
+        :param l_qtables: list. paths to the qtables to be used
+        :*param n_sessions: integer. Number of files to read
+        :*param i_idx: integer. start file of the envioronment
+        '''
+        n_sessions = min(n_sessions, self.env.order_matching.max_nfiles)
+        l_agents = self.env.get_learning_agents()
+        s_err = 'The environment should have one replica by qtable'
+        assert len(l_agents) == len(l_qtables), s_err
+        # load all qtables in one array and distribute them to the agents
+        l_states, l_actions, na_qtables = load_qtables(l_qtables)
+        for agent, s_qtable, na_values in zip(l_agents, l_qtables, na_qtables):
+            agent.set_qtable_values(l_states=l_states,
+                                    l_actions=l_actions,
+                                    na_values=na_values,
+                                    s_fname=s_qtable)
+        d_pnl = dict((s_qtable, {}) for s_qtable in l_qtables)
+        progress = self._start_progress('Simulator.batch_test()', 1,
+                                        n_sessions)
+        # reset the order matching to the initial point
+        self.env.reset_order_matching_idx(i_idx=i_idx)
+        for i_sess in range(n_sessions):
+            self.quit = False
+            self.env.reset()
+            i_last_date = None
+            instrument.STATS.reset()
+            if progress:
+                progress.start_session(i_sess)
+            # iterate over the current dataset
+            while True:
+                try:
+                    self.env.step()
+                    if progress:
+                        progress.check(self.env)
+                    # sample the pnl of each policy when the time changes
+                    my_ordmatch = self.env.order_matching
+                    if my_ordmatch.last_date != i_last_date:
+                        i_last_date = my_ordmatch.last_date
+                        s_date = my_ordmatch.row['Date']
+                        for agent, s_qtable in zip(l_agents, l_qtables):
+                            f_pnl = self.env.agent_states[agent]['Pnl']
+                            d_pnl[s_qtable][s_date] = f_pnl
+                except StopIteration:
+                    self.quit = True
+                except KeyboardInterrupt:
+                    self.quit = True
+                finally:
+                    if self.quit or self.env.done:
+                        break
+            self.log_stage_timers('Simulator.batch_test()')
+        # log the end of the trial
+        self.env.log_trial()
+        from pandas import DataFrame
+        return DataFrame(d_pnl)
+
+    def batch_in_sample_test(self, n_trials=1, n_sessions=1):
+        '''
+        Test the performance of the different policies learned after each trial
+        replaying the datset used to create them just once. The environment
+        should be a VecEnvironment with n_trials replicas. The PnL is the
+        approximation of batch_test()
+        :*param n_sessions: integer. Number of files to read
+        :*param n_trials: integer. Iterations over the same files
+        '''
+        agent = self.env.get_learning_agents()[0]
+        l_qtables = []
+        for trial in range(n_trials):
+            s_qtable = 'log/qtable/{}_qtable_{}.log'
+            s_qtable = s_qtable.format(agent.s_agent_name, trial+1)
+            l_qtables.append(s_qtable)
+        return self.batch_test(l_qtables=l_qtables, n_sessions=n_sessions)
+
+    def batch_out_of_sample(self, l_qtables, n_start, n_sessions=1):
+        '''
+        Test the performance of many policies starting on the files index
+        passed as parameter, replaying the files just once. The environment
+        should be a VecEnvironment with one replica by qtable. Return a
+        dataframe with the PnL of each policy, the approximation of
+        batch_test()
+        :param l_qtables: list. paths to the qtables to be used
+        :param n_start: integer. start file to use in simulation
+        :*param n_sessions: integer. Number of files to read
+        '''
+        return self.batch_test(l_qtables=l_qtables, n_sessions=n_sessions,
+                               i_idx=n_start)
 
     def in_sample_test(self, n_trials=1, n_sessions=1):
         '''
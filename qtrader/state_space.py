@@ -0,0 +1,202 @@
+from ast import literal_eval
+
+from numpy import (arange, array, broadcast_to, full, nan, isnan, inf, where,
+                   sign, int64)
+
+
+'''
+Begin help functions
+'''
+
+# all actions, in the same order of Environment.valid_actions
+ACTIONS = [None, 'BEST_BID', 'BEST_OFFER', 'BEST_BOTH', 'SELL', 'BUY']
+# the sets of actions allowed to the agent, depending on its position
+ACTIONS_TO_OPEN = [None, 'BEST_BID', 'BEST_OFFER', 'BEST_BOTH']
+ACTIONS_TO_CLOSE_WHEN_SHORT = [None, 'BEST_BID']
+ACTIONS_TO_CLOSE_WHEN_LONG = [None, 'BEST_OFFER']
+ACTIONS_TO_STOP_WHEN_SHORT = [None, 'BEST_BID', 'BUY']
+ACTIONS_TO_STOP_WHEN_LONG = [None, 'BEST_OFFER', 'SELL']
+VALID_ACTION_SETS = [ACTIONS_TO_OPEN,
+                     ACTIONS_TO_CLOSE_WHEN_SHORT,
+                     ACTIONS_TO_CLOSE_WHEN_LONG,
+                     ACTIONS_TO_STOP_WHEN_SHORT,
+                     ACTIONS_TO_STOP_WHEN_LONG]
+D_VALID_SET_INDEX = dict((tuple(l_valid), i_set)
+                         for i_set, l_valid in enumerate(VALID_ACTION_SETS))
+# number of states by cluster: 3 positions x has bid x has offer
+N_SUBSTATES = 12
+
+
+def get_action_index(s_action):
+    '''
+    Return the column of the action in the dense Q-table
+    :param s_action: string. The action taken
+    '''
+    return ACTIONS.index(s_action)
+
+
+def get_valid_set_index(valid_actions):
+    '''
+    Return the index in VALID_ACTION_SETS of the list of actions passed
+    :param valid_actions: list. List of the allowed actions
+    '''
+    return D_VALID_SET_INDEX[tuple(valid_actions)]
+
+
+def get_valid_set_id(f_pos, f_delta_pnl, f_max_pos=100.):
+    '''
+    Return the index in VALID_ACTION_SETS of the actions allowed to the agent.
+    Mirror the rules applied by BasicAgent._take_action()
+    :param f_pos: float. The current position of the agent
+    :param f_delta_pnl: float. Drawdown from the maximum PnL of the position
+    :*param f_max_pos: float. The maximum position allowed
+    '''
+    b_stop = abs(f_delta_pnl) >= (4.-1e-6)
+    if f_pos <= (f_max_pos * -1):
+        return 3 if b_stop else 1
+    elif f_pos >= f_max_pos:
+        return 4 if b_stop else 2
+    return 0
+
+
+def state_to_index(d_state):
+    '''
+    Return the row of the state in the dense Q-table
+    :param d_state: dictionary. The intern state of the agent
+    '''
+    i_pos = int(sign(d_state['Position'])) + 1
+    i_idx = d_state['cluster'] * N_SUBSTATES + i_pos * 4
+    i_idx += int(d_state['best_bid']) * 2 + int(d_state['best_offer'])
+    return i_idx
+
+
+def index_to_state(i_idx, f_max_pos=100.):
+    '''
+    Return the intern state of the agent related to a row of the dense
+    Q-table, in the same key order used by BasicAgent._get_intern_state()
+    :param i_idx: integer. The row of the dense Q-table
+    :*param f_max_pos: float. The maximum position allowed
+    '''
+    i_cluster, i_aux = divmod(int(i_idx), N_SUBSTATES)
+    i_pos, i_aux = divmod(i_aux, 4)
+    d_rtn = {}
+    d_rtn['cluster'] = i_cluster
+    d_rtn['Position'] = (i_pos - 1) * f_max_pos
+    d_rtn['best_bid'] = bool(i_aux // 2)
+    d_rtn['best_offer'] = bool(i_aux % 2)
+    return d_rtn
+
+
+def parse_state(s_state):
+    '''
+    Return the intern state dictionary from the string used as key in the
+    Q-tables
+    :param s_state: string. The key of the state in the Q-table
+    '''
+    return literal_eval(s_state)
+
+
+def qtable_to_array(q_table, n_clusters=None):
+    '''
+    Return a dense array with shape (n_states, n_actions) from a Q-table keyed
+    by the string representation of the states. NaN where it has no value
+    :param q_table: dictionary. Q-values by state and action
+    :*param n_clusters: integer. Number of clusters. Infer from q_table if None
+    '''
+    l_aux = []
+    for s_state, d_actions in q_table.items():
+        d_state = parse_state(s_state)
+        # skip keys that are not states, as the 'None' of the first update
+        if not isinstance(d_state, dict):
+            continue
+        l_aux.append((state_to_index(d_state), d_actions))
+    if not n_clusters:
+        n_clusters = max([i_idx for i_idx, d in l_aux] + [0])
+        n_clusters = n_clusters // N_SUBSTATES + 1
+    na_rtn = full((n_clusters * N_SUBSTATES, len(ACTIONS)), nan)
+    for i_idx, d_actions in l_aux:
+        for s_action, f_val in d_actions.items():
+            if f_val is None or isnan(f_val):
+                continue
+            na_rtn[i_idx, get_action_index(s_action)] = f_val
+    return na_rtn
+
+
+def array_to_qtable(na_qtable, f_max_pos=100.):
+    '''
+    Return a Q-table keyed by the string representation of the states from a
+    dense array with shape (n_states, n_actions)
+    :param na_qtable: numpy array. Q-values. NaN where it was not observed
+    :*param f_max_pos: float. The maximum position allowed
+    '''
+    d_rtn = {}
+    for i_idx, na_row in enumerate(na_qtable):
+        if isnan(na_row).all():
+            continue
+        s_state = str(index_to_state(i_idx, f_max_pos))
+        d_rtn[s_state] = dict((s_action, float(f_val))
+                              for s_action, f_val in zip(ACTIONS, na_row)
+                              if not isnan(f_val))
+    return d_rtn
+
+
+def qtable_to_ranks(q_table, n_states):
+    '''
+    Return an array with shape (n_states, n_actions) with the position of
+    each action in the dictionary of its state in the Q-table. A frozen
+    LearningAgent_k looks at the actions in this order and keeps the first of
+    the ones tied with the best value. len(ACTIONS) where there is no action
+    :param q_table: dictionary. Q-values by state and action
+    :param n_states: integer. Number of rows of the dense Q-table
+    '''
+    na_rtn = full((n_states, len(ACTIONS)), len(ACTIONS), int64)
+    for s_state, d_actions in q_table.items():
+        d_state = parse_state(s_state)
+        if not isinstance(d_state, dict):
+            continue
+        i_idx = state_to_index(d_state)
+        if i_idx >= n_states:
+            continue
+        for i_rank, s_action in enumerate(d_actions):
+            na_rtn[i_idx, get_action_index(s_action)] = i_rank
+    return na_rtn
+
+
+def compile_frozen_policy(na_qtable, na_ranks=None):
+    '''
+    Return the action index that a frozen LearningAgent_k takes in each state
+    for each set of valid actions. Accept stacks of Q-tables, so an array with
+    shape (..., n_states, n_actions) becomes (..., n_states, n_valid_sets)
+    :param na_qtable: numpy array. Q-values. NaN where it was not observed
+    :*param na_ranks: numpy array. The order the ties are broken, as
+        qtable_to_ranks(), with the same shape of na_qtable. The order of
+        ACTIONS if None
+    '''
+    na_qtable = array(na_qtable, dtype=float)
+    if na_ranks is None:
+        na_ranks = broadcast_to(arange(len(ACTIONS)), na_qtable.shape)
+    na_rtn = full(na_qtable.shape[:-1] + (len(VALID_ACTION_SETS),), 0, int64)
+    for i_set, l_valid in enumerate(VALID_ACTION_SETS):
+        # the stop actions are forced to be the last desired
+        na_mask = array([s_action in l_valid and s_action not in ['BUY', 'SELL']
+                         for s_action in ACTIONS])
+        na_val = where(na_mask & ~isnan(na_qtable), na_qtable, -inf)
+        # when no action is good enough, close out the position (or do
+        # nothing), as done when the state was not observed previously
+        i_default = get_action_index(None)
+        if 'BUY' in l_valid:
+            i_default = get_action_index('BUY')
+        elif 'SELL' in l_valid:
+            i_default = get_action_index('SELL')
+        # the first action of the Q-table among the tied with the best value
+        na_max = na_val.max(axis=-1)
+        na_tied = where(na_val == na_max[..., None], na_ranks, len(ACTIONS) + 1)
+        na_rtn[..., i_set] = where(na_max > 0.01,
+                                   na_tied.argmin(axis=-1),
+                                   i_default)
+    return na_rtn
+
+
+'''
+End help functions
+'''
@@ -0,0 +1,197 @@
+from datetime import date, timedelta
+from io import TextIOWrapper
+import logging
+from sys import argv
+import time
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from numpy import exp, sqrt
+from numpy.random import RandomState
+
+import async_logging
+
+
+DEBUG = True
+
+'''
+Begin help functions
+'''
+
+
+class InvalidOptionException(Exception):
+    """
+    InvalidOptionException is raised when the generator is called without the
+    output file
+    """
+    pass
+
+
+# trading session, in seconds since midnight
+SESSION_START = 10 * 3600
+SESSION_END = 17 * 3600
+TICK = 0.01
+LOT = 100
+
+
+def format_time(s_day, i_seconds):
+    '''
+    Return the timestamp in the format read by BloombergMatching.next()
+    :param s_day: string. The day, as YYYY-MM-DD
+    :param i_seconds: integer. Seconds since midnight
+    '''
+    i_hour, i_aux = divmod(int(i_seconds), 3600)
+    i_min, i_sec = divmod(i_aux, 60)
+    return '{} {:02d}:{:02d}:{:02d}'.format(s_day, i_hour, i_min, i_sec)
+
+
+def generate_day(s_day, i_rows=50000, f_price=50., f_vol=0.02,
+                 f_trade_rate=0.2, f_churn=0.3, i_max_lots=20,
+                 random_state=None):
+    '''
+    Return the rows of a day of Level I data as (Date, Type, Price, Size).
+    The mid-price follows a geometric random walk and each BID or ASK row
+    either changes the size of the best price or moves it towards the
+    mid-price. TRADE rows hit the best bid or the best offer without exceeding
+    the quantity of the level, as expected by translate_trades()
+    :param s_day: string. The day, as YYYY-MM-DD
+    :*param i_rows: integer. Number of rows of the day
+    :*param f_price: float. The mid-price at the opening
+    :*param f_vol: float. Daily volatility of the mid-price
+    :*param f_trade_rate: float. Probability of a row being a trade
+    :*param f_churn: float. Probability of a quote moving its price level
+    :*param i_max_lots: integer. Maximum quantity of a level, in lots
+    :*param random_state: RandomState object. The source of randomness
+    '''
+    if random_state is None:
+        random_state = RandomState()
+    # draw everything at once and just walk through the arrays
+    na_ret = random_state.normal(0., f_vol / sqrt(i_rows), i_rows)
+    na_type = random_state.random_sample(i_rows)
+    na_side = random_state.random_sample(i_rows) < 0.5
+    na_move = random_state.random_sample(i_rows) < f_churn
+    na_lots = random_state.randint(1, i_max_lots + 1, i_rows)
+    na_time = SESSION_START + (SESSION_END - SESSION_START) * (
+        random_state.random_sample(i_rows))
+    na_time.sort()
+    # open the book with one level by side
+    f_mid = f_price
+    i_bid = int(round(f_mid / TICK)) - 1
+    i_ask = i_bid + 2
+    i_qbid = i_max_lots // 2 * LOT
+    i_qask = i_max_lots // 2 * LOT
+    s_time = format_time(s_day, na_time[0])
+    l_rtn = [(s_time, 'BID', i_bid, i_qbid), (s_time, 'ASK', i_ask, i_qask)]
+    for i_row in range(2, i_rows):
+        f_mid *= exp(na_ret[i_row])
+        i_mid = f_mid / TICK
+        s_time = format_time(s_day, na_time[i_row])
+        b_bid = na_side[i_row]
+        if na_type[i_row] < f_trade_rate:
+            # a trade can not consume the whole level. Otherwise, the book
+            # would be left without one of the sides
+            i_qlevel = i_qbid if b_bid else i_qask
+            i_qty = min(na_lots[i_row], i_qlevel // LOT - 1) * LOT
+            if i_qty <= 0:
+                continue
+            if b_bid:
+                i_qbid -= i_qty
+                l_rtn.append((s_time, 'TRADE', i_bid, i_qty))
+            else:
+                i_qask -= i_qty
+                l_rtn.append((s_time, 'TRADE', i_ask, i_qty))
+            continue
+        i_qty = na_lots[i_row] * LOT
+        if b_bid:
+            if na_move[i_row]:
+                # move one tick towards the mid-price, keeping the spread open
+                if i_bid + 1 < min(i_mid, i_ask):
+                    i_bid += 1
+                elif i_bid > i_mid - 1:
+                    i_bid -= 1
+            i_qbid = i_qty
+            l_rtn.append((s_time, 'BID', i_bid, i_qbid))
+        else:
+            if na_move[i_row]:
+                if i_ask - 1 > max(i_mid, i_bid):
+                    i_ask -= 1
+                elif i_ask < i_mid + 1:
+                    i_ask += 1
+            i_qask = i_qty
+            l_rtn.append((s_time, 'ASK', i_ask, i_qask))
+    return [(s_time, s_type, i_price * TICK, i_qty)
+            for s_time, s_type, i_price, i_qty in l_rtn]
+
+
+def write_day(fw, l_rows):
+    '''
+    Write the rows of a day in the format read by BloombergMatching
+    :param fw: file object. Where to write
+    :param l_rows: list. Rows returned by generate_day()
+    '''
+    fw.write(',Date,Type,Price,Size\n')
+    for i_id, (s_time, s_type, f_price, i_qty) in enumerate(l_rows):
+        fw.write('{},{},{},{:0.2f},{}\n'.format(i_id, s_time, s_type, f_price,
+                                                i_qty))
+
+
+def make_synthetic_zip(s_fname, i_rows=50000, i_days=1, f_price=50.,
+                       f_vol=0.02, f_trade_rate=0.2, f_churn=0.3,
+                       i_max_lots=20, i_seed=None, s_start='2016-07-25'):
+    '''
+    Create a zip file with one file of synthetic Level I data by day, in the
+    format read by BloombergMatching. The same seed produces the same files.
+    Return the path of the zip file
+    :param s_fname: string. Path of the zip file
+    :*param i_rows: integer. Number of rows by day
+    :*param i_days: integer. Number of days (files) to create
+    :*param f_price: float. The mid-price at the opening of the first day
+    :*param f_vol: float. Daily volatility of the mid-price
+    :*param f_trade_rate: float. Probability of a row being a trade
+    :*param f_churn: float. Probability of a quote moving its price level
+    :*param i_max_lots: integer. Maximum quantity of a level, in lots
+    :*param i_seed: integer. Seed of the random numbers
+    :*param s_start: string. The first day, as YYYY-MM-DD
+    '''
+    f_start = time.time()
+    random_state = RandomState(i_seed)
+    dt_day = date(*[int(x) for x in s_start.split('-')])
+    with ZipFile(s_fname, 'w', ZIP_DEFLATED) as archive:
+        for i_day in range(i_days):
+            # skip weekends
+            while dt_day.weekday() >= 5:
+                dt_day += timedelta(days=1)
+            s_day = dt_day.strftime('%Y-%m-%d')
+            l_rows = generate_day(s_day, i_rows=i_rows, f_price=f_price,
+                                  f_vol=f_vol, f_trade_rate=f_trade_rate,
+                                  f_churn=f_churn, i_max_lots=i_max_lots,
+                                  random_state=random_state)
+            # the next day opens at the last price of this one
+            f_price = l_rows[-1][2]
+            s_day = dt_day.strftime('%Y%m%d') + '.csv'
+            with TextIOWrapper(archive.open(s_day, 'w'), 'ascii') as fw:
+                write_day(fw, l_rows)
+            dt_day += timedelta(days=1)
+    s_msg = 'make_synthetic_zip(): {} days of {} rows created in {:0.2f} seconds'
+    s_msg = s_msg.format(i_days, i_rows, time.time() - f_start)
+    if DEBUG:
+        logging.info(s_msg)
+    else:
+        print(s_msg)
+    return s_fname
+
+
+'''
+End help functions
+'''
+
+
+if __name__ == '__main__':
+    if len(argv) < 2:
+        s_err = '\nRun "python qtrader/synthetic_data.py <OUTPUT> [<ROWS>'
+        s_err += ' [<DAYS> [<SEED>]]]" to create a zip file of synthetic data.'
+        raise InvalidOptionException(s_err)
+    l_aux = [int(x) for x in argv[2:5]]
+    d_kwargs = dict(zip(['i_rows', 'i_days', 'i_seed'], l_aux))
+    if DEBUG:
+        async_logging.setup_logging()
+    make_synthetic_zip(argv[1], **d_kwargs)
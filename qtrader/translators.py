@@ -221,7 +221,8 @@ def translate_row(idx, row, my_ordmatch, s_side=None):
     return l_msg
 
 
-def translate_to_agent(agent, s_action, my_ordmatch, f_spread=0.10):
+def translate_to_agent(agent, s_action, my_ordmatch, f_spread=0.10,
+                       order_ids=None):
     '''
     Translate a line from a file of the bloomberg level I data. Is expected
     that the agent has one orders by side, at maximum
@@ -229,9 +230,12 @@ def translate_to_agent(agent, s_action, my_ordmatch, f_spread=0.10):
     :param s_action: string.
     :param my_ordmatch: OrderMatching object.
     :param f_spread: float. Number of cents to include in the price
+    :*param order_ids: object. Its i_last_order_id attribute numbers the new
+        orders. The book of the order matching if None
     '''
     # reconver some variables and check if it is a valid row
-    my_book = my_ordmatch.my_book
+    if order_ids is None:
+        order_ids = my_ordmatch.my_book
     l_msg = []
     # recover the best price from the row side that is not just the primary
     t_best_bid = my_ordmatch.best_bid
@@ -282,9 +286,9 @@ def translate_to_agent(agent, s_action, my_ordmatch, f_spread=0.10):
                 # replace it with a new ID
                 d_rtn = {'agent_id': agent.i_id,
                          'instrumento_symbol': 'PETR4',
-                         'order_id': my_book.i_last_order_id + 1,
+                         'order_id': order_ids.i_last_order_id + 1,
                          'order_entry_step': my_ordmatch.i_nrow,
-                         'new_order_id': my_book.i_last_order_id + 1,
+                         'new_order_id': order_ids.i_last_order_id + 1,
                          'order_price': t_best_bid[0] - f_spread,
                          'order_side': 'BID',
                          'order_status': 'Replaced',
@@ -293,15 +297,15 @@ def translate_to_agent(agent, s_action, my_ordmatch, f_spread=0.10):
                          'agressor_indicator': 'Neutral',
                          'action': s_action,
                          'original_id': -1}
-                my_book.i_last_order_id += 1
+                order_ids.i_last_order_id += 1
                 l_msg.append(d_rtn.copy())
         else:
             # include a new order
             d_rtn = {'agent_id': agent.i_id,
                      'instrumento_symbol': 'PETR4',
-                     'order_id': my_book.i_last_order_id + 1,
+                     'order_id': order_ids.i_last_order_id + 1,
                      'order_entry_step': my_ordmatch.i_nrow,
-                     'new_order_id': my_book.i_last_order_id + 1,
+                     'new_order_id': order_ids.i_last_order_id + 1,
                      'order_price': t_best_bid[0] - f_spread,
                      'order_side': 'BID',
                      'order_status': 'New',
@@ -310,7 +314,7 @@ def translate_to_agent(agent, s_action, my_ordmatch, f_spread=0.10):
                      'agressor_indicator': 'Neutral',
                      'action': s_action,
                      'original_id': -1}
-            my_book.i_last_order_id += 1
+            order_ids.i_last_order_id += 1
             l_msg.append(d_rtn.copy())
     # update when it has a limit order book message related to the ask side
     if s_action in ['BEST_OFFER', 'BEST_BOTH']:
@@ -334,9 +338,9 @@ def translate_to_agent(agent, s_action, my_ordmatch, f_spread=0.10):
                 # replace it with a new ID
                 d_rtn = {'agent_id': agent.i_id,
                          'instrumento_symbol': 'PETR4',
-                         'order_id': my_book.i_last_order_id + 1,
+                         'order_id': order_ids.i_last_order_id + 1,
                          'order_entry_step': my_ordmatch.i_nrow,
-                         'new_order_id': my_book.i_last_order_id + 1,
+                         'new_order_id': order_ids.i_last_order_id + 1,
                          'order_price': t_best_ask[0] + f_spread,
                          'order_side': 'ASK',
                          'order_status': 'Replaced',
@@ -345,15 +349,15 @@ def translate_to_agent(agent, s_action, my_ordmatch, f_spread=0.10):
                          'agressor_indicator': 'Neutral',
                          'action': s_action,
                          'original_id': -1}
-                my_book.i_last_order_id += 1
+                order_ids.i_last_order_id += 1
                 l_msg.append(d_rtn.copy())
         else:
             # include a new order
             d_rtn = {'agent_id': agent.i_id,
                      'instrumento_symbol': 'PETR4',
-                     'order_id': my_book.i_last_order_id + 1,
+                     'order_id': order_ids.i_last_order_id + 1,
                      'order_entry_step': my_ordmatch.i_nrow,
-                     'new_order_id': my_book.i_last_order_id + 1,
+                     'new_order_id': order_ids.i_last_order_id + 1,
                      'order_price': t_best_ask[0] + f_spread,
                      'order_side': 'ASK',
                      'order_status': 'New',
@@ -362,7 +366,7 @@ def translate_to_agent(agent, s_action, my_ordmatch, f_spread=0.10):
                      'agressor_indicator': 'Neutral',
                      'action': s_action,
                      'original_id': -1}
-            my_book.i_last_order_id += 1
+            order_ids.i_last_order_id += 1
             l_msg.append(d_rtn.copy())
 
     return l_msg
@@ -0,0 +1,183 @@
+import logging
+
+from environment import Environment
+
+
+DEBUG = True
+
+'''
+Begin help functions
+'''
+
+
+def make_shadow_fill(order_msg):
+    '''
+    Return a message filling entirely an order that lives just in the memory
+    of a replica agent, in the same format used by the translators
+    :param order_msg: dict. The message that has created the shadow order
+    '''
+    d_rtn = order_msg.copy()
+    i_qty = d_rtn['total_qty_order'] - d_rtn['traded_qty_order']
+    # if one makes a trade at bid, it is a buy
+    s_action = 'BUY'
+    if d_rtn['order_side'] == 'ASK':
+        s_action = 'SELL'
+    d_rtn['order_status'] = 'Filled'
+    d_rtn['traded_qty_order'] = d_rtn['total_qty_order']
+    d_rtn['agressor_indicator'] = 'Passive'
+    d_rtn['order_qty'] = i_qty
+    d_rtn['action'] = s_action
+    return d_rtn
+
+
+class ReplicaOrderIds(object):
+    '''
+    The ids of the shadow orders of a replica. They are numbered apart from
+    the book, so the replicas do not change the ids of the market they shadow
+    '''
+    def __init__(self):
+        '''
+        Initiate a ReplicaOrderIds object
+        '''
+        self.i_last_order_id = 0
+
+
+'''
+End help functions
+'''
+
+
+class VecEnvironment(Environment):
+    '''
+    Environment where many replicas of the primary agent trade on top of a
+    single market book. The replicas never send orders to the book, so all of
+    them see the same market and their fills are resolved against it
+    '''
+
+    def __init__(self, s_fname, i_idx=None, b_debug_obs=False, i_seed=None,
+                 i_stream=0, b_vectorized_rng=True):
+        '''
+        Initialize a VecEnvironment object
+        :param s_fname: string. the container zip file to be used in simulation
+        :*param i_idx: integer. The index of the start file to be read
+        :*param b_debug_obs: boolean. If should check the cached observation
+            against a recomputed one every time it is reused
+        :*param i_seed: integer. Seed of the run. Entropy of the OS if None
+        :*param i_stream: integer. Sub-stream of the run used by this
+            environment
+        :*param b_vectorized_rng: boolean. If the replicas should draw their
+            random numbers in blocks with NumPy
+        '''
+        super(VecEnvironment, self).__init__(s_fname=s_fname, i_idx=i_idx,
+                                             b_debug_obs=b_debug_obs,
+                                             i_seed=i_seed, i_stream=i_stream,
+                                             b_vectorized_rng=b_vectorized_rng)
+        self.l_replicas = []
+        # the ids of the shadow orders, by replica id
+        self.d_order_ids = {}
+
+    def add_replica(self, agent_class, *args, **kwargs):
+        '''
+        Create a new replica of the primary agent and start to track it. Each
+        replica holds its own orders, positions and Q-table
+        :param agent_class: Agent Object. The agent desired
+        :*param args, kwargs: any type. Any other parameter needed by the agent
+        '''
+        agent = self.create_agent(agent_class, *args, **kwargs)
+        self.l_replicas.append(agent)
+        return agent
+
+    def set_primary_agent(self, agent):
+        '''
+        Include an agent already created as a replica
+        :param agent: Agent Object. The agent used as primary
+        '''
+        super(VecEnvironment, self).set_primary_agent(agent)
+        # the replicas should not be seen by the translators as the primary
+        self.primary_agent = None
+        if agent not in self.l_replicas:
+            self.l_replicas.append(agent)
+
+    def get_learning_agents(self):
+        '''
+        Return a list of the agents whose policies are tracked by simulation
+        '''
+        return list(self.l_replicas)
+
+    def get_order_ids(self, agent):
+        '''
+        Return the object that numbers the shadow orders of the replica passed
+        :param agent: Agent object. The replica that sends the orders
+        '''
+        if agent.i_id not in self.d_order_ids:
+            self.d_order_ids[agent.i_id] = ReplicaOrderIds()
+        return self.d_order_ids[agent.i_id]
+
+    def update_primary_agents(self):
+        '''
+        Resolve the shadow orders of the replicas against the current state of
+        the book and update the ones that are allowed to act
+        '''
+        self._fill_shadow_orders()
+        if not self.is_open_to_agents():
+            return
+        for agent in self.l_replicas:
+            if agent.should_update():
+                self.i_decisions += 1
+                self.update_agent_state(agent=agent, msg=None)
+
+    def _fill_shadow_orders(self):
+        '''
+        Fill every order of each replica that was traded through or crossed
+        by the market in the current step, not just the best ones
+        '''
+        my_ordmatch = self.order_matching
+        f_bid = my_ordmatch.best_bid[0]
+        f_ask = my_ordmatch.best_ask[0]
+        f_trade = None
+        if my_ordmatch.row['Type'] == 'TRADE':
+            f_trade = float(my_ordmatch.row['Price'])
+        # a bid is filled when someone sells at its price or below and an
+        # offer when someone buys at its price or above
+        l_sell = [f_price for f_price in [f_ask, f_trade] if f_price]
+        l_buy = [f_price for f_price in [f_bid, f_trade] if f_price]
+        for agent in self.l_replicas:
+            l_fill = []
+            if l_sell:
+                f_sell = min(l_sell)
+                l_fill += [order_msg for f_price, order_msg
+                           in agent.d_order_tree['BID'].items()
+                           if f_price >= f_sell]
+            if l_buy:
+                f_buy = max(l_buy)
+                l_fill += [order_msg for f_price, order_msg
+                           in agent.d_order_tree['ASK'].items()
+                           if f_price <= f_buy]
+            for order_msg in l_fill:
+                # the replica can have changed its orders after a fill
+                if order_msg['order_id'] not in agent.d_order_map:
+                    continue
+                msg = make_shadow_fill(order_msg)
+                self.update_agent_state(agent=agent, msg=msg)
+
+    def update_order_book(self, l_msg):
+        '''
+        Ignore the messages sent by the replicas. Their orders live just in
+        their own memory and are filled by _fill_shadow_orders()
+        :param l_msg: list. messages to use to update the book
+        '''
+        pass
+
+    def log_trial(self):
+        '''
+        Log the end of current trial and the PnL of each replica
+        '''
+        super(VecEnvironment, self).log_trial()
+        if self.count_trials > 1:
+            for agent in self.l_replicas:
+                s_msg = 'VecEnvironment.log_trial(): Agent {} PnL = {:0.2f}'
+                s_msg = s_msg.format(agent, self.agent_states[agent]['Pnl'])
+                if DEBUG:
+                    logging.info(s_msg)
+                else:
+                    print(s_msg)
@@ -0,0 +1,265 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import time
+
+from numpy import array, diff, mean, sqrt, std
+
+import artefacts
+import market_data
+from run_cache import RunCache, get_file_digest, get_run_key, seed_all
+
+
+DEBUG = True
+
+# modules imported by the parent of the workers before they are forked
+PRELOAD_MODULES = ['artefacts', 'market_data', 'agent', 'environment',
+                   'simulator']
+START_METHODS = ['forkserver', 'fork']
+TASK_OPTIONS = ['train', 'test']
+# parameters of the agent when the config does not set them
+DEFAULT_AGENT_KWARGS = {'f_min_time': 2., 'f_k': 0.8, 'f_gamma': 0.5}
+
+
+'''
+Begin help functions
+'''
+
+
+class InvalidOptionException(Exception):
+    """
+    InvalidOptionException is raised when the pool or a task is set with an
+    option that is not known
+    """
+    pass
+
+
+def run_task(s_fname, d_config, i_idx, i_seed, s_cache_dir=None):
+    '''
+    Simulate one day with the agent described by the config and return a
+    dictionary with the results. It is the function run by the workers. When
+    a cache is passed, an identical run is read from it instead
+    :param s_fname: string. the container zip file to be used in simulation
+    :param d_config: dictionary. 'agent' (name of the class in the agent
+        module), 'option' ('train' or 'test'), 'n_trials', 'qtable' (used by
+        the test) and 'agent_kwargs' (DEFAULT_AGENT_KWARGS if not set)
+    :param i_idx: integer. The index of the file (day) to be read
+    :param i_seed: integer. Seed of the random numbers used by the agent
+    :*param s_cache_dir: string. Directory of the RunCache. No cache if None
+    '''
+    import agent
+    from environment import Environment
+    from simulator import Simulator
+    import state_space
+    f_start = time.time()
+    s_option = d_config.get('option', 'train')
+    if s_option not in TASK_OPTIONS:
+        s_err = 'Select an option between: {}'.format(TASK_OPTIONS)
+        raise InvalidOptionException(s_err)
+    cache = None
+    if s_cache_dir:
+        cache = RunCache(s_cache_dir)
+        d_key = {'task': d_config, 'idx': i_idx, 'seed': i_seed}
+        if s_option == 'test':
+            d_key['qtable'] = get_file_digest(d_config['qtable'])
+        s_key = get_run_key(s_fname, d_key)
+        d_hit = cache.get(s_key)
+        if d_hit:
+            d_rtn = d_hit['summary']
+            d_rtn['cached'] = True
+            d_rtn['seconds'] = time.time() - f_start
+            return d_rtn
+    seed_all(i_seed)
+    agent_class = getattr(agent, d_config.get('agent', 'LearningAgent_k'))
+    # each day is a sub-stream of the seed, so the result of a task does not
+    # depend on the worker that runs it or on the tasks run before
+    e = Environment(s_fname=s_fname, i_idx=i_idx, i_seed=i_seed,
+                    i_stream=i_idx)
+    d_kwargs = d_config.get('agent_kwargs', DEFAULT_AGENT_KWARGS)
+    a = e.create_agent(agent_class, **d_kwargs)
+    e.set_primary_agent(a)
+    sim = Simulator(e, update_delay=1.00, display=False, b_progress=False)
+    n_trials = d_config.get('n_trials', 1)
+    try:
+        if s_option == 'train':
+            sim.train(n_trials=n_trials, n_sessions=1, b_save_qtable=False)
+        else:
+            sim.test(d_config['qtable'], n_trials=n_trials, n_sessions=1,
+                     i_idx=i_idx)
+    finally:
+        # the workers exit without collecting the environments left
+        e.order_matching.detach_shared_day()
+    d_rtn = {'config': d_config,
+             'idx': i_idx,
+             'seed': i_seed,
+             'day': e.order_matching.l_fnames[i_idx].filename,
+             'pnl': float(e.agent_states[a]['Pnl']),
+             'reward': float(getattr(a, 'f_total_reward', 0.)),
+             'mean_reward': float(a.f_session_reward /
+                                  max(1, len(a.l_session_pnl))),
+             'sharpe': get_sharpe(a.l_session_pnl),
+             'qtable_states': len(getattr(a, 'q_table', {})),
+             'rows': int(e.order_matching.i_nrow),
+             'seconds': time.time() - f_start,
+             'cached': False}
+    if cache:
+        d_arrays = {'pnl': array(a.l_session_pnl, dtype=float)}
+        if isinstance(getattr(a, 'q_table', None), dict):
+            d_arrays['qtable'] = state_space.qtable_to_array(a.q_table)
+        cache.put(s_key, d_rtn, d_arrays, d_config=d_key)
+    return d_rtn
+
+
+def get_sharpe(l_pnl):
+    '''
+    Return the Sharpe ratio of the PnL path of a session: the mean change of
+    PnL between updates over its standard deviation, scaled by the square
+    root of the number of updates. Zero when the PnL does not change
+    :param l_pnl: list. PnL seen by each update of the agent
+    '''
+    if len(l_pnl) < 2:
+        return 0.
+    na_diff = diff(l_pnl)
+    f_std = std(na_diff)
+    if f_std == 0:
+        return 0.
+    return float(mean(na_diff) / f_std * sqrt(len(na_diff)))
+
+
+def _run_packed_task(t_task):
+    '''
+    Unpack the arguments of run_task(), as the pool passes just one
+    :param t_task: tuple. (s_fname, d_config, i_idx, i_seed, s_cache_dir)
+    '''
+    return run_task(*t_task)
+
+
+'''
+End help functions
+'''
+
+
+class WorkerPool(object):
+    '''
+    A pool of worker processes forked from a parent that already imported
+    the package, loaded the scaler artefacts and decoded the days of the
+    archive, so every worker starts with all of it in copy-on-write memory
+    and runs (config, day, seed) tasks with almost no setup
+    '''
+    def __init__(self, s_fname, l_idx=None, n_workers=None,
+                 s_start_method='forkserver', l_scalers=None,
+                 b_shared_days=False, s_cache_dir=None):
+        '''
+        Initiate a WorkerPool object and start the workers
+        :param s_fname: string. the container zip file to be used in simulation
+        :*param l_idx: list. Index of the files (days) preloaded. All if None
+        :*param n_workers: integer. Worker processes. All cores if None
+        :*param s_start_method: string. 'forkserver' or 'fork'
+        :*param l_scalers: list. Scalers whose artefacts are preloaded
+        :*param b_shared_days: boolean. If the days should be published in
+            shared memory, where any process of the host can attach to them,
+            instead of decoded in the parent
+        :*param s_cache_dir: string. Directory of the RunCache used by the
+            tasks. No cache if None
+        '''
+        if s_start_method not in START_METHODS:
+            s_err = 'Select a start method between: {}'.format(START_METHODS)
+            raise InvalidOptionException(s_err)
+        self.s_fname = s_fname
+        self.s_cache_dir = s_cache_dir
+        self.n_workers = n_workers or multiprocessing.cpu_count()
+        self.s_start_method = s_start_method
+        l_scalers = l_scalers or ['LessClustersScaler']
+        self.l_shared_days = []
+        if b_shared_days:
+            self.l_shared_days = market_data.publish_days(s_fname, l_idx)
+        if s_start_method == 'forkserver':
+            # the server imports market_data with these variables set
+            d_environ = {}
+            if not b_shared_days:
+                d_environ['QTRADER_PRELOAD_ARCHIVE'] = s_fname
+                d_environ['QTRADER_PRELOAD_DAYS'] = ','.join(
+                    str(i_idx) for i_idx in (l_idx or []))
+            ctx = artefacts.get_forkserver_context(
+                l_scalers, PRELOAD_MODULES[1:], d_environ=d_environ)
+        else:
+            for s_module in PRELOAD_MODULES:
+                __import__(s_module)
+            artefacts.prewarm(l_scalers)
+            if not b_shared_days:
+                market_data.preload_days(s_fname, l_idx)
+            ctx = multiprocessing.get_context('fork')
+        self.pool = ctx.Pool(self.n_workers)
+
+    def submit(self, d_config, i_idx, i_seed=0):
+        '''
+        Queue a task and return its AsyncResult
+        :param d_config: dictionary. The agent simulated. See run_task()
+        :param i_idx: integer. The index of the file (day) to be read
+        :*param i_seed: integer. Seed of the random numbers used by the agent
+        '''
+        return self.pool.apply_async(run_task, (self.s_fname, d_config, i_idx,
+                                                i_seed, self.s_cache_dir))
+
+    def map(self, l_tasks):
+        '''
+        Run the tasks passed and yield their results as they finish
+        :param l_tasks: list. (config, day index, seed) of each task
+        '''
+        l_args = [(self.s_fname, d_config, i_idx, i_seed, self.s_cache_dir)
+                  for d_config, i_idx, i_seed in l_tasks]
+        for d_res in self.pool.imap_unordered(_run_packed_task, l_args):
+            yield d_res
+
+    def close(self):
+        '''
+        Wait for the tasks queued and stop the workers
+        '''
+        self.pool.close()
+        self.pool.join()
+        for shared_day in self.l_shared_days:
+            shared_day.detach()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.pool.terminate()
+            for shared_day in self.l_shared_days:
+                shared_day.detach()
+
+
+if __name__ == '__main__':
+    s_txt = 'Train an agent on many (day, seed) pairs in a pool of workers'
+    s_txt += ' forked with the data and the models already loaded'
+    parser = argparse.ArgumentParser(description=s_txt)
+    parser.add_argument('archive', help='zip file with the market data')
+    parser.add_argument('--days', type=int, nargs='+', default=[0],
+                        help='index of the files (days) of the archive')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0])
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--start-method', choices=START_METHODS,
+                        default='forkserver')
+    parser.add_argument('--shared-memory', action='store_true',
+                        help='publish the days in shared memory')
+    parser.add_argument('--cache', default=None,
+                        help='directory of the cache of runs')
+    parser.add_argument('--config', default='{}',
+                        help='JSON with the config of the tasks')
+    args = parser.parse_args()
+    d_config = json.loads(args.config)
+    l_tasks = [(d_config, i_idx, i_seed) for i_idx in args.days
+               for i_seed in args.seeds]
+    logging.disable(logging.INFO)
+    with WorkerPool(args.archive, l_idx=args.days, n_workers=args.workers,
+                    s_start_method=args.start_method,
+                    b_shared_days=args.shared_memory,
+                    s_cache_dir=args.cache) as pool:
+        for d_res in pool.map(l_tasks):
+            s_msg = 'day {idx} seed {seed}: pnl {pnl:0.2f}, {rows} rows in'
+            s_msg += ' {seconds:0.2f} seconds'
+            print(s_msg.format(**d_res))